@@ -1,24 +1,17 @@
 ### game.py is sort of the controller of the IronPython SGF Editor.  The main
 ### class is Game, which provides calls for GUI event handling and makes calls
-### to update the board and moves model.
+### to update the board and moves model.  Game tells the UI about changes
+### through a GameObserver, so this module does not need WPF and runs under
+### plain CPython too, for example in batch jobs or worker processes.
 
-import wpf
-
-### Don't need this now due to new wpf module, but left as documentation of usage.
-###
-### Needed for System.Windows.Media ...
-#clr.AddReference("PresentationCore")
-## Needed for System.Windows
-#clr.AddReference('PresentationFramework')
-
-from System.Windows.Media import Colors
-from System.Windows import MessageBox
+import collections
 
 import goboard
+from goboard import Colors
 import sgfparser
 
-__all__ = ["Game", "create_default_game", "MAX_BOARD_SIZE", "opposite_move_color",
-           "create_parsed_game"]
+__all__ = ["Game", "GameObserver", "create_default_game", "MAX_BOARD_SIZE",
+           "opposite_move_color", "create_parsed_game"]
 
 
 MAX_BOARD_SIZE = 19
@@ -27,13 +20,23 @@ DEFAULT_KOMI = "6.5"
 
 ### The Game class is a controller of sorts for the app.  It provides helper functions
 ### for the UI that event handlers can call.  These functions call on the model,
-### GoBoard, and they call on the UI APIs to update, such as enabling/disabling buttons.
+### GoBoard, and they call on the observer to update the UI, such as
+### enabling/disabling buttons (see GameObserver).
 ###
 class Game (object):
 
-    def __init__ (self, main_win, size, handicap, komi, handicap_stones = None):
-        ## _main_win is the WPF application object.
-        self._main_win = main_win
+    ## checkpoint_interval is how many moves apart (by move number) the game
+    ## keeps board snapshots for goto_move, and max_checkpoints bounds how many
+    ## it keeps, dropping the least recently used.
+    checkpoint_interval = 16
+    max_checkpoints = 64
+
+    def __init__ (self, observer, size, handicap, komi, handicap_stones = None):
+        ## _observer is the main window, or a GameObserver to run without a UI
+        ## (None means a new GameObserver).
+        if observer is None:
+            observer = GameObserver()
+        self._observer = observer
         ## board holds the GoBoard model.
         self.board = goboard.GoBoard(size)
         self._init_handicap_next_color(handicap, handicap_stones)
@@ -75,7 +78,15 @@ class Game (object):
         ## _cut_move holds the head of a sub tree that was last cut.
         ## Note, the public cut_move is a method.
         self._cut_move = None
-        main_win.setup_board_display(self)
+        ## _position_history holds the board's position_hash for the initial
+        ## board and after each move to the current move, and
+        ## _position_counts counts how many times each hash occurs in it, so
+        ## make_move can check for ko and superko in constant time.
+        self._reset_position_history()
+        ## _checkpoints maps moves to the board snapshot and position history
+        ## after the move, least recently used first (see _checkpoint).
+        self._checkpoints = collections.OrderedDict()
+        observer.setup_board_display(self)
 
     ### _init_handicap_next_color sets the next color to play and sets up any
     ### handicap state.  If there is a handicap,the moves may be specified in a
@@ -91,6 +102,8 @@ class Game (object):
             self.next_color = Colors.White
             self.handicap_moves = handicap_stones
             if handicap_stones is None:
+                if self.board.size != 19:
+                    raise Exception("Only know where handicap stones go on 19x19 boards.")
                 self.handicap_moves = []
                 def make_move (row, col):
                     m = goboard.Move(row, col, Colors.Black)
@@ -158,24 +171,33 @@ class Game (object):
         maybe_branching = ((cur_move is not None and cur_move.next is not None) or
                            (cur_move is None and self.first_move is not None))
         if self.board.has_stone(row, col):
-            MessageBox.Show("Can't play where there already is a stone.")
+            self._observer.show_message("Can't play where there already is a stone.")
             return None
-        ## move may be set below to pre-existing move, tossing this new object.
+        if maybe_branching:
+            existing = self._next_move_at(cur_move, row, col)
+            if existing is not None:
+                ## Found existing move at location in branches, just replay it
+                ## for capture effects, etc.  Don't need to check ReplayMove for
+                ## conflicting board move since user clicked and space is
+                ## empty.  Like Next, this doesn't check for ko or self capture.
+                if cur_move is None:
+                    self.first_move = existing
+                else:
+                    cur_move.next = existing
+                return self.replay_move()
         move = goboard.Move(row, col, self.next_color)
         if self._check_self_capture_no_kill(move):
-            MessageBox.Show("You cannot make a move that removes a group's last liberty")
+            self._observer.show_message("You cannot make a move that removes a group's last liberty")
+            return None
+        repeat = self._check_repeated_position(move)
+        if repeat is not None:
+            self._observer.show_message(repeat)
             return None
         if maybe_branching:
-            tmp = self._make_branching_move(cur_move, move)
-            if tmp is move:
-                ## Just because we're branching, doesn't mean the game is dirty.
-                ## If added new move, mark dirty since user could have saved game.
-                self.dirty = True
-            else:
-                ## Found existing move at location in branches, just reply it for
-                ## capture effects, etc.  Don't need to check ReplayMove for conflicting
-                ## board move since user clicked and space is empty.
-                return self.replay_move()
+            self._make_branching_move(cur_move, move)
+            ## Just because we're branching, doesn't mean the game is dirty.
+            ## If added new move, mark dirty since user could have saved game.
+            self.dirty = True
         else:
             if self._state is GameState.NOT_STARTED:
                 self.first_move = move
@@ -185,37 +207,86 @@ class Game (object):
                 move.previous = cur_move
             self.dirty = True
         self._save_and_update_comments(cur_move, move)
+        self.board.start_changes()
         self.board.add_stone(move)
         self.current_move = move
         move.number = self.move_count + 1
         self.move_count += 1
         self.next_color = opposite_move_color(self.next_color)
-        self._main_win.prevButton.IsEnabled = True
-        self._main_win.homeButton.IsEnabled = True
-        if move.next is None:
-            ## Made a move or branch that is at end of line of play.
-            self._main_win.nextButton.IsEnabled = False
-            self._main_win.endButton.IsEnabled = False
-        else:
-            ## Made a move that is already the next move in some branch,
-            ## and it has a next move.
-            self._main_win.nextButton.IsEnabled = True
-            self._main_win.endButton.IsEnabled = True
-        if len(move.dead_stones) != 0:
-            self.remove_stones(move.dead_stones)
+        ## Move may be at the end of a line of play, or it may already be the
+        ## next move in some branch and have a next move.
+        self._update_navigation()
+        for m in move.dead_stones:
+            self.board.remove_stone(m)
+        self._push_position()
+        self._checkpoint(move)
+        self._update_board_display(cur_move, move)
         return move
 
     ### CheckSelfCaptureNoKill returns true if move removes the last liberty of
-    ### its group without killing an opponent group.  It needs to temporarily add
-    ### the move to the board, then remove it.  Try catch may be over kill here, but ....
+    ### its group without killing an opponent group.  It also stores the stones
+    ### move kills in move.  The board's groups answer both without adding the
+    ### move to the board.
     ###
     def _check_self_capture_no_kill (self, move):
-        try:
-            self.board.add_stone(move)
-            noKill = len(self.check_for_kill(move)) == 0
-            return (not self.find_liberty(move.row, move.column, move.color)) and noKill
-        finally:
-            self.board.remove_stone(move)
+        move.dead_stones = self.board.would_capture(move)
+        return len(move.dead_stones) == 0 and self.board.is_self_capture(move)
+
+    ### _check_repeated_position returns a message saying why move is illegal
+    ### if it would take a ko back immediately or repeat any other board
+    ### position since the start of the game (positional superko), and None
+    ### otherwise.  This assumes _check_self_capture_no_kill set
+    ### move.dead_stones.  Replaying moves from files does not check for ko
+    ### since some rule sets allow repeating positions.
+    ###
+    def _check_repeated_position (self, move):
+        h = self.board.hash_after(move, move.dead_stones)
+        if h not in self._position_counts:
+            return None
+        history = self._position_history
+        if len(history) >= 2 and history[-2] == h:
+            return "You cannot retake the ko immediately."
+        return "You cannot make a move that repeats an earlier board position."
+
+    ### _reset_position_history sets the position history to just the current
+    ### board, which should be the initial board state.
+    ###
+    def _reset_position_history (self):
+        h = self.board.position_hash
+        self._position_history = [h]
+        self._position_counts = {h: 1}
+
+    ### _push_position adds the board's position to the position history after
+    ### playing a move, and _pop_position removes it before unwinding one.
+    ###
+    def _push_position (self):
+        h = self.board.position_hash
+        self._position_history.append(h)
+        self._position_counts[h] = self._position_counts.get(h, 0) + 1
+
+    def _pop_position (self):
+        h = self._position_history.pop()
+        count = self._position_counts[h] - 1
+        if count == 0:
+            del self._position_counts[h]
+        else:
+            self._position_counts[h] = count
+
+    ### _next_move_at returns the next move of cur_move (or the first move of
+    ### the game if cur_move is None), in any branch, at row, col, or None if
+    ### there isn't one.
+    ###
+    def _next_move_at (self, cur_move, row, col):
+        if cur_move is None:
+            game_or_move = self
+            next = self.first_move
+        else:
+            game_or_move = cur_move
+            next = cur_move.next
+        for m in game_or_move.branches or [next]:
+            if m.row == row and m.column == col:
+                return m
+        return None
 
     ### _make_branching_move sets up cur_move to have more than one next move,
     ### that is, branches.  If the new move, move, is at the same location as
@@ -232,7 +303,7 @@ class Game (object):
             cur_move.next = move
             move.previous = cur_move
         ## move may be pre-existing move with branches, or may need to clear combo ...
-        self._main_win.update_branch_combo(move.branches, move.next)
+        self._observer.update_branch_combo(move.branches, move.next)
         return move
 
     ### _make_branching_move_branches takes a game or move object (the current
@@ -274,104 +345,27 @@ class Game (object):
 
     ### check_for_kill determines if move kills any stones on the board and
     ### returns a list of move objects that were killed after storing them in
-    ### the Move object.  We use find_liberty and collect_stones rather than
-    ### try to build list as we go to simplify code.  Worse case we recurse all
-    ### the stones twice, but it doesn't impact observed performance.
-    ###
-    ### We do not need to clear visited between each outer 'if' check.  If we
-    ### start descending on a different stone in a different outer 'if' and
-    ### encounter a stone, S, that we've visited before, then searching that
-    ### stone previously must have returned false.  That is, searching all the
-    ### stones connected to S found no liberties before, and the current outer
-    ### 'if' must be searching the same group.  The new stone is going to
-    ### return false again, so no reason to clear visited.
+    ### the Move object.  Move must be on the board.  The board keeps groups and
+    ### their liberties up to date (see goboard.GoBoard), so this just looks at
+    ### the groups next to move rather than searching them for liberties.
     ###
     def check_for_kill (self, move):
-        row = move.row
-        col = move.column
-        ## Consider later if this is too much consing per move.
-        visited = [[False for j in xrange(self.board.size)] for i in xrange(self.board.size)]
-        opp_color = opposite_move_color(move.color)
-        dead_stones = []
-        if (self.board.has_stone_color_left(row, col, opp_color) and 
-            not self.find_liberty(row, col - 1, opp_color, visited)):
-            self.collect_stones(row, col - 1, opp_color, dead_stones)
-        if (self.board.has_stone_color_up(row, col, opp_color) and 
-            not self.find_liberty(row - 1, col, opp_color, visited)):
-            self.collect_stones(row - 1, col, opp_color, dead_stones)
-        if (self.board.has_stone_color_right(row, col, opp_color) and 
-            not self.find_liberty(row, col + 1, opp_color, visited)):
-            self.collect_stones(row, col + 1, opp_color, dead_stones)
-        if (self.board.has_stone_color_down(row, col, opp_color) and 
-            not self.find_liberty(row + 1, col, opp_color, visited)):
-            self.collect_stones(row + 1, col, opp_color, dead_stones)
-        move.dead_stones = dead_stones
-        return dead_stones
-
-    ### find_Liberty starts at row, col traversing all stones with the supplied
-    ### color to see if any stone has a liberty.  It returns true if it finds a
-    ### liberty.  If we've already been here, then its search is still pending
-    ### (and other stones it connects with should be searched).  See comment
-    ### for check_for_kill.  Visited can be null if you just want to check if a
-    ### single stone/group has any liberties, say, to see if a move was a self capture.
-    ###
-    def find_liberty (self, row, col, color, visited = None):
-        if visited is None:
-            ## Consider later if this is too much consing per move.
-            ## We cons this for self kill check, cons another for CheckForKill of opponent stones.
-            visited = [[None for i in xrange(self.board.size)] 
-                       for j in xrange(self.board.size)]
-        if visited[row - 1][col - 1]:
-            return False
-        ## Check for immediate liberty (breadth first).
-        if col != 1 and not self.board.has_stone_left(row, col):
-            return True
-        if row != 1 and not self.board.has_stone_up(row, col):
-            return True
-        if col != self.board.size and not self.board.has_stone_right(row, col):
-            return True
-        if row != self.board.size and not self.board.has_stone_down(row, col):
-            return True
-        ## No immediate liberties, so keep looking ...
-        visited[row - 1][col - 1] = True
-        if (self.board.has_stone_color_left(row, col, color) and
-            self.find_liberty(row, col - 1, color, visited)):
-            return True;
-        if (self.board.has_stone_color_up(row, col, color) and
-            self.find_liberty(row - 1, col, color, visited)):
-            return True;
-        if (self.board.has_stone_color_right(row, col, color) and
-            self.find_liberty(row, col + 1, color, visited)):
-            return True;
-        if (self.board.has_stone_color_down(row, col, color) and
-            self.find_liberty(row + 1, col, color, visited)):
-            return True;
-        ## No liberties ...
-        return False;
+        move.dead_stones = self.board.captured_stones(move)
+        return move.dead_stones
+
+    ### find_liberty returns true if any of the stones of color connected to
+    ### the stone at row, col has a liberty.  This searches the board rather
+    ### than using its groups (see check_for_kill and GoBoard.find_liberty).
+    ###
+    def find_liberty (self, row, col, color):
+        return self.board.find_liberty(row, col, color)
     
-    ### CollectStones gathers all the stones at row, col of color color, adding them
-    ### to the list dead_stones.  This does not update the board model by removing
-    ### the stones.  CheckForKill uses this to collect stones, ReadyForRendering calls
-    ### CheckForKill to prepare moves for rendering, but it shouldn't remove stones
-    ### from the board.
-    ###
-    def collect_stones (self, row, col, color, dead_stones, visited = None):
-        if visited is None:
-            ## Consider later if this is too much consing per move.
-            ## We cons this for self kill check, cons another for CheckForKill of opponent stones.
-            visited = [[None for i in xrange(self.board.size)] 
-                       for j in xrange(self.board.size)]
-        dead_stones.append(self.board.move_at(row, col))
-        visited[row - 1][col - 1] = True
-        ##self.board.remove_stone_at(row, col)
-        if self.board.has_stone_color_left(row, col, color) and not visited[row - 1][col - 2]:
-            self.collect_stones(row, col - 1, color, dead_stones, visited)
-        if self.board.has_stone_color_up(row, col, color) and not visited[row - 2][col - 1]:
-            self.collect_stones(row - 1, col, color, dead_stones, visited)
-        if self.board.has_stone_color_right(row, col, color) and not visited[row - 1][col]:
-            self.collect_stones(row, col + 1, color, dead_stones, visited)
-        if self.board.has_stone_color_down(row, col, color) and not visited[row][col - 1]:
-            self.collect_stones(row + 1, col, color, dead_stones, visited)
+    ### collect_stones adds the stones of color connected to the stone at row,
+    ### col to the list dead_stones.  This does not update the board model by
+    ### removing the stones.
+    ###
+    def collect_stones (self, row, col, color, dead_stones):
+        dead_stones.extend(self.board.collect_stones(row, col, color))
 
     
     ###
@@ -390,40 +384,37 @@ class Game (object):
         current = self.current_move
         if current is None:
             raise Exception("Previous button should be disabled if no current move.")
-        if not current.is_pass:
-            self.board.remove_stone(current)
-        self.add_stones(current.dead_stones)
-        self.next_color = current.color
-        self.move_count -= 1
+        self.board.start_changes()
+        self._unwind_move_model(current)
         previous = current.previous
+        self._update_board_display(current, previous)
         self._save_and_update_comments(current, previous)        
         if previous is None:
-            self._main_win.prevButton.IsEnabled = False
-            self._main_win.homeButton.IsEnabled = False
-        #    self._main_ui.MainWindow.FindName("prevButton").IsEnabled = False
-        #    self._main_ui.MainWindow.FindName("homeButton").IsEnabled = False
-        #self._main_ui.MainWindow.FindName("nextButton").IsEnabled = True
-        #self._main_ui.MainWindow.FindName("endButton").IsEnabled = True
-        self._main_win.nextButton.IsEnabled = True
-        self._main_win.endButton.IsEnabled = True
-        if previous is None:
-            self._main_win.update_branch_combo(self.branches, current)
+            self._observer.update_branch_combo(self.branches, current)
         else:
-            self._main_win.update_branch_combo(previous.branches, current)
+            self._observer.update_branch_combo(previous.branches, current)
         self.current_move = previous
+        self._update_navigation()
         return current
     
+    ### _unwind_move_model does the model work for unwind_move, taking move off
+    ### the board and putting back the stones it captured.
+    ###
+    def _unwind_move_model (self, move):
+        self._pop_position()
+        if not move.is_pass:
+            self.board.remove_stone(move)
+        for m in move.dead_stones:
+            self.board.add_stone(m)
+        self.next_color = move.color
+        self.move_count -= 1
+
     def can_unwind_move (self):
         return (not self._state is GameState.NOT_STARTED and
                 self.current_move is not None)
 
-    def add_stones (self, stones):
-        self._main_win.add_stones(stones)
-        for m in stones:
-            self.board.add_stone(m)
-
     ### goto_start resets the model to the initial board state before any moves
-    ### have been played, and then resets the UI.  This assumes the game has
+    ### have been played, and then updates the UI.  This assumes the game has
     ### started.
     ###
     def goto_start (self):
@@ -433,17 +424,24 @@ class Game (object):
         if current is None:
             raise Exception("Home button should be disabled if no current move.")
         self._save_and_update_comments(current, None)
-        self.board.goto_start()
-        self._main_win.reset_to_start(current)
+        self.board.start_changes()
+        self._reset_board()
+        self._update_board_display(current, None)
         ## Updating self.current_move, so after here, lexical 'current' is different
-        self.next_color = (self.handicap_moves is None and Colors.Black) or Colors.White
         self.current_move = None
+        self._observer.update_branch_combo(self.branches, self.first_move)
+        self._update_navigation()
+
+    ### _reset_board resets the board model to the initial board state.
+    ###
+    def _reset_board (self):
+        self.board.goto_start()
+        if self.handicap_moves is not None:
+            for m in self.handicap_moves:
+                self.board.add_stone(m)
+        self._reset_position_history()
+        self.next_color = (self.handicap_moves is None and Colors.Black) or Colors.White
         self.move_count = 0
-        self._main_win.update_branch_combo(self.branches, self.first_move)
-        self._main_win.prevButton.IsEnabled = False
-        self._main_win.homeButton.IsEnabled = False
-        self._main_win.nextButton.IsEnabled = True
-        self._main_win.endButton.IsEnabled = True
 
 
     ###
@@ -469,20 +467,15 @@ class Game (object):
             raise Exception("Next button should be disabled if no next move.")
         else:
             self.current_move = self.current_move.next
-        if self._replay_move_update_model(self.current_move) is None:
+        self.board.start_changes()
+        if self._replay_move_model(self.current_move) is None:
+            self.board.end_changes()
             self.current_move = fixup_move
             return None
+        self._update_board_display(fixup_move, self.current_move)
         self._save_and_update_comments(self.current_move.previous, self.current_move)
-        if self.current_move.next is None:
-            self._main_win.nextButton.IsEnabled = False
-            self._main_win.endButton.IsEnabled = False
-        #    self._main_ui.MainWindow.FindName("nextButton").IsEnabled = False
-        #    self._main_ui.MainWindow.FindName("endButton").IsEnabled = False
-        #self._main_ui.MainWindow.FindName("prevButton").IsEnabled = True
-        self._main_win.prevButton.IsEnabled = True
-        self._main_win.homeButton.IsEnabled = True
-        self._main_win.update_branch_combo(self.current_move.branches, self.current_move.next)
-        self._main_win.commentBox.Text = self.current_move.comments
+        self._update_navigation()
+        self._observer.update_branch_combo(self.current_move.branches, self.current_move.next)
         return self.current_move
 
     def can_replay_move (self):        
@@ -492,59 +485,59 @@ class Game (object):
 
     ### goto_last_move handles jumping to the end of the game record following
     ### all the currently selected branches.  This handles all game/board model
-    ### and UI updates, including current move adornments.  If the game hasn't
-    ### started, this throws an error.
+    ### and UI updates, including current move adornments, and the UI gets one
+    ### update for all the moves replayed.  If the game hasn't started, this
+    ### throws an error.
     ###
     def goto_last_move (self):
         if self._state is GameState.NOT_STARTED:
             raise Exception("End button should be disabled if game not started.")
         current = self.current_move
         save_orig_current = current
+        self.board.start_changes()
         ## Setup for loop ...
         if current is None:
             current = self.first_move
-            if self._replay_move_update_model(current) is None:
+            if self._replay_move_model(current) is None:
                 ## No partial actions/state to cleanup or revert
+                self.board.end_changes()
                 return
-            self._main_win.add_next_stone_no_current(current)
             next = current.next
         else:
             next = current.next
         ## Walk to last move
         while next is not None:
-            if self._replay_move_update_model(next) is None:
-                MessageBox.Show("Next move conincides with a move on the board. " +
-                                "You are replying moves from a pasted branch that's inconsistent.")
+            if self._replay_move_model(next) is None:
+                self._observer.show_message(
+                    "Next move conincides with a move on the board. " +
+                    "You are replying moves from a pasted branch that's inconsistent.")
                 break
-            self._main_win.add_next_stone_no_current(next)
             current = next
             next = current.next
         ## Update last move UI
+        self._update_board_display(save_orig_current, current)
         self._save_and_update_comments(save_orig_current, current)
-        self._main_win.add_current_adornments(current)
         self.current_move = current
         self.move_count = current.number
         self.next_color = opposite_move_color(current.color)
-        self._main_win.prevButton.IsEnabled = True
-        self._main_win.homeButton.IsEnabled = True
-        self._main_win.nextButton.IsEnabled = next is not None
-        self._main_win.endButton.IsEnabled = next is not None
+        self._update_navigation()
         ## There can't be any branches, but this ensures UI is cleared.
         if next is not None:
-            self._main_win.update_branch_combo(current.branches, next)
+            self._observer.update_branch_combo(current.branches, next)
         else:
-            self._main_win.update_branch_combo(None, None)
+            self._observer.update_branch_combo(None, None)
     
-    ### _replay_move_update_model updates the board model, next move color,
-    ### etc., when replaying a move in the game record.  This also handles
-    ### rendering a move that has only been read from a file and never
-    ### displayed in the UI.  Rendering here just means its state will be as if
-    ### it had been rendedered before.  We must setup branches to Move objects,
-    ### and make sure the next Move object is created and marked unrendered so
-    ### that code elsewhere that checks move.next will know there's a next
-    ### move.
+    ### _replay_move_model updates the board model, next move color, etc.,
+    ### when replaying a move in the game record, leaving the UI to the caller
+    ### (see _update_board_display).  This also handles rendering a move that
+    ### has only been read from a file and never displayed in the UI.
+    ### Rendering here just means its state will be as if it had been
+    ### rendedered before.  We must setup branches to Move objects, and make
+    ### sure the next Move object is created and marked unrendered so that code
+    ### elsewhere that checks move.next will know there's a next move.  This
+    ### returns None if move's location already has a stone.
     ###
-    def _replay_move_update_model (self, move):
+    def _replay_move_model (self, move):
         if not move.is_pass:
             ## Check if board has stone already since might be replaying branch
             ## that was pasted into tree (and moves could conflict).
@@ -557,13 +550,190 @@ class Game (object):
             ## Move points to a ParsedNode and has never been displayed.
             self._ready_for_rendering(move)
         self.move_count += 1
-        self.remove_stones(move.dead_stones)
+        for m in move.dead_stones:
+            self.board.remove_stone(m)
+        self._push_position()
+        self._checkpoint(move)
         return move
 
-    def remove_stones (self, stones):
-        self._main_win.remove_stones(stones)
-        for m in stones:
-            self.board.remove_stone(m)
+    ### _update_board_display ends the board changes a navigation command
+    ### started with board.start_changes and gives the UI one BoardDiff to
+    ### take the display from showing origin as the current move to showing
+    ### dest, however many moves the command replayed or unwound.  Either may
+    ### be None for the initial board state.
+    ###
+    def _update_board_display (self, origin, dest):
+        removed, added = self.board.end_changes()
+        self._observer.update_board(
+            goboard.BoardDiff(removed, added, self._shown_adornments(origin),
+                              self._shown_adornments(dest), origin, dest))
+
+    ### _update_navigation tells the UI whether there are moves to rewind and
+    ### to replay from the current move, for enabling the navigation buttons.
+    ###
+    def _update_navigation (self):
+        self._observer.update_navigation(self.can_unwind_move(),
+                                         self.can_replay_move())
+
+    ### _shown_adornments returns the adornments the UI shows when move is the
+    ### current move, not counting the current move adornment.
+    ###
+    def _shown_adornments (self, move):
+        if move is None:
+            return self.setup_adornments
+        return [a for a in move.adornments
+                if a is not goboard.Adornments.current_move_adornment]
+
+
+
+    ###
+    ### Jumping to Moves
+    ###
+
+    ### goto_node makes move the current move, selecting the branches that lead
+    ### to it, and updates the board and UI.  This takes the cheaper of two
+    ### ways to get there: unwinding the current move back to the last move
+    ### the current move and move have in common and then replaying the moves
+    ### to move, or restoring the board from the nearest checkpoint on the way
+    ### to move and replaying the moves after it (see _checkpoint).  Either
+    ### way, the UI gets one update for the whole jump, so jumping costs about
+    ### the length of the path between the moves, not the length of the game.
+    ### Move must be in this game's tree.  If a move on the way conflicts with
+    ### a stone on the board, which can happen in pasted branches, this stops
+    ### at the move before it.  This returns the new current move.
+    ###
+    def goto_node (self, move):
+        path = []
+        m = move
+        while m is not None:
+            path.append(m)
+            m = m.previous
+        path.reverse()
+        if path[0] is not self.first_move and (self.branches is None or
+                                               path[0] not in self.branches):
+            raise Exception("Move is not in this game.")
+        return self._goto_path(path, len(path))
+
+    ### goto_move_number goes to move number n following the currently selected
+    ### branches, like goto_node, or to the last move if there are fewer moves.
+    ### Zero is the initial board state.  This returns the new current move.
+    ###
+    def goto_move_number (self, n):
+        ## Moves exist only up to the first one that has never been replayed,
+        ## and _goto_path replays the rest.
+        path = []
+        m = self.first_move
+        for i in xrange(n):
+            if m is None:
+                break
+            path.append(m)
+            m = m.next
+        return self._goto_path(path, n)
+
+    ### _goto_path does the work for goto_node and goto_move_number.  Path is
+    ### the list of moves from the first move, and after replaying them, this
+    ### keeps replaying next moves until it has replayed count moves or gets to
+    ### the end of the game.
+    ###
+    def _goto_path (self, path, count):
+        if self._state is GameState.NOT_STARTED:
+            raise Exception("Can't go to a move if game not started.")
+        ## Select the branches that lead to the last move.
+        if path:
+            self.first_move = path[0]
+        for i in xrange(1, len(path)):
+            path[i - 1].next = path[i]
+        current = self.current_move
+        common = self._common_move_count(path)
+        unwinds = self.move_count - common
+        ## Find the checkpoint nearest the end of path.
+        checkpoint = 0
+        for i in xrange(len(path) - 1, -1, -1):
+            if path[i] in self._checkpoints:
+                checkpoint = i + 1
+                break
+        self.board.start_changes()
+        if unwinds + count - common <= count - checkpoint:
+            for i in xrange(unwinds):
+                self._unwind_move_model(self.current_move)
+                self.current_move = self.current_move.previous
+            start = common
+        elif checkpoint > 0:
+            self._restore_checkpoint(path[checkpoint - 1])
+            start = checkpoint
+        else:
+            self._reset_board()
+            start = 0
+        if start > 0:
+            target = path[start - 1]
+            next = target.next
+        else:
+            target = None
+            next = self.first_move
+        ## Path's branches are selected, so following next moves follows path.
+        for i in xrange(start, count):
+            if next is None:
+                break
+            if self._replay_move_model(next) is None:
+                self._observer.show_message(
+                    "Next move coincides with a move on the board.  " +
+                    "You are replaying moves from a pasted branch that's inconsistent.")
+                break
+            target = next
+            next = target.next
+        ## Update UI for the new board.
+        self._update_board_display(current, target)
+        self._save_and_update_comments(current, target)
+        self.current_move = target
+        self._update_navigation()
+        if target is None:
+            self._observer.update_branch_combo(self.branches, self.first_move)
+        else:
+            self._observer.update_branch_combo(target.branches, target.next)
+        return target
+
+    ### _common_move_count returns how many moves at the start of path lead to
+    ### the current move, that is, the number of the last move they have in
+    ### common, or zero if it is the initial board state.  This walks back from
+    ### the current move using move numbers (which are depths in the tree), so
+    ### it costs the distance back to the common move.
+    ###
+    def _common_move_count (self, path):
+        m = self.current_move
+        while m is not None and m.number > len(path):
+            m = m.previous
+        while m is not None and path[m.number - 1] is not m:
+            m = m.previous
+        return (m is not None and m.number) or 0
+
+    ### _checkpoint saves a snapshot of the board and the position history
+    ### after move if move's number is a multiple of checkpoint_interval.  When
+    ### there are more than max_checkpoints, this drops the least recently used
+    ### one.  Checkpoints are only for moves on paths we've replayed, and
+    ### paste_move clears them since pasted moves have new positions.
+    ###
+    def _checkpoint (self, move):
+        if move.number % self.checkpoint_interval != 0 or move in self._checkpoints:
+            return
+        self._checkpoints[move] = (self.board.snapshot(),
+                                   tuple(self._position_history),
+                                   self._position_counts.copy())
+        if len(self._checkpoints) > self.max_checkpoints:
+            self._checkpoints.popitem(False)
+
+    ### _restore_checkpoint restores the board model to the checkpoint saved
+    ### after move.
+    ###
+    def _restore_checkpoint (self, move):
+        ## Re-insert to mark it most recently used.
+        checkpoint = self._checkpoints.pop(move)
+        self._checkpoints[move] = checkpoint
+        snapshot, history, counts = checkpoint
+        self.board.restore(snapshot)
+        self._position_history = list(history)
+        self._position_counts = counts.copy()
+        self.next_color = opposite_move_color(move.color)
+        self.move_count = move.number
 
 
     ### _ready_for_rendering puts move in a state as if it had been displayed
@@ -583,14 +753,14 @@ class Game (object):
         if pn.branches is not None:
             moves = []
             for n in pn.branches:
-                m = _parsed_node_to_move(n)
+                m = _parsed_node_to_move(n, self.board.size)
                 m.number = self.move_count + 2
                 m.previous = move
                 moves.append(m)
             move.branches = moves
             mnext = moves[0]
         elif pn.next is not None:
-            mnext = _parsed_node_to_move(pn.next)
+            mnext = _parsed_node_to_move(pn.next, self.board.size)
             mnext.number = self.move_count + 2
             mnext.previous = move
         move.next = mnext
@@ -599,30 +769,31 @@ class Game (object):
         return move
 
     ### _replay_unrendered_adornments is just a helper for
-    ### _replay_move_update_model.  This does not need to check add_adornment
+    ### _replay_move_model.  This does not need to check add_adornment
     ### for a None result since we're trusting the file was written correctly,
     ### or it doesn't matter if there are dup'ed letters.
     ###
     def _replay_unrendered_adornments (self, move):
         props = move.parsed_node.properties
+        size = self.board.size
         if "TR" in props:
-            coords = [goboard.parsed_to_model_coordinates(x) for x in props["TR"]]
+            coords = [goboard.parsed_to_model_coordinates(x, size) for x in props["TR"]]
             adorns = [self.add_adornment(move, x[0], x[1], goboard.Adornments.triangle)
                       for x in coords]
             for x in adorns:
-                self._main_win.add_unrendered_adornment(x)
+                self._observer.add_unrendered_adornment(x)
         if "SQ" in props:
-            coords = [goboard.parsed_to_model_coordinates(x) for x in props["SQ"]]
+            coords = [goboard.parsed_to_model_coordinates(x, size) for x in props["SQ"]]
             adorns = [self.add_adornment(move, x[0], x[1], goboard.Adornments.square)
                       for x in coords]
             for x in adorns:
-                self._main_win.add_unrendered_adornment(x)
+                self._observer.add_unrendered_adornment(x)
         if "LB" in props:
-            coords = [goboard.parsed_label_model_coordinates(x) for x in props["LB"]]
+            coords = [goboard.parsed_label_model_coordinates(x, size) for x in props["LB"]]
             adorns = [self.add_adornment(move, x[0], x[1], goboard.Adornments.letter, x[2])
                       for x in coords]
             for x in adorns:
-                self._main_win.add_unrendered_adornment(x)
+                self._observer.add_unrendered_adornment(x)
 
 
     ### _save_and_update_comments ensures the model captures any comment
@@ -637,9 +808,9 @@ class Game (object):
     def _save_and_update_comments (self, origin, dest):
         self.save_comment(origin)
         if dest is not None:
-            self._main_win.commentBox.Text = dest.comments
+            self._observer.set_comment(dest.comments)
         else:
-            self._main_win.commentBox.Text = self.comments
+            self._observer.set_comment(self.comments)
 
     ### save_current_comment makes sure the current comment is persisted from the UI to
     ### the model.  This is used from the UI, such as when saving a file.
@@ -651,10 +822,11 @@ class Game (object):
     ### If move is null, the comment belongs to the game start or empty board.
     ###
     def save_comment (self, move):
-        cur_comment = self._main_win.commentBox.Text
+        cur_comment = self._observer.get_comment()
         if move is not None:
             if move.comments != cur_comment:
                 move.comments = cur_comment
+                move.saved_node = None
                 self.dirty = True
         else:
             if self.comments != cur_comment:
@@ -669,14 +841,16 @@ class Game (object):
 
     ### cut_move must be invoked on a current move.  It leaves the game state
     ### with the previous move or initial board as the current state, and it
-    ### updates UI.
+    ### updates UI, except that the caller shows the new current move in
+    ### anything that Game does not tell the observer about (such as a tree
+    ### view).
     ###
     def cut_move (self):
         cut_move = self.current_move
         if cut_move is None:
             raise Exception("Must cut current move, so cannot be initial board state.")
         ## unwind move with all UI updates and game model updates (and saves comments)
-        self._main_win.prevButton_left_down(None, None)
+        self.unwind_move()
         prev_move = self.current_move
         cut_move.previous = None
         if prev_move is None:
@@ -704,15 +878,14 @@ class Game (object):
             self._cut_next_move(prev_move, cut_move)
         self._cut_move = cut_move
         self.dirty = True
+        ## Don't hold onto boards for moves no longer in the game.
+        self._checkpoints.clear()
         ## Update UI now that current move's next/branches have changed.
+        self._update_navigation()
         if prev_move is None:
-            self._main_win.nextButton.IsEnabled = self.first_move is not None
-            self._main_win.endButton.IsEnabled = self.first_move is not None
-            self._main_win.update_branch_combo(self.branches, self.first_move)
+            self._observer.update_branch_combo(self.branches, self.first_move)
         else:
-            self._main_win.nextButton.IsEnabled = prev_move.next is not None
-            self._main_win.endButton.IsEnabled = prev_move.next is not None
-            self._main_win.update_branch_combo(prev_move.branches, prev_move.next)
+            self._observer.update_branch_combo(prev_move.branches, prev_move.next)
 
     ### _cut_next_move takes a Move or ParsedNode that is the previous move of
     ### the second argument, which is the move being cut.  This cleans up next
@@ -749,14 +922,17 @@ class Game (object):
     ### displayed.  It does not worry about duplicate next moves; it just
     ### pastes the sub tree.  If there is a next move at the same loc, we do
     ### not merge the trees matching moves since this would lose node
-    ### information (marked up and comments).
+    ### information (marked up and comments).  This replays the pasted move,
+    ### and like cut_move, the caller shows the new current move in anything
+    ### Game does not tell the observer about.  This returns the pasted move,
+    ### or None if it could not paste or replay it.
     ###
     def paste_move (self):
         if self._cut_move is None:
             raise Exception("No cut sub tree to paste.")
         if self._cut_move.color != self.next_color:
-            MessageBox.Show("Cannot paste cut move that is same color as current move.");
-            return;
+            self._observer.show_message("Cannot paste cut move that is same color as current move.");
+            return None;
         cur_move = self.current_move
         if cur_move is not None:
             _paste_next_move(cur_move, self._cut_move)
@@ -783,9 +959,14 @@ class Game (object):
                 self._state = GameState.STARTED
         self._cut_move.previous = cur_move  # stores None appropriately when no current
         self.dirty = True
+        ## Pasted moves may have had checkpoints, but their positions changed.
+        self._checkpoints.clear()
         _renumber_moves(self._cut_move)
         self._cut_move = None
-        self._main_win.nextButton_left_down(None, None)
+        move = self.replay_move()
+        if move is None:
+            self._observer.show_message("Can't play branch further due to conflicting stones on the board.")
+        return move
 
 
     ###
@@ -812,7 +993,7 @@ class Game (object):
                             'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V',
                             'W', 'X', 'Y', 'Z']:
                     if _list_find(elt, letters,
-                                  lambda x,y: x == y.cookie.Child.Content) == -1:
+                                  lambda x,y: x == y.letter) == -1:
                         data = elt #chr(ord('A') +  len(letters))
                         break
             return goboard.Adornments(kind, row, col, None, data), data
@@ -851,12 +1032,11 @@ class Game (object):
     def remove_adornment (self, a):
         move = self.current_move
         if self._state is GameState.NOT_STARTED or move is None:
-            adornments = self.setup_adornments
+            self.setup_adornments.remove(a)
         elif move is not None:
-            adornments = move.adornments
+            move.remove_adornment(a)
         else:
             raise Exception("Should never get here.")
-        adornments.remove(a)
 
     ###
     ### Misc Branches UI helpers
@@ -897,11 +1077,11 @@ class Game (object):
     def _branches_for_moving (self):
         ## Check if have move
         if self._state is GameState.NOT_STARTED:
-            MessageBox.Show("Game not started, now branches to modify.")
+            self._observer.show_message("Game not started, now branches to modify.")
             return (None, None)
         current = self.current_move
         if current is None:
-            MessageBox.Show("Must be on the first move of a branch to move it.")
+            self._observer.show_message("Must be on the first move of a branch to move it.")
             return (None, None)
         ## Get appropriate branches
         prev = current.previous
@@ -911,7 +1091,7 @@ class Game (object):
             branches = prev.branches
         ## Get index of current move in branches
         if branches is None:
-            MessageBox.Show("Must be on the first move of a branch to move it.")
+            self._observer.show_message("Must be on the first move of a branch to move it.")
             return (None, None)
         elif prev is None:
             cur_index = branches.index(self.first_move)
@@ -934,15 +1114,15 @@ class Game (object):
         if delta < 0:
             if cur_index > 0:
                 swap()
-                MessageBox.Show("Branch moved up.")
+                self._observer.show_message("Branch moved up.")
             else:
-                MessageBox.Show("This branch is the main branch.")
+                self._observer.show_message("This branch is the main branch.")
         elif delta > 0:
             if cur_index < (len(branches) - 1):
                 swap()
-                MessageBox.Show("Branch moved down.")
+                self._observer.show_message("Branch moved down.")
             else:
-                MessageBox.Show("This branch is the last branch.")
+                self._observer.show_message("This branch is the last branch.")
         else:
             raise Exception("Must call _move_branch with non-zero delta.")
 
@@ -951,8 +1131,8 @@ class Game (object):
 ###
 
     ### write_game takes a filename to write an .sgf file.  This maps the game
-    ### to an sgfparser.ParsedGame and uses its __str__ method to produce the
-    ### output.
+    ### to an sgfparser.ParsedGame and uses its write_to method to stream the
+    ### output to the file.
     ###
     def write_game (self, filename = None):
         if filename is None:
@@ -960,8 +1140,14 @@ class Game (object):
                 raise Exception ("Need filename to write file.")
             filename = self.filename
         pg = parsed_game_from_game(self)
-        f = open(filename, "w")
-        f.write(str(pg))
+        f = sgfparser.open_game_file(filename, "w")
+        try:
+            ## Cache node text so that the next save only rebuilds the text for
+            ## moves that change (see _gen_parsed_node).
+            pg.write_to(f, True)
+        except:
+            sgfparser.discard_game_file(f)
+            raise
         f.close()
         self.dirty = False
         self.filename = filename
@@ -972,7 +1158,7 @@ class Game (object):
         else:
             number = self.current_move.number
             is_pass = self.current_move.is_pass
-        self._main_win.update_title(number, is_pass, self.filebase)
+        self._observer.update_title(number, is_pass, self.filebase)
         #self.Title = "SGFEd -- " + self.filebase + ";  Move " + str(number)
 
     ### write_flipped_game saves all the game moves as a diagonal mirror image.
@@ -982,14 +1168,88 @@ class Game (object):
     ###
     def write_flipped_game (self, filename):
         pg = parsed_game_from_game(self, True) # True = flipped
-        f = open(filename, "w")
-        f.write(str(pg))
+        f = sgfparser.open_game_file(filename, "w")
+        try:
+            pg.write_to(f)
+        except:
+            sgfparser.discard_game_file(f)
+            raise
         f.close()
         self.dirty = False
         
 ### end Game class
 
 
+###
+### Game Observers
+###
+
+### GameObserver is the interface Game uses to update the UI and to show
+### messages to the user, so that Game does not depend on a UI toolkit.  The
+### main window implements these methods for the WPF UI.  This class
+### implements them for running without a UI: it keeps the comment text, so
+### save_comment works, and it keeps the messages game shows in messages.
+### Subclasses can override any of them, such as update_board to render
+### diffs some other way.
+###
+class GameObserver (object):
+
+    def __init__ (self):
+        self.comment = ""
+        self.messages = []
+
+    ### setup_board_display prepares the display for game's board when Game
+    ### constructs game.
+    ###
+    def setup_board_display (self, game):
+        pass
+
+    ### update_board takes a goboard.BoardDiff with all the changes to the
+    ### board display for one move, rewind, or jump.
+    ###
+    def update_board (self, diff):
+        pass
+
+    ### update_navigation takes whether there are moves to rewind from the
+    ### current move and moves to replay, for enabling navigation buttons.
+    ###
+    def update_navigation (self, can_unwind, can_replay):
+        pass
+
+    ### update_branch_combo takes the current branches and the next move (see
+    ### SgfEdWindow.update_branch_combo).
+    ###
+    def update_branch_combo (self, branches, next_move):
+        pass
+
+    ### set_comment shows the current move's comment text, and get_comment
+    ### returns the text, with any edits the user made.
+    ###
+    def set_comment (self, text):
+        self.comment = text
+
+    def get_comment (self):
+        return self.comment
+
+    ### update_title takes the current move number, whether it is a pass,
+    ### and the game's file name (see SgfEdWindow.update_title).
+    ###
+    def update_title (self, number, is_pass, filebase):
+        pass
+
+    ### add_unrendered_adornment takes an adornment of a move the user has
+    ### not replayed yet, so the UI can set up its cookie.
+    ###
+    def add_unrendered_adornment (self, adornment):
+        pass
+
+    ### show_message shows text to the user, such as why Game didn't make a
+    ### move.
+    ###
+    def show_message (self, text):
+        self.messages.append(text)
+
+
 ###
 ### Mapping Games to ParsedGames (for printing)
 ###
@@ -1002,14 +1262,15 @@ class Game (object):
 def parsed_game_from_game (game, flipped = False):
     pgame = sgfparser.ParsedGame()
     pgame.nodes = _gen_parsed_game_root(game, flipped)
+    size = game.board.size
     if game.branches is None:
         if game.first_move is not None:
-            pgame.nodes.next = _gen_parsed_nodes(game.first_move, flipped)
+            pgame.nodes.next = _gen_parsed_nodes(game.first_move, flipped, size)
             pgame.nodes.next.previous = pgame.nodes
     else:
         branches = []
         for m in game.branches:
-            tmp = _gen_parsed_nodes(m, flipped)
+            tmp = _gen_parsed_nodes(m, flipped, size)
             branches.append(tmp)
             tmp.previous = pgame.nodes
         pgame.nodes.next = branches[0]
@@ -1032,7 +1293,7 @@ def _gen_parsed_game_root (game, flipped):
     if game.parsed_game is not None:
         n.properties = _copy_properties(game.parsed_game.nodes.properties)
     n.properties["AP"] = ["SGFPy"]
-    n.properties["SZ"] = [str(game.board.size)]
+    n.properties["SZ"] = [goboard.get_parsed_board_size(game.board.size)]
     ## Comments
     if "GC" in n.properties:
         ## game.comments has merged GC and C comments.
@@ -1049,11 +1310,11 @@ def _gen_parsed_game_root (game, flipped):
     n.properties["KM"] = [game.komi]
     if "AB" in n.properties:
         if flipped:
-            n.properties["AB"] = flip_coordinates(n.properties["AB"])
+            n.properties["AB"] = flip_coordinates(n.properties["AB"], game.board.size)
         ## else leave them as-is
     else:
         if game.handicap != 0 and game.handicap != "0":
-            n.properties["AB"] = [goboard.get_parsed_coordinates(m, flipped) for
+            n.properties["AB"] = [goboard.get_parsed_coordinates(m, flipped, game.board.size) for
                                   m in game.handicap_moves]
     ## Player names
     n.properties["PB"] = ((game.player_black is not None and [game.player_black]) or 
@@ -1062,10 +1323,13 @@ def _gen_parsed_game_root (game, flipped):
                           ["White"])
     return n
 
+### _copy_properties returns a copy of a node's properties with list values
+### so that callers can modify them (parsed nodes have tuple values).
+###
 def _copy_properties (props):
     res = {}
     for k,v in props.iteritems():
-        res[k] = v[:]
+        res[k] = list(v)
     return res
 
 ### _gen_parsed_nodes returns a ParsedNode with all the moves following move
@@ -1075,19 +1339,19 @@ def _copy_properties (props):
 ### with branches.  If flipped is true, then moves and adornment indexes are
 ### diagonally mirrored; see write_flipped_game.
 ###
-def _gen_parsed_nodes (move, flipped):
+def _gen_parsed_nodes (move, flipped, size):
     if not move.rendered:
         ## If move exists and not rendered, then must be ParsedNode.
         if flipped:
-            return _clone_and_flip_nodes(move.parsed_node)
+            return _clone_and_flip_nodes(move.parsed_node, size)
         else:
             return move.parsed_node
-    cur_node = _gen_parsed_node(move, flipped)
+    cur_node = _gen_parsed_node(move, flipped, size)
     first = cur_node
     if move.branches is None:
         move = move.next
         while move is not None:
-            cur_node.next = _gen_parsed_node(move, flipped)
+            cur_node.next = _gen_parsed_node(move, flipped, size)
             cur_node.next.previous = cur_node
             if move.branches is None:
                 cur_node = cur_node.next
@@ -1099,7 +1363,7 @@ def _gen_parsed_nodes (move, flipped):
     if move is not None:
         cur_node.branches = []
         for m in move.branches:
-            tmp = _gen_parsed_nodes(m, flipped)
+            tmp = _gen_parsed_nodes(m, flipped, size)
             cur_node.branches.append(tmp)
             tmp.previous = cur_node
         cur_node.next = cur_node.branches[0]
@@ -1115,13 +1379,25 @@ def _gen_parsed_nodes (move, flipped):
 ### NOTE, this function needs to overwrite any node properties that the UI
 ### supports editing.  For example, if the end user modified adornments.
 ###
-def _gen_parsed_node (move, flipped):
+### Unless flipped, this saves the node in move.saved_node and returns it again
+### for later saves, so that writing the game reuses the node's cached text.
+### Anything that changes what this function generates for a move must set
+### move.saved_node to None, as Move.add_adornment and save_comment do.  The
+### caller links the node into the tree, so this clears any old links.
+###
+def _gen_parsed_node (move, flipped, size):
     if not move.rendered:
         ## If move exists and not rendered, then must be ParsedNode.
         if flipped:
-            return _clone_and_flip_nodes(move.parsed_node)
+            return _clone_and_flip_nodes(move.parsed_node, size)
         else:
             return move.parsed_node
+    if not flipped and move.saved_node is not None:
+        node = move.saved_node
+        node.next = None
+        node.previous = None
+        node.branches = None
+        return node
     node = sgfparser.ParsedNode()
     node.properties = ((move.parsed_node is not None and
                          _copy_properties(move.parsed_node.properties)) or
@@ -1129,9 +1405,9 @@ def _gen_parsed_node (move, flipped):
     props = node.properties
     ## Color
     if move.color == Colors.Black:
-        props["B"] = [goboard.get_parsed_coordinates(move, flipped)]
+        props["B"] = [goboard.get_parsed_coordinates(move, flipped, size)]
     elif move.color == Colors.White:
-        props["W"] = [goboard.get_parsed_coordinates(move, flipped)]
+        props["W"] = [goboard.get_parsed_coordinates(move, flipped, size)]
     else:
         raise Exception ("Should have only B or W moves.")
     ## Comments
@@ -1147,7 +1423,7 @@ def _gen_parsed_node (move, flipped):
     if "LB" in props:
         del props["LB"]
     for a in move.adornments:
-        coords = goboard.get_parsed_coordinates(a, flipped)
+        coords = goboard.get_parsed_coordinates(a, flipped, size)
         if a.kind is goboard.Adornments.triangle:
             if "TR" in props:
                 props["TR"].append(coords)
@@ -1159,11 +1435,13 @@ def _gen_parsed_node (move, flipped):
             else:
                 props["SQ"] = [coords]
         if a.kind is goboard.Adornments.letter:
-            data = coords + ":" + a.cookie.Child.Content
+            data = coords + ":" + a.letter
             if "LB" in props:
                 props["LB"].append(data)
             else:
                 props["LB"] = [data]
+    if not flipped:
+        move.saved_node = node
     return node
 
 ### _clone_and_flip_nodes is similar to _gen_parsed_nodes.  This returns a
@@ -1172,13 +1450,13 @@ def _gen_parsed_node (move, flipped):
 ### diagonal mirror image, see write_flipped_game.  This recurses on nodes with
 ### branches.
 ###
-def _clone_and_flip_nodes (nodes):
-    first = _clone_and_flip_node(nodes)
+def _clone_and_flip_nodes (nodes, size):
+    first = _clone_and_flip_node(nodes, size)
     cur_node = first
     if nodes.branches is None:
         nodes = nodes.next
         while nodes is not None:
-            cur_node.next = _clone_and_flip_node(nodes)
+            cur_node.next = _clone_and_flip_node(nodes, size)
             cur_node.next.previous = cur_node
             if nodes.branches is None:
                 cur_node = cur_node.next
@@ -1190,7 +1468,7 @@ def _clone_and_flip_nodes (nodes):
     if nodes is not None:
         cur_node.branches = []
         for m in nodes.branches:
-            tmp = _clone_and_flip_nodes(m)
+            tmp = _clone_and_flip_nodes(m, size)
             cur_node.branches.append(tmp)
             tmp.previous = cur_node
         cur_node.next = cur_node.branches[0]
@@ -1200,37 +1478,37 @@ def _clone_and_flip_nodes (nodes):
 ### ParsedNode that is a clone of node, but any indexes are diagonally mirror
 ### transposed, see write_flipped_game.
 ###
-def _clone_and_flip_node (node):
+def _clone_and_flip_node (node, size):
     new_node = sgfparser.ParsedNode()
     new_node.properties = _copy_properties(node.properties)
     props = new_node.properties
     ## Color
     if "B" in props:
-        props["B"] = flip_coordinates(props["B"])
+        props["B"] = flip_coordinates(props["B"], size)
     elif "W" in props:
-        props["W"] = flip_coordinates(props["W"])
+        props["W"] = flip_coordinates(props["W"], size)
     else:
         raise Exception ("Should have only B or W moves.")
     ## Adornments
     if "TR" in props:
-        props["TR"] = flip_coordinates(props["TR"])
+        props["TR"] = flip_coordinates(props["TR"], size)
     if "SQ" in props:
-        props["SQ"] = flip_coordinates(props["SQ"])
+        props["SQ"] = flip_coordinates(props["SQ"], size)
     if "LB" in props:
-        props["LB"] = flip_coordinates(props["LB"], True)
+        props["LB"] = flip_coordinates(props["LB"], size, True)
     return new_node
 
 ### flip_coordinates takes a list of parsed coordinate strings and returns the
-### same kind of list with the coorindates diagonally flipped (see
-### write_flipped_game).
+### same kind of list with the coorindates diagonally flipped on a board of
+### size (see write_flipped_game).
 ###
-def flip_coordinates (coords, labels = False):
+def flip_coordinates (coords, size, labels = False):
     if labels:
         ## coords elts are "<col><row>:<letter>"
-        return [x + y for x in flip_coordinates([l[:2] for l in coords])
-                      for y in [lb[2:] for lb in coords]]
+        return [goboard.flip_parsed_coordinates(lb[:2], size) + lb[2:]
+                for lb in coords]
     else:
-        return [goboard.flip_parsed_coordinates(yx) for yx in coords]
+        return [goboard.flip_parsed_coordinates(yx, size) for yx in coords]
     
 
 ###
@@ -1260,7 +1538,9 @@ def _paste_next_move (move_or_parsednode, cut_move):
 
 ### _renumber_moves takes a move with the correct number assignment and walks
 ### the sub tree of moves to reassign new numbers to the nodes.  This is used
-### by game._paste_move.
+### by game._paste_move.  Numbers are depths in the tree, which goto_node and
+### goto_move_number rely on, so branches are one more than the move they
+### follow.
 ###
 def _renumber_moves (move):
     count = move.number
@@ -1276,7 +1556,7 @@ def _renumber_moves (move):
     ## Only get here when move is None, or we're recursing on branches.
     if move is not None:
         for m in move.branches:
-            m.number = count
+            m.number = count + 1
             _renumber_moves(m)
 
 ### _check_for_coincident_moves checks if every move in a cut tree can play
@@ -1320,17 +1600,22 @@ def opposite_move_color (color):
     return (color == Colors.Black and Colors.White) or Colors.Black
 
     
-def create_default_game (main_win):
-    return Game(main_win, MAX_BOARD_SIZE, 0, DEFAULT_KOMI)
+def create_default_game (observer = None):
+    return Game(observer, MAX_BOARD_SIZE, 0, DEFAULT_KOMI)
 
 
-### create_parsed_game takes a ParsedGame and main UI window.  It creates a new
-### Game (which cleans up the current game) and sets up the first moves so that
-### the user can start advancing through the moves.
+### create_parsed_game takes a ParsedGame and the main UI window, or a
+### GameObserver or None to run without a UI.  It creates a new Game (which
+### cleans up the current game) and sets up the first moves so that the user
+### can start advancing through the moves.
 ###
-def create_parsed_game (pgame, main_win):
+def create_parsed_game (pgame, observer = None):
     ## Check some root properties
     props = pgame.nodes.properties
+    ## Board size
+    if "SZ" not in props:
+        raise Exception("No board size property?!")
+    size = goboard.parsed_to_board_size(props["SZ"][0])
     ## Handicap stones
     if "HA" in props:
         ## KGS saves HA[6] and then AB[]...
@@ -1338,7 +1623,7 @@ def create_parsed_game (pgame, main_win):
         if "AB" not in props:
             raise Exception("If parsed game has handicap, then need handicap stones.")
         def make_handicap_move (coords):
-            row, col = goboard.parsed_to_model_coordinates(coords)
+            row, col = goboard.parsed_to_model_coordinates(coords, size)
             m = goboard.Move(row, col, Colors.Black)
             m.parsed_node = pgame.nodes
             m.rendered = False
@@ -1349,19 +1634,13 @@ def create_parsed_game (pgame, main_win):
         all_black = None
     if "AW" in props:
         raise Exception("Don't support multiple white stones at root.")
-    ## Board size
-    if "SZ" not in props:
-        raise Exception("No board size property?!")
-    size = int(props["SZ"][0])
-    if size != 19:
-        raise Exception("Only work with size 19 currently, got %s" % (size))
     ## Komi
     if "KM" in props:
         komi = props["KM"][0]
     else:
         komi = ((handicap == 0) and DEFAULT_KOMI) or "0.5"
     ## Creating new game cleans up current game
-    g = Game(main_win, size, handicap, komi, all_black)
+    g = Game(observer, size, handicap, komi, all_black)
     ## Player names
     if "PB" in props:
         g.player_black = props["PB"][0]
@@ -1379,15 +1658,11 @@ def create_parsed_game (pgame, main_win):
     if g.first_move is not None:
         ## No first move if file just has handicap stones.
         g._state = GameState.STARTED
-        main_win.nextButton.IsEnabled = True
-        main_win.endButton.IsEnabled = True
-        main_win.update_branch_combo(g.branches, g.first_move)
+        g._observer.update_branch_combo(g.branches, g.first_move)
     else:
-        main_win.nextButton.IsEnabled = False
-        main_win.endButton.IsEnabled = False
-        main_win.update_branch_combo(g.branches, None)
-    main_win.commentBox.Text = g.comments
-    main_win.game = g
+        g._observer.update_branch_combo(g.branches, None)
+    g._update_navigation()
+    g._observer.set_comment(g.comments)
     return g
 
 
@@ -1416,7 +1691,7 @@ def _setup_first_parsed_move (g, nodes):
         ## Game starts with branches
         moves = []
         for n in nodes.branches:
-            m = _parsed_node_to_move(n)
+            m = _parsed_node_to_move(n, g.board.size)
             m.number = g.move_count + 1
             ## Don't set m.previous since they are fist moves.
             moves.append(m)
@@ -1427,7 +1702,7 @@ def _setup_first_parsed_move (g, nodes):
         if nodes is None:
             m = None
         else:
-            m = _parsed_node_to_move(nodes)
+            m = _parsed_node_to_move(nodes, g.board.size)
             ## Note, do not incr g.move_count since first move has not been rendered,
             ## so if user clicks, that should be number 1 too.
             m.number = g.move_count + 1
@@ -1437,14 +1712,15 @@ def _setup_first_parsed_move (g, nodes):
 ### _parsed_node_to_move takes a ParsedNode and returns a Move model for it.
 ### For now, this is fairly constrained to expected next move colors and no
 ### random setup nodes that place several moves or just place adornments.
+### The move must be on a board of size.
 ###
-def _parsed_node_to_move (n):
+def _parsed_node_to_move (n, size):
     if "B" in n.properties:
         color = Colors.Black
-        row, col = goboard.parsed_to_model_coordinates(n.properties["B"][0])
+        row, col = goboard.parsed_to_model_coordinates(n.properties["B"][0], size)
     elif "W" in n.properties:
         color = Colors.White
-        row, col = goboard.parsed_to_model_coordinates(n.properties["W"][0])        
+        row, col = goboard.parsed_to_model_coordinates(n.properties["W"][0], size)        
     else:
         raise Exception("Next nodes must be moves, don't handle arbitrary nodes yet -- %s" %
                         (n.node_str(False)))
@@ -1502,9 +1778,9 @@ def show_tree (game):
                 display[i][j] = "O"
             elif tree_grid[i][j].kind is TreeViewNode.line_bend_kind:
                 display[i][j] = "L"
-            else: #if tree_grid[i][j].color == Colors.BurlyWood:
+            else: #if tree_grid[i][j].color is None:
                 display[i][j] = "S"
-    MessageBox.Show("\n".join(["".join(r) for r in display]))
+    game._observer.show_message("\n".join(["".join(r) for r in display]))
 
 ## layout recurses through the moves assigning them to a location in the display grid.
 ## max_rows is an array mapping the column number to the next free row that
@@ -1556,8 +1832,8 @@ def setup_layout_model (pn, max_rows, cum_max_row, tree_depth):
     elif "W" in pn.properties:
         model.color = Colors.White
     elif tree_depth == 0:
-        ## This is the empty board start node
-        model.color = Colors.BurlyWood # sentinel color
+        ## This is the empty board start node, which has no color.
+        model.color = None
     else:
         raise Exception("eh?!  Node is not move, nor are we at the start of the parsed tree -- %s" %
                         (pn.node_str(False)))
@@ -1,32 +1,89 @@
 ### goboard.py provides the board and move models.  The main classes are
-### GoBoard, Move, and Adornments.
+### GoBoard, Move, and Adornments.  The models don't use WPF or .NET, so they
+### run under plain CPython too.
 
-import clr
+import random
 
-## Debugging only ...
-## Needed for System.Windows
-#clr.AddReference('PresentationFramework')
-#from System.Windows import MessageBox
+import sgfparser
 
-__all__ = ["GoBoard", "Move", "Adornments", "parsed_move_model_coordinates", 
-           "parsed_label_model_coordinates", "parsed_to_model_coordinates"]
+__all__ = ["GoBoard", "Move", "Adornments", "BoardDiff", "Colors",
+           "parsed_move_model_coordinates", 
+           "parsed_label_model_coordinates", "parsed_to_model_coordinates",
+           "board_dimensions", "parsed_to_board_size", "get_parsed_board_size"]
 
 
 ### GoBoard models the board in terms of what stones are where on the
 ### board and has a list/tree of Moves.  The board model is that rows
 ### increase going down from the top, and columns increase to the right.
+### Boards may be rectangular, with width columns and height rows.
+###
+### GoBoard also keeps the groups of stones up to date as stones come and go,
+### so capture and self capture checks don't have to search the board.  Each
+### location is a point, (row - 1) * width + (col - 1).  The points of a group
+### form a union-find tree, and the root point holds the list of the group's
+### points and its count of pseudo-liberties.  Pseudo-liberties count an
+### empty point once for each of the group's stones next to it, which is easy
+### to keep up to date and is zero exactly when the group has no liberties.
+### Removing a stone from a bigger group can split it, so that marks the group
+### to regroup from its remaining stones the next time we need groups.  When
+### captures remove a whole group a stone at a time, nothing remains, and
+### regrouping costs nothing.
+###
+### GoBoard also keeps a Zobrist hash of the position in position_hash, the
+### exclusive or of a random key for each stone's point and color, so adding
+### or removing a stone updates it in constant time.  Equal positions have
+### equal hashes for boards of the same size.
 ###
 class GoBoard (object):
     
-    supported_sizes = [9, 13, 19]
+    ## Each side of the board can have from min_size to max_size lines, which
+    ## is as many as .sgf coordinate letters can name.
+    min_size = 2
+    max_size = 52
     
     def __init__ (self, size):
-        ## size holds the number of lines on the board.
-        if size not in GoBoard.supported_sizes:
-            raise Exception("Board size must be 9, 13, or 19 -- got " + str(size))
-        self.size = size
+        width, height = board_dimensions(size)
+        if not (GoBoard.min_size <= width <= GoBoard.max_size and
+                GoBoard.min_size <= height <= GoBoard.max_size):
+            raise Exception("Board size must be from %s to %s lines -- got %s" %
+                            (GoBoard.min_size, GoBoard.max_size, size))
+        ## size holds the number of lines on a square board, or (width, height)
+        ## for a rectangular board, like the .sgf SZ property.
+        self.size = (width == height and width) or (width, height)
+        self.width = width
+        self.height = height
         ## moves holds Move objects or None if there's no stone at the location
-        self.moves = [[None for col in xrange(size)] for row in xrange(size)]
+        self.moves = [[None for col in xrange(width)] for row in xrange(height)]
+        ## _neighbors holds the list of points next to each point.
+        self._neighbors = _neighbor_points(width, height)
+        ## _zobrist maps each color to its Zobrist keys (see _color_keys).
+        self._zobrist = {}
+        ## _changed maps changed points to the Move they had before, while
+        ## recording changes (see start_changes).
+        self._changed = None
+        self._reset_groups()
+
+    ### _reset_groups sets up the group model for an empty board.
+    ###
+    def _reset_groups (self):
+        n = self.width * self.height
+        ## _points holds the Move at each point, or None.
+        self._points = [None] * n
+        ## _parent holds each stone's parent point in its group's tree.
+        self._parent = range(n)
+        ## _members and _liberties hold the group's points and pseudo-liberty
+        ## count at a group's root point.
+        self._members = [None] * n
+        self._liberties = [0] * n
+        ## _dirty holds the roots of groups that lost stones (see _regroup).
+        self._dirty = set()
+        ## _visited marks the points a search has visited with the search's
+        ## generation number, so starting a search clears all the old marks
+        ## just by taking the next number (see _next_generation).
+        self._visited = [0] * n
+        self._generation = 0
+        ## position_hash is the empty board's hash.
+        self.position_hash = 0
 
     ### add_stone adds move to the model, assuming it has valid indexes.
     ### row, col are one-based, as we talk about go boards.
@@ -35,6 +92,40 @@ class GoBoard (object):
         if self.moves[move.row - 1][move.column - 1] is not None:
             raise Exception("Ensure board has no stone at location.")
         self.moves[move.row - 1][move.column - 1] = move
+        if self._dirty:
+            self._regroup()
+        p = (move.row - 1) * self.width + move.column - 1
+        points = self._points
+        parent = self._parent
+        members = self._members
+        liberties = self._liberties
+        if self._changed is not None and p not in self._changed:
+            self._changed[p] = None
+        points[p] = move
+        self.position_hash ^= self._color_keys(move.color)[p]
+        parent[p] = p
+        members[p] = [p]
+        liberties[p] = 0
+        root = p
+        libs = 0
+        for q in self._neighbors[p]:
+            m = points[q]
+            if m is None:
+                libs += 1
+                continue
+            ## p was a pseudo-liberty of q's group.
+            r = self._find(q)
+            liberties[r] -= 1
+            if r != root and m.color == move.color:
+                ## Merge the smaller group into the bigger one.
+                if len(members[r]) < len(members[root]):
+                    r, root = root, r
+                parent[root] = r
+                members[r].extend(members[root])
+                liberties[r] += liberties[root]
+                members[root] = None
+                root = r
+        liberties[root] += libs
         return move
     
     ### remove_stone removes the move indicated by move's row and column.
@@ -43,6 +134,24 @@ class GoBoard (object):
     ###
     def remove_stone (self, move):
         self.moves[move.row - 1][move.column - 1] = None
+        p = (move.row - 1) * self.width + move.column - 1
+        points = self._points
+        if points[p] is None:
+            return
+        self.position_hash ^= self._color_keys(points[p].color)[p]
+        if self._changed is not None and p not in self._changed:
+            self._changed[p] = points[p]
+        points[p] = None
+        for q in self._neighbors[p]:
+            if points[q] is not None:
+                self._liberties[self._find(q)] += 1
+        ## Leave p in its group's tree since other stones' parents may go
+        ## through it.
+        root = self._find(p)
+        if len(self._members[root]) == 1:
+            self._members[root] = None
+        else:
+            self._dirty.add(root)
     
     def remove_stone_at (self, row, col):
         if self.move_at(row, col):
@@ -51,9 +160,283 @@ class GoBoard (object):
     ### goto_start removes all stones from the model.
     ###
     def goto_start (self):
-        for row in xrange(self.size):
-            for col in xrange(self.size):
+        for row in xrange(self.height):
+            for col in xrange(self.width):
                 self.moves[row][col] = None
+        if self._changed is not None:
+            self._record_changes([None] * len(self._points))
+        self._reset_groups()
+
+    ### start_changes starts recording which points gain or lose stones, and
+    ### end_changes stops and returns the lists of Moves removed from and
+    ### added to the board since start_changes.  A point that changes and then
+    ### changes back, or ends up with another stone of the same color, is in
+    ### neither list, so after any number of moves or jumps, the lists are the
+    ### least a display of the board needs to update (see BoardDiff).
+    ###
+    def start_changes (self):
+        self._changed = {}
+
+    def end_changes (self):
+        changed = self._changed
+        self._changed = None
+        points = self._points
+        removed = []
+        added = []
+        for p, old in changed.iteritems():
+            new = points[p]
+            if old is not new and (old is None or new is None or
+                                   old.color != new.color):
+                if old is not None:
+                    removed.append(old)
+                if new is not None:
+                    added.append(new)
+        return removed, added
+
+    ### _record_changes records the changed points when the board is about to
+    ### have the Moves in new_points.
+    ###
+    def _record_changes (self, new_points):
+        changed = self._changed
+        for p, old in enumerate(self._points):
+            if old is not new_points[p] and p not in changed:
+                changed[p] = old
+
+    ### snapshot returns the board's position as a compact value for restore:
+    ### the Move (or None) at each point, the position hash, and each group's
+    ### root, points, and pseudo-liberty count.
+    ###
+    def snapshot (self):
+        if self._dirty:
+            self._regroup()
+        liberties = self._liberties
+        groups = tuple((root, tuple(points), liberties[root])
+                       for root, points in enumerate(self._members) if points)
+        return (tuple(self._points), self.position_hash, groups)
+
+    ### restore puts the board back in the position that snapshot returned.
+    ###
+    def restore (self, snapshot):
+        points, position_hash, groups = snapshot[:3]
+        if self._changed is not None:
+            self._record_changes(points)
+        n = len(points)
+        width = self.width
+        for row in xrange(self.height):
+            self.moves[row][:] = points[row * width:(row + 1) * width]
+        self._points = list(points)
+        parent = range(n)
+        members = [None] * n
+        liberties = [0] * n
+        for root, group, libs in groups:
+            members[root] = list(group)
+            liberties[root] = libs
+            for q in group:
+                parent[q] = root
+        self._parent = parent
+        self._members = members
+        self._liberties = liberties
+        self._dirty.clear()
+        self.position_hash = position_hash
+
+    ### _find returns the root point of the group of the stone at point p,
+    ### shortening the path to the root as it goes.
+    ###
+    def _find (self, p):
+        parent = self._parent
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    ### _regroup replaces each group that lost stones with the groups formed by
+    ### its remaining stones, counting their pseudo-liberties afresh.
+    ###
+    def _regroup (self):
+        points = self._points
+        parent = self._parent
+        members = self._members
+        neighbors = self._neighbors
+        for root in self._dirty:
+            old = members[root]
+            members[root] = None
+            for q in old:
+                parent[q] = -1
+            for q in old:
+                if points[q] is None or parent[q] != -1:
+                    continue
+                ## Collect the stones connected to q into a new group rooted at q.
+                color = points[q].color
+                parent[q] = q
+                group = [q]
+                libs = 0
+                i = 0
+                while i < len(group):
+                    for t in neighbors[group[i]]:
+                        m = points[t]
+                        if m is None:
+                            libs += 1
+                        elif parent[t] == -1 and m.color == color:
+                            parent[t] = q
+                            group.append(t)
+                    i += 1
+                members[q] = group
+                self._liberties[q] = libs
+        self._dirty.clear()
+
+    ### _color_keys returns the list of Zobrist keys, one per point, for stones
+    ### of color.
+    ###
+    def _color_keys (self, color):
+        keys = self._zobrist.get(color)
+        if keys is None:
+            keys = _zobrist_keys(self.width, self.height, color)
+            self._zobrist[color] = keys
+        return keys
+
+    ### hash_after returns what position_hash would be after adding move to
+    ### the board and removing dead_stones, without changing the board.
+    ###
+    def hash_after (self, move, dead_stones):
+        h = self.position_hash
+        if move.is_pass:
+            return h
+        width = self.width
+        h ^= self._color_keys(move.color)[(move.row - 1) * width + move.column - 1]
+        for m in dead_stones:
+            h ^= self._color_keys(m.color)[(m.row - 1) * width + m.column - 1]
+        return h
+
+    ### _next_generation returns a new mark for _visited.
+    ###
+    def _next_generation (self):
+        self._generation += 1
+        return self._generation
+
+    ### find_liberty returns true if any of the stones of color connected to the
+    ### stone at row, col has a liberty.  Unlike liberty_count, this searches
+    ### the stones, using an explicit stack so that big groups can't run out of
+    ### stack space, and it stops at the first liberty it finds.
+    ###
+    def find_liberty (self, row, col, color):
+        gen = self._next_generation()
+        visited = self._visited
+        points = self._points
+        neighbors = self._neighbors
+        p = (row - 1) * self.width + col - 1
+        visited[p] = gen
+        stack = [p]
+        while stack:
+            for q in neighbors[stack.pop()]:
+                m = points[q]
+                if m is None:
+                    return True
+                if visited[q] != gen and m.color == color:
+                    visited[q] = gen
+                    stack.append(q)
+        return False
+
+    ### collect_stones returns the Moves of color connected to the stone at
+    ### row, col by searching the board like find_liberty.
+    ###
+    def collect_stones (self, row, col, color):
+        gen = self._next_generation()
+        visited = self._visited
+        points = self._points
+        neighbors = self._neighbors
+        p = (row - 1) * self.width + col - 1
+        visited[p] = gen
+        res = [points[p]]
+        stack = [p]
+        while stack:
+            for q in neighbors[stack.pop()]:
+                m = points[q]
+                if m is not None and visited[q] != gen and m.color == color:
+                    visited[q] = gen
+                    stack.append(q)
+                    res.append(m)
+        return res
+
+    ### liberty_count returns the number of pseudo-liberties (see GoBoard) of
+    ### the group with a stone at row, col, which is zero exactly when the
+    ### group has no liberties.
+    ###
+    def liberty_count (self, row, col):
+        if self._dirty:
+            self._regroup()
+        return self._liberties[self._find((row - 1) * self.width + col - 1)]
+
+    ### group_moves returns the Moves of the group with a stone at row, col.
+    ###
+    def group_moves (self, row, col):
+        if self._dirty:
+            self._regroup()
+        root = self._find((row - 1) * self.width + col - 1)
+        return [self._points[q] for q in self._members[root]]
+
+    ### captured_stones returns the Moves of the opponent groups next to move
+    ### that have no liberties, where move is on the board.
+    ###
+    def captured_stones (self, move):
+        if self._dirty:
+            self._regroup()
+        res = []
+        roots = []
+        for q in self._neighbors[(move.row - 1) * self.width + move.column - 1]:
+            m = self._points[q]
+            if m is not None and m.color != move.color:
+                root = self._find(q)
+                if self._liberties[root] == 0 and root not in roots:
+                    roots.append(root)
+                    res.extend([self._points[s] for s in self._members[root]])
+        return res
+
+    ### would_capture returns the Moves that move would capture if played,
+    ### where move's location is empty.  An opponent group dies if all its
+    ### pseudo-liberties are stones next to move's location.
+    ###
+    def would_capture (self, move):
+        res = []
+        for root, count in self._touching_groups(move):
+            if (self._points[root].color != move.color and
+                    self._liberties[root] == count):
+                res.extend([self._points[s] for s in self._members[root]])
+        return res
+
+    ### is_self_capture returns true if playing move, whose location is empty,
+    ### would leave its group with no liberties without capturing anything.
+    ###
+    def is_self_capture (self, move):
+        p = (move.row - 1) * self.width + move.column - 1
+        for q in self._neighbors[p]:
+            if self._points[q] is None:
+                return False
+        for root, count in self._touching_groups(move):
+            if self._points[root].color == move.color:
+                if self._liberties[root] > count:
+                    return False
+            elif self._liberties[root] == count:
+                return False
+        return True
+
+    ### _touching_groups returns a list of (root, count) for the groups next to
+    ### move's location, where count is the number of the group's stones next
+    ### to it, that is, how many of its pseudo-liberties the location is.
+    ###
+    def _touching_groups (self, move):
+        if self._dirty:
+            self._regroup()
+        res = []
+        for q in self._neighbors[(move.row - 1) * self.width + move.column - 1]:
+            if self._points[q] is not None:
+                root = self._find(q)
+                for i in xrange(len(res)):
+                    if res[i][0] == root:
+                        res[i] = (root, res[i][1] + 1)
+                        break
+                else:
+                    res.append((root, 1))
+        return res
     
     ### move_at returns the move at row, col (one-based indexes), or None if
     ### there is no move here.
@@ -93,7 +476,7 @@ class GoBoard (object):
     
     
     def has_stone_right (self, row, col):
-        return ((col + 1) <= self.size) and (self.move_at(row, col + 1) is not None)
+        return ((col + 1) <= self.width) and (self.move_at(row, col + 1) is not None)
     
     def has_stone_color_right (self, row, col, color):
         return self.has_stone_right(row, col) and (self.move_at(row, col + 1).color == color)
@@ -107,13 +490,60 @@ class GoBoard (object):
     
     
     def has_stone_down (self, row, col):
-        return ((row + 1) <= self.size) and (self.move_at(row + 1, col) is not None)
+        return ((row + 1) <= self.height) and (self.move_at(row + 1, col) is not None)
     
     def has_stone_color_down (self, row, col, color):
         return self.has_stone_down(row, col) and (self.move_at(row + 1, col).color == color)
     
 
 
+### _neighbor_points returns a list with the list of neighboring points for
+### each point on a board of width by height (see GoBoard).  These only
+### depend on the board's dimensions, so they are computed once per size.
+###
+def _neighbor_points (width, height):
+    res = _neighbor_points_cache.get((width, height))
+    if res is None:
+        res = []
+        for row in xrange(height):
+            for col in xrange(width):
+                n = []
+                if col > 0: n.append(row * width + col - 1)
+                if row > 0: n.append((row - 1) * width + col)
+                if col < width - 1: n.append(row * width + col + 1)
+                if row < height - 1: n.append((row + 1) * width + col)
+                res.append(n)
+        _neighbor_points_cache[(width, height)] = res
+    return res
+
+_neighbor_points_cache = {}
+
+### _zobrist_keys returns the list of random Zobrist keys for stones of color
+### on a board of width by height, one per point.  All boards of a size share
+### keys so that their hashes are comparable.
+###
+def _zobrist_keys (width, height, color):
+    keys = _zobrist_keys_cache.get((width, height, color))
+    if keys is None:
+        keys = [_zobrist_random.getrandbits(64) for i in xrange(width * height)]
+        ## Another thread may have made keys first, and its keys win.
+        keys = _zobrist_keys_cache.setdefault((width, height, color), keys)
+    return keys
+
+_zobrist_keys_cache = {}
+_zobrist_random = random.Random(0x5ca1ab1e)
+
+
+
+### Colors holds the stone colors.  They are plain strings rather than WPF
+### Colors so that the models don't need WPF, and the UI maps them to
+### brushes.
+###
+class Colors (object):
+    Black = "Black"
+    White = "White"
+
+
 ### Move models a move or stone on the board and links to the previous
 ### and next moves.
 ###
@@ -143,69 +573,145 @@ class Move (object):
         ## displayed, but parsed nodes can have unprocessed branches or
         ## annotations.
         self.rendered = True
+        ## saved_node is the ParsedNode that represented this move the last
+        ## time the game was saved, with its text cached, or None if the move's
+        ## comments or adornments changed since then (see
+        ## game._gen_parsed_node).
+        self.saved_node = None
     
     
     ### The adornment functions do no checking on the objects added, whether
     ### objects are really in the collection for removing, etc.  It's up to
-    ### users to use them correctly.
+    ### users to use them correctly.  The current move adornment is not saved
+    ### in files, so moving it around doesn't change saved_node.
     
     def add_adornment (self, a):
         self.adornments.append(a)
+        if a.kind is not Adornments.current_move:
+            self.saved_node = None
         return a
     
     def remove_adornment (self, a):
-        self.adornments.Remove(a)
+        self.adornments.remove(a)
+        if a.kind is not Adornments.current_move:
+            self.saved_node = None
 
 ###
 ### Coordinates conversions
 ###
 
-### letters used for translating parsed coordinates to get model coordinates.
+### _letters holds the .sgf coordinate letter for each line, indexed from one
+### as the model is.
+###
+_letters = ["skip_0_goboard_one_based"] + list("abcdefghijklmnopqrstuvwxyz" +
+                                               "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+### _model_coordinates maps every two letter .sgf coordinate to its model row,
+### col, and the empty string (a pass) to None, None.
+###
+_model_coordinates = dict((_letters[col] + _letters[row], (row, col))
+                          for row in xrange(1, len(_letters))
+                          for col in xrange(1, len(_letters)))
+_model_coordinates[""] = (None, None)
+
+### board_dimensions returns the width and height of a board of size, which
+### is the number of lines on a square board or (width, height) (see GoBoard).
+###
+def board_dimensions (size):
+    if type(size) is tuple:
+        return size
+    return size, size
+
+### parsed_to_board_size returns a board size (see GoBoard) from an .sgf SZ
+### property value, "<lines>" or "<columns>:<rows>".
 ###
-_letters = ["skip_0_goboard_one_based", 
-            "a", "b", "c", "d", "e", "f", "g", "h", "i", "j",
-            "k", "l", "m", "n", "o", "p", "q", "r", "s"]
+def parsed_to_board_size (data):
+    try:
+        if ":" in data:
+            width, height = [int(x) for x in data.split(":")]
+            if width != height:
+                return (width, height)
+            return width
+        return int(data)
+    except ValueError:
+        raise Exception("Bad board size property -- %s" % (data))
+
+### get_parsed_board_size returns the .sgf SZ property value for a board size.
+###
+def get_parsed_board_size (size):
+    width, height = board_dimensions(size)
+    if width == height:
+        return str(width)
+    return "%s:%s" % (width, height)
 
 ### get_parsed_coordinates returns letter-based coordinates from _letters for
-### writing .sgf files.  If flipped, then return the diagonal mirror image
-### coordinates for writing files in the opponent's view of the board.
+### writing .sgf files.  If flipped, then return the coordinates rotated half
+### way around the board of size for writing files in the opponent's view of
+### the board.
 ###
-def get_parsed_coordinates (move_or_adornment, flipped):
+def get_parsed_coordinates (move_or_adornment, flipped, size = 19):
     if type(move_or_adornment) is Move and move_or_adornment.is_pass:
         return ""
     if flipped:
-        return (_letters[20 - move_or_adornment.column] +
-                _letters[20 - move_or_adornment.row])
+        col_letters, row_letters = _flipped_letters(size)
+        return (col_letters[move_or_adornment.column] +
+                row_letters[move_or_adornment.row])
     else:
         return (_letters[move_or_adornment.column] +
                 _letters[move_or_adornment.row])
 
-def flip_parsed_coordinates (coords):
-    coords = parsed_to_model_coordinates(coords)
-    if None in coords:
+### flip_parsed_coordinates takes parsed coordinates and returns them rotated
+### half way around the board of size (see get_parsed_coordinates).
+###
+def flip_parsed_coordinates (coords, size = 19):
+    row, col = parsed_to_model_coordinates(coords, size)
+    if row is None:
         return ""
     else:
-        return _letters[20 - coords[1]] + _letters[20 - coords[0]]
-    
+        col_letters, row_letters = _flipped_letters(size)
+        return col_letters[col] + row_letters[row]
+
+### _flipped_letters returns lists like _letters for the columns and rows of a
+### board of size, but each line gets the letter of the line the same distance
+### in from the opposite edge.  These are computed once per size.
+###
+def _flipped_letters (size):
+    res = _flipped_letters_cache.get(size)
+    if res is None:
+        width, height = board_dimensions(size)
+        res = ([None] + [_letters[width + 1 - i] for i in xrange(1, width + 1)],
+               [None] + [_letters[height + 1 - i] for i in xrange(1, height + 1)])
+        _flipped_letters_cache[size] = res
+    return res
+
+_flipped_letters_cache = {}
 
 
 ### parsed_label_model_coordinates takes a parsed properties and returns as
 ### multiple values the row, col (in terms of the model used by goboard.py),
-### and the label letter.  Data should be "<letter><letter>:<letter>".
+### and the label letter.  Data should be "<letter><letter>:<letter>".  See
+### parsed_to_model_coordinates for size.
 ###
-def parsed_label_model_coordinates (data):
-    return parsed_to_model_coordinates(data) + (data[3],)
+def parsed_label_model_coordinates (data, size = None):
+    return parsed_to_model_coordinates(data[:2], size) + (data[3],)
     
 ### parsed_to_model_coordinates takes a parsed coordinates string and returns
 ### as multiple values the row, col in terms of the model used by goboard.py.
-### This assumes coords is "<letter><letter>" and valid indexes.
+### Coords is "<letter><letter>", or "" for a pass move.  If size is not None,
+### the coordinates must be on a board of that size (see GoBoard), so that bad
+### files fail with a parser error rather than indexing off the board.
 ###
-def parsed_to_model_coordinates (coords):
-    if coords == "":
-        ## Pass move
-        return None, None
-    else:
-        return (_letters.index(coords[1]), _letters.index(coords[0]))
+def parsed_to_model_coordinates (coords, size = None):
+    try:
+        row, col = _model_coordinates[coords]
+    except KeyError:
+        raise sgfparser.FileFormatError("Bad coordinates -- %s" % (coords))
+    if size is not None and row is not None:
+        width, height = board_dimensions(size)
+        if row > height or col > width:
+            raise sgfparser.FileFormatError(
+                "Coordinates off the board -- %s" % (coords))
+    return row, col
 
 ###
 ### Adornments
@@ -267,3 +773,48 @@ Adornments.current_move = object()
 Adornments.current_move_adornment = Adornments(Adornments.current_move, 1, 1)
 
 
+
+###
+### Board Diffs
+###
+
+### BoardDiff is what changes on the display of the board when going from one
+### position to another: the stones to remove and add, the adornments to
+### remove and add, and the moves that lose and gain the current move
+### marker.  Game makes one for each navigation command, however many moves
+### it replays or unwinds, so the UI updates the board in one batch.  Removed
+### and added are the Moves from GoBoard.end_changes.  Old_adornments and
+### new_adornments are the adornments showing in each position, not counting
+### the current move adornment, and old_current and new_current are the
+### current moves, or None for the initial board state.
+###
+class BoardDiff (object):
+
+    def __init__ (self, removed, added, old_adornments, new_adornments,
+                  old_current, new_current):
+        self.removed_stones = removed
+        self.added_stones = added
+        old_set = set(old_adornments)
+        new_set = set(new_adornments)
+        self.removed_adornments = [a for a in old_adornments if a not in new_set]
+        self.added_adornments = [a for a in new_adornments if a not in old_set]
+        ## Unmarked and marked are None if the marker stays put, and pass moves
+        ## and the initial board state have no marker.
+        if old_current is new_current:
+            self.unmarked = None
+            self.marked = None
+        else:
+            self.unmarked = _marked_move(old_current)
+            self.marked = _marked_move(new_current)
+
+    ### is_empty returns whether the display needs no update at all.
+    ###
+    def is_empty (self):
+        return (not self.removed_stones and not self.added_stones and
+                not self.removed_adornments and not self.added_adornments and
+                self.unmarked is None and self.marked is None)
+
+def _marked_move (move):
+    if move is None or move.is_pass:
+        return None
+    return move
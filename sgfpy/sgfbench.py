@@ -0,0 +1,723 @@
+### sgfbench.py is the benchmark suite for the parser and writer.  It times
+### sgfparser and game.parsed_game_from_game on generated .sgf text shaped like
+### real files (pro game records, reviews with many variations, deeply nested
+### variations, comment heavy reviews, big collections) and reports nodes and
+### bytes per second.  Run it with the same python you run the app with, for
+### example, "ipy sgfbench.py", or with CPython for batch use of the models.
+### The generators are deterministic, so numbers from different runs or
+### machines compare the same text.
+###
+### To catch regressions, save a baseline before a change and compare after:
+###     ipy sgfbench.py --save before.txt
+###     ipy sgfbench.py --compare before.txt
+### Passing a directory name times loading the .sgf files in it instead.
+###
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+import game
+import goboard
+from goboard import Colors
+import sgfcache
+import sgfcorpus
+import sgfparser
+
+
+###
+### Generating .sgf text
+###
+
+_letters = "abcdefghijklmnopqrs"
+
+_words = ["the", "black", "white", "group", "is", "dead", "alive", "here", "this",
+          "move", "should", "play", "at", "tenuki", "joseki", "sente", "gote",
+          "ko", "aji", "shape", "thickness", "territory", "moyo", "invasion"]
+
+### gen_commented_game returns the text of a game with moves nodes in which
+### every node has a comment of about comment_words words broken into lines,
+### with the occasional escaped char, like a heavily reviewed teaching game.
+###
+def gen_commented_game (moves, comment_words, seed = 1):
+    rand = random.Random(seed)
+    res = ["(;GM[1]FF[4]SZ[19]PB[Black]PW[White]KM[6.5]"]
+    color = "B"
+    for i in xrange(moves):
+        res.append("\n;%s[%s%s]" % (color, rand.choice(_letters), rand.choice(_letters)))
+        if comment_words > 0:
+            res.append("C[" + _gen_comment(rand, comment_words) + "]")
+        color = (color == "B" and "W") or "B"
+    res.append(")")
+    return "".join(res)
+
+### gen_encoded_game returns the bytes of a game like gen_commented_game, but
+### with CA[charset] and comments and player names that mix in words in the
+### charset's script.  The Shift_JIS words have second bytes that look like \.
+###
+def gen_encoded_game (moves, comment_words, charset, seed = 1):
+    rand = random.Random(seed)
+    words = _words + _charset_words[charset]
+    res = [u"(;GM[1]FF[4]CA[%s]SZ[19]PB[%s]PW[%s]KM[6.5]" %
+           (charset, rand.choice(words), rand.choice(words))]
+    color = "B"
+    for i in xrange(moves):
+        res.append(u"\n;%s[%s%s]" % (color, rand.choice(_letters), rand.choice(_letters)))
+        if comment_words > 0:
+            res.append(u"C[" + " ".join([rand.choice(words)
+                                         for j in xrange(comment_words)]) + u"]")
+        color = (color == "B" and "W") or "B"
+    res.append(u")")
+    return u"".join(res).encode(charset)
+
+_charset_words = {"UTF-8": [u"\u9ed1\u68cb", u"\u767d\u68cb", u"\u6d3b\u304d",
+                            u"\u0436\u0438\u0432\u0430\u044f", u"\uc0ac\ud65c"],
+                  "GB2312": [u"\u9ed1\u68cb", u"\u767d\u68cb", u"\u6d3b", u"\u6b7b",
+                             u"\u52ab\u4e89"],
+                  "Shift_JIS": [u"\u9ed2\u756a", u"\u8868\u793a", u"\u6d3b\u304d",
+                                u"\u30bd\u30d5\u30c8", u"\u80fd\u529b"],
+                  "ISO-8859-1": [u"d\xe9j\xe0", u"caf\xe9", u"na\xefve", u"\xfcber"]}
+
+### gen_mainline_game returns the text of a pro game record, game info and
+### moves moves (at most 361) at distinct points, with an occasional short
+### comment.
+###
+def gen_mainline_game (moves = 250, seed = 1):
+    rand = random.Random(seed)
+    points = [x + y for x in _letters for y in _letters]
+    rand.shuffle(points)
+    res = ["(;GM[1]FF[4]CA[UTF-8]AP[CGoban:3]ST[2]RU[Japanese]SZ[19]KM[6.50]TM[28800]"
+           "OT[5x60 byo-yomi]PW[%s]WR[9p]PB[%s]BR[9p]DT[20%02d-%02d-%02d]EV[%s]RE[%s]" %
+           (rand.choice(_players), rand.choice(_players), rand.randint(0, 15),
+            rand.randint(1, 12), rand.randint(1, 28), rand.choice(_events),
+            rand.choice(["B+R", "W+R", "B+2.5", "W+0.5"]))]
+    color = "B"
+    for i in xrange(moves):
+        res.append("\n;%s[%s]" % (color, points[i]))
+        if rand.random() < 0.05:
+            res.append("C[" + _gen_comment(rand, 8) + "]")
+        color = (color == "B" and "W") or "B"
+    res.append(")")
+    return "".join(res)
+
+### gen_capture_game returns the text of a game of random play that keeps
+### filling the board, so groups die and their points get played again.  This
+### plays the moves on a goboard.GoBoard to skip occupied points and self
+### captures.  Random play ends up filling its own eyes, so the game stops
+### early if there's no legal move.
+###
+def gen_capture_game (moves = 300, seed = 1):
+    rand = random.Random(seed)
+    board = goboard.GoBoard(19)
+    res = ["(;GM[1]FF[4]SZ[19]PB[Black]PW[White]KM[6.5]"]
+    colors = [("B", Colors.Black), ("W", Colors.White)]
+    for i in xrange(moves):
+        name, color = colors[i % 2]
+        legal = [goboard.Move(row, col, color) for row in xrange(1, 20)
+                 for col in xrange(1, 20) if not board.has_stone(row, col)]
+        legal = [m for m in legal if not board.is_self_capture(m)]
+        if not legal:
+            break
+        m = rand.choice(legal)
+        board.add_stone(m)
+        for dead in board.captured_stones(m):
+            board.remove_stone(dead)
+        res.append("\n;%s[%s]" % (name, goboard.get_parsed_coordinates(m, False)))
+    res.append(")")
+    return "".join(res)
+
+_players = ["Honinbo Shusaku", "Go Seigen", "Cho Chikun", "Lee Sedol", "Ke Jie",
+            "Iyama Yuta", "Shin Jinseo", "Gu Li"]
+
+_events = ["Kisei", "Meijin", "Honinbo", "LG Cup", "Samsung Cup", "Ing Cup"]
+
+### gen_wide_game returns the text of a review with many variations.  Every
+### every moves along the main line, there are branches - 1 variations of
+### branch_moves moves each.
+###
+def gen_wide_game (moves = 200, every = 5, branches = 8, branch_moves = 6, seed = 1):
+    rand = random.Random(seed)
+    res = ["(;GM[1]FF[4]SZ[19]PB[Black]PW[White]KM[6.5]\n"]
+    ## pending holds the variations to write after the rest of the main line
+    ## for each place the main line branches.
+    pending = []
+    color = "B"
+    for i in xrange(moves):
+        res.append(";%s[%s%s]" % (color, rand.choice(_letters), rand.choice(_letters)))
+        color = (color == "B" and "W") or "B"
+        if i % every == every - 1 and i != moves - 1:
+            variations = []
+            for b in xrange(branches - 1):
+                variations.append("\n(" + _gen_moves(rand, color, branch_moves) + ")")
+            pending.append("".join(variations))
+            ## The main line continues as the first branch.
+            res.append("\n(")
+        else:
+            res.append("\n")
+    for variations in reversed(pending):
+        res.append(")")
+        res.append(variations)
+    res.append(")")
+    return "".join(res)
+
+### gen_deep_game returns the text of a game whose variations nest depth deep,
+### where each move has the next move and a one move alternative.
+###
+def gen_deep_game (depth = 2000, seed = 1):
+    rand = random.Random(seed)
+    res = ["(;GM[1]FF[4]SZ[19]PB[Black]PW[White]KM[6.5]"]
+    color = "B"
+    for i in xrange(depth):
+        res.append("\n(" + _gen_moves(rand, color, 1))
+        color = (color == "B" and "W") or "B"
+    for i in xrange(depth):
+        color = (color == "B" and "W") or "B"
+        res.append(")\n(" + _gen_moves(rand, color, 1) + ")")
+    res.append(")")
+    return "".join(res)
+
+### gen_collection returns the text of a file with games game records.
+###
+def gen_collection (games = 200, moves = 250):
+    return "\n".join([gen_mainline_game(moves, seed) for seed in xrange(games)])
+
+def _gen_moves (rand, color, moves):
+    res = []
+    for i in xrange(moves):
+        res.append(";%s[%s%s]" % (color, rand.choice(_letters), rand.choice(_letters)))
+        color = (color == "B" and "W") or "B"
+    return "".join(res)
+
+def _gen_comment (rand, comment_words):
+    words = []
+    for j in xrange(comment_words):
+        words.append(rand.choice(_words))
+        if j % 12 == 11:
+            words.append("\n")
+        if j % 50 == 49:
+            words.append("a\\] and b\\\\")
+    return " ".join(words)
+
+
+###
+### Timing
+###
+
+### best_time calls fn repeat times and returns the best time in seconds.
+###
+def best_time (fn, repeat = 5):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        fn()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+### parse_text returns a ParsedGame for the first game in text.  Lazy is passed
+### to the Lexer (see sgfparser.parse_file).
+###
+def parse_text (text, lazy = False):
+    return sgfparser.parse_game(sgfparser.Lexer(text, False, lazy))
+
+### bench_parse parses text repeat times and returns the best time in seconds.
+###
+def bench_parse (text, repeat = 5, lazy = False):
+    return best_time(lambda: parse_text(text, lazy), repeat)
+
+### bench_write parses text and then writes the game repeat times to a
+### StringIO, returning the best time in seconds.
+###
+def bench_write (text, repeat = 5):
+    g = parse_text(text)
+    return best_time(lambda: g.write_to(StringIO()), repeat)
+
+### bench_collection returns the best time in seconds for indexing all the
+### games in text and parsing each one.
+###
+def bench_collection (text, repeat = 5):
+    def parse_all ():
+        c = sgfparser.GameCollection(text)
+        for i in xrange(len(c)):
+            c.get_game(i)
+    return best_time(parse_all, repeat)
+
+### bench_game_to_parsed makes a game.Game from the parsed text, replays the
+### main line so that those moves have Move objects, and returns the best time
+### in seconds for game.parsed_game_from_game, which is the first half of
+### saving a file.
+###
+def bench_game_to_parsed (text, repeat = 5):
+    win = game.GameObserver()
+    g = game.create_parsed_game(parse_text(text), win)
+    g.goto_last_move()
+    return best_time(lambda: game.parsed_game_from_game(g), repeat)
+
+### bench_resave makes a game.Game from the parsed text and replays the main
+### line like bench_game_to_parsed, so the main line must not have moves on
+### occupied points.  It returns the best times in seconds for saving the
+### whole game the first time and for saving it again after changing one
+### move's comment, which only has to rebuild that move's node text.  Saving
+### writes to a StringIO, caching node text as write_game does.
+###
+def bench_resave (text, repeat = 5):
+    win = game.GameObserver()
+    g = game.create_parsed_game(parse_text(text), win)
+    g.goto_last_move()
+    def save ():
+        game.parsed_game_from_game(g).write_to(StringIO(), True)
+    def first_save ():
+        for m in _game_moves(g):
+            m.saved_node = None
+            if m.parsed_node is not None:
+                m.parsed_node.text = None
+        save()
+    first_t = best_time(first_save, repeat)
+    ## Edit a comment in the middle of the game before each save.
+    moves = list(_game_moves(g))
+    m = moves[len(moves) / 2]
+    def edit_and_save ():
+        win.set_comment(m.comments + "!")
+        g.save_comment(m)
+        save()
+    return first_t, best_time(edit_and_save, repeat)
+
+### bench_replay returns the best time in seconds for making a game.Game from
+### the parsed text and replaying its main line, which updates the board and
+### checks for captures at each move.  Text's main line must not have moves on
+### occupied points.
+###
+def bench_replay (text, repeat = 5):
+    pg = parse_text(text)
+    def replay ():
+        g = game.create_parsed_game(pg, game.GameObserver())
+        g.goto_last_move()
+    return best_time(replay, repeat)
+
+### bench_jumps replays text's main line and then returns the best time in
+### seconds for jumping to jumps random move numbers with Game.goto_move_number,
+### using checkpoints every interval moves (see Game.checkpoint_interval).
+###
+def bench_jumps (text, interval, jumps = 200, repeat = 5):
+    g = game.create_parsed_game(parse_text(text), game.GameObserver())
+    g.checkpoint_interval = interval
+    g.goto_last_move()
+    rand = random.Random(0)
+    targets = [rand.randint(0, g.move_count) for i in xrange(jumps)]
+    def jump ():
+        for n in targets:
+            g.goto_move_number(n)
+    return best_time(jump, repeat)
+
+### bench_liberty_checks replays text's main line and then times checking
+### every stone's group for a liberty with Game.find_liberty.  This returns
+### the number of checks and the best time in seconds.
+###
+def bench_liberty_checks (text, repeat = 5):
+    g = game.create_parsed_game(parse_text(text), game.GameObserver())
+    g.goto_last_move()
+    stones = [m for row in g.board.moves for m in row if m is not None]
+    def check ():
+        for m in stones:
+            g.find_liberty(m.row, m.column, m.color)
+    return len(stones), best_time(check, repeat)
+
+### snake_board returns a full board of size (odd) whose black stones are one
+### long dragon snaking down the board row by row, with white stones between
+### the rows, so the dragon is dead and as long as a group can be.  If liberty
+### is true, the dragon's tail end is empty, so a search starting at the top
+### left has to walk the whole dragon to find its liberty.
+###
+def snake_board (size = 19, liberty = False):
+    board = goboard.GoBoard(size)
+    ## Odd rows are black, and each even row has one black stone joining the
+    ## rows above and below it at alternating ends.
+    if ((size - 1) // 2) % 2 == 1:
+        tail = (size, 1)
+    else:
+        tail = (size, size)
+    for row in xrange(1, size + 1):
+        for col in xrange(1, size + 1):
+            if liberty and (row, col) == tail:
+                continue
+            if row % 2 == 1:
+                black = True
+            elif (row // 2) % 2 == 1:
+                black = col == size
+            else:
+                black = col == 1
+            board.add_stone(goboard.Move(row, col, (black and Colors.Black) or
+                                                   Colors.White))
+    return board
+
+### bench_fills records the rates of the board's flood fills,
+### GoBoard.find_liberty and GoBoard.collect_stones, over the dead snake
+### dragon of snake_board and over the one with a liberty at its tail.
+###
+def bench_fills (results, size = 19, repeat = 50):
+    for liberty in (False, True):
+        board = snake_board(size, liberty)
+        name = (liberty and "snake dragon with liberty") or "dead snake dragon"
+        stones = len(board.collect_stones(1, 1, Colors.Black))
+        t = best_time(lambda: board.find_liberty(1, 1, Colors.Black), repeat)
+        results.record(name + " find_liberty", stones / t, "stones/s")
+        if not liberty:
+            t = best_time(lambda: board.collect_stones(1, 1, Colors.Black), repeat)
+            results.record(name + " collect_stones", stones / t, "stones/s")
+
+### _game_moves yields the Moves of game's main line.
+###
+def _game_moves (g):
+    m = g.first_move
+    while m is not None:
+        yield m
+        m = m.next
+
+### count_nodes returns the number of nodes in the tree of nodes.
+###
+def count_nodes (nodes):
+    count = 0
+    stack = [nodes]
+    while stack:
+        n = stack.pop()
+        count += 1
+        if n.branches is not None:
+            stack.extend(n.branches)
+        elif n.next is not None:
+            stack.append(n.next)
+    return count
+
+### bench_charsets parses games in each charset in _charset_words and records
+### the parse rate next to the rate of just decoding the whole text, which is
+### what reading the file as text up front would cost before any lexing.
+###
+def bench_charsets (results, moves = 1000, comment_words = 50):
+    total_bytes = 0
+    total_t = 0
+    for charset in sorted(_charset_words):
+        text = gen_encoded_game(moves, comment_words, charset)
+        t = bench_parse(text, 10)
+        results.record("%s parse" % (charset), len(text) / 1024.0 / t, "KB/s")
+        total_bytes += len(text)
+        total_t += t
+        t = best_time(lambda: text.decode(charset), 50)
+        results.record("%s decoding all text" % (charset), len(text) / 1024.0 / t, "KB/s")
+    results.record("mixed charsets parse", total_bytes / 1024.0 / total_t, "KB/s")
+
+### bench_cache writes text to a temporary file and returns the best times in
+### seconds for parsing it with parse_file and for re-opening it through a
+### warm sgfcache.ParseCache.
+###
+def bench_cache (text, repeat = 5):
+    directory = tempfile.mkdtemp()
+    try:
+        name = os.path.join(directory, "bench.sgf")
+        f = open(name, "wb")
+        f.write(text)
+        f.close()
+        cache = sgfcache.ParseCache(os.path.join(directory, "cache"))
+        cache.parse_file(name)
+        parse_best = None
+        cache_best = None
+        for i in xrange(repeat):
+            start = time.time()
+            sgfparser.parse_file(name)
+            t = time.time() - start
+            if parse_best is None or t < parse_best:
+                parse_best = t
+            start = time.time()
+            cache.parse_file(name)
+            t = time.time() - start
+            if cache_best is None or t < cache_best:
+                cache_best = t
+        return parse_best, cache_best
+    finally:
+        shutil.rmtree(directory, True)
+
+### bench_corpus loads the .sgf files in directory with 1, 2, 4, ... workers up
+### to the number of processors and prints the files per second for each, as
+### well as for reading just the game info with parse_file_header.
+###
+def bench_corpus (directory):
+    names = sgfcorpus.corpus_files(directory)
+    start = time.time()
+    errors = 0
+    for n in names:
+        try:
+            sgfparser.parse_file_header(n)
+        except Exception:
+            errors += 1
+    t = time.time() - start
+    print "corpus, %d files, headers only: %8.4fs  %8.0f files/s  (%d errors)" % \
+          (len(names), t, len(names) / t, errors)
+    workers = 1
+    while True:
+        start = time.time()
+        errors = 0
+        for r in sgfcorpus.load_corpus(names, workers):
+            if r.error is not None:
+                errors += 1
+        t = time.time() - start
+        print "corpus, %d files, %2d workers: %8.4fs  %8.0f files/s  (%d errors)" % \
+              (len(names), workers, t, len(names) / t, errors)
+        if workers >= sgfcorpus.cpu_count():
+            break
+        workers = min(workers * 2, sgfcorpus.cpu_count())
+
+
+
+###
+### Memory
+###
+
+### tree_memory returns the number of nodes and the bytes they use (node
+### objects, their dicts if any, property dicts, IDs, and values) for the tree
+### of nodes.  Objects shared between nodes, such as interned IDs, count once.
+###
+def tree_memory (nodes):
+    seen = set()
+    total = 0
+    count = 0
+    stack = [nodes]
+    while stack:
+        n = stack.pop()
+        count += 1
+        total += sys.getsizeof(n)
+        if hasattr(n, "__dict__"):
+            total += sys.getsizeof(n.__dict__)
+        total += sys.getsizeof(n.properties)
+        for k, v in n.properties.iteritems():
+            if id(k) not in seen:
+                seen.add(id(k))
+                total += sys.getsizeof(k)
+            total += sys.getsizeof(v)
+            for x in v:
+                total += sys.getsizeof(x)
+        if n.branches is not None:
+            total += sys.getsizeof(n.branches)
+            stack.extend(n.branches)
+        elif n.next is not None:
+            stack.append(n.next)
+    return count, total
+
+### _DictNode is how ParsedNode used to look, a plain object with properties
+### holding lists, for comparing memory use.
+###
+class _DictNode (object):
+    def __init__ (self):
+        self.next = None
+        self.previous = None
+        self.branches = None
+        self.properties = {}
+
+### _dict_node_copy returns a copy of the tree of nodes made of _DictNodes,
+### where each node has its own copy of its property IDs as the parser used
+### to produce (python shares one char strings, so this does too).
+###
+def _dict_node_copy (nodes):
+    def copy (n):
+        res = _DictNode()
+        for k, v in n.properties.iteritems():
+            res.properties[(k + ".")[:-1]] = list(v)
+        return res
+    first = copy(nodes)
+    stack = [(nodes, first)]
+    while stack:
+        n, new = stack.pop()
+        if n.branches is not None:
+            new.branches = []
+            for b in n.branches:
+                new_b = copy(b)
+                new_b.previous = new
+                new.branches.append(new_b)
+                stack.append((b, new_b))
+            new.next = new.branches[0]
+        elif n.next is not None:
+            new.next = copy(n.next)
+            new.next.previous = new
+            stack.append((n.next, new.next))
+    return first
+
+### bench_node_memory parses text and reports the bytes per node for the
+### parsed tree and for the same tree with the old node representation.
+###
+def bench_node_memory (results, name, text):
+    nodes = parse_text(text).nodes
+    count, new_bytes = tree_memory(nodes)
+    ignore, old_bytes = tree_memory(_dict_node_copy(nodes))
+    results.record(name + " memory", new_bytes / float(count), "bytes/node")
+    results.record(name + " memory with dict nodes", old_bytes / float(count), "bytes/node")
+
+
+###
+### Running and recording
+###
+
+### BenchResults records the numbers from a run, printing them as they come,
+### and saves and compares them with baseline files.  A baseline file has a
+### line per number, the name and unit, a tab, and the value.  Units ending in
+### "/s" are rates, where bigger is better, and smaller is better otherwise.
+###
+class BenchResults (object):
+    def __init__ (self):
+        ## values maps "<name> (<unit>)" to the number.
+        self.values = {}
+        self.keys = []
+
+    def record (self, name, value, unit):
+        key = "%s (%s)" % (name, unit)
+        print "%-50s %14.1f" % (key, value)
+        sys.stdout.flush()
+        self.values[key] = value
+        self.keys.append(key)
+
+    def save (self, filename):
+        f = open(filename, "w")
+        try:
+            for k in self.keys:
+                f.write("%s\t%r\n" % (k, self.values[k]))
+        finally:
+            f.close()
+
+    ### compare prints how each number changed from the baseline file and
+    ### returns the keys of the numbers that got worse by more than threshold
+    ### percent.
+    ###
+    def compare (self, filename, threshold):
+        baseline = read_baseline(filename)
+        regressions = []
+        print
+        print "%-50s %14s %14s %8s" % ("compared to " + filename, "baseline", "now", "change")
+        for k in self.keys:
+            if k not in baseline:
+                continue
+            old = baseline[k]
+            new = self.values[k]
+            change = 100.0 * (new - old) / old
+            if k.endswith("/s)"):
+                worse = -change
+            else:
+                worse = change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(k)
+            print "%-50s %14.1f %14.1f %+7.1f%%%s" % (k, old, new, change, flag)
+        return regressions
+
+### read_baseline returns a dictionary of the numbers in a file that
+### BenchResults.save wrote.
+###
+def read_baseline (filename):
+    res = {}
+    f = open(filename)
+    try:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                k, v = line.rsplit("\t", 1)
+                res[k] = float(v)
+    finally:
+        f.close()
+    return res
+
+### shapes returns a list of (name, text, repeat) for the generated games the
+### suite times, where repeat is how many times to time each one.
+###
+def shapes ():
+    return [("mainline", gen_mainline_game(250), 20),
+            ("wide", gen_wide_game(200, 5, 8, 6), 10),
+            ("deep", gen_deep_game(2000), 10),
+            ("review", gen_commented_game(300, 200), 5),
+            ("big review", gen_commented_game(1000, 500), 3)]
+
+### run_suite runs all the benchmarks on generated text and records the
+### numbers in results.
+###
+def run_suite (results):
+    for name, text, repeat in shapes():
+        g = parse_text(text)
+        nodes = count_nodes(g.nodes)
+        out_size = len(str(g))
+        t = bench_parse(text, repeat)
+        results.record(name + " parse", nodes / t, "nodes/s")
+        results.record(name + " parse", len(text) / 1024.0 / t, "KB/s")
+        t = bench_parse(text, repeat, True)
+        results.record(name + " lazy parse", len(text) / 1024.0 / t, "KB/s")
+        t = bench_write(text, repeat)
+        results.record(name + " write", nodes / t, "nodes/s")
+        results.record(name + " write", out_size / 1024.0 / t, "KB/s")
+    text = gen_mainline_game(250)
+    nodes = count_nodes(parse_text(text).nodes)
+    t = bench_game_to_parsed(text, 20)
+    results.record("mainline parsed_game_from_game", nodes / t, "nodes/s")
+    t = bench_replay(text, 20)
+    results.record("mainline replay", nodes / t, "nodes/s")
+    text = gen_capture_game(600)
+    nodes = count_nodes(parse_text(text).nodes)
+    t = bench_replay(text, 10)
+    results.record("capture game replay", nodes / t, "nodes/s")
+    ## An interval longer than the game means no checkpoints.
+    t = bench_jumps(text, 1000000)
+    results.record("capture game jumps without checkpoints", 200 / t, "jumps/s")
+    t = bench_jumps(text, game.Game.checkpoint_interval)
+    results.record("capture game jumps with checkpoints", 200 / t, "jumps/s")
+    text = gen_mainline_game(250)
+    checks, t = bench_liberty_checks(text, 20)
+    results.record("liberty checks", checks / t, "checks/s")
+    bench_fills(results)
+    first_t, resave_t = bench_resave(text, 20)
+    results.record("mainline first save", first_t * 1000, "ms")
+    results.record("mainline save after comment edit", resave_t * 1000, "ms")
+    games, moves = 200, 250
+    text = gen_collection(games, moves)
+    nodes = games * (moves + 1)
+    t = bench_collection(text, 3)
+    results.record("collection parse", nodes / t, "nodes/s")
+    results.record("collection parse", len(text) / 1024.0 / t, "KB/s")
+    bench_charsets(results)
+    text = gen_commented_game(1000, 500)
+    parse_t, cache_t = bench_cache(text)
+    results.record("big review parse_file", len(text) / 1024.0 / parse_t, "KB/s")
+    results.record("big review cached parse_file", len(text) / 1024.0 / cache_t, "KB/s")
+    bench_node_memory(results, "review", gen_commented_game(1000, 20))
+    bench_node_memory(results, "mainline", gen_mainline_game(361))
+
+### main runs the suite, saving or comparing with a baseline file as the
+### command line says, or if there's a directory name, the corpus loading
+### benchmark on that directory.  This exits with status 1 if the comparison
+### found regressions.
+###
+def main (args):
+    parser = argparse.ArgumentParser(description = "Time parsing and writing .sgf files.")
+    parser.add_argument("directory", nargs = "?",
+                        help = "time loading the .sgf files in this directory instead")
+    parser.add_argument("--save", metavar = "FILE",
+                        help = "save the numbers to FILE as a baseline")
+    parser.add_argument("--compare", metavar = "FILE",
+                        help = "compare the numbers with the baseline in FILE")
+    parser.add_argument("--threshold", type = float, default = 10.0,
+                        help = "percent worse that counts as a regression (default 10)")
+    opts = parser.parse_args(args)
+    if opts.directory:
+        bench_corpus(opts.directory)
+        return 0
+    results = BenchResults()
+    run_suite(results)
+    if opts.save:
+        results.save(opts.save)
+    if opts.compare:
+        regressions = results.compare(opts.compare, opts.threshold)
+        if regressions:
+            print "%d regressions" % (len(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,280 @@
+### sgfcache.py keeps parsed games in a cache directory so that re-opening a
+### big .sgf file that hasn't changed loads a compact serialization of the
+### ParsedGame tree instead of running the Lexer and parser again.  The cache
+### is opt-in; code that wants it parses with a ParseCache's parse_file rather
+### than sgfparser.parse_file.
+###
+
+import hashlib
+import marshal
+import os
+import tempfile
+import zipfile
+
+import sgfparser
+
+
+### default_max_bytes is the default limit on the total size of the cache
+### files in a cache directory.
+###
+default_max_bytes = 64 * 1024 * 1024
+
+## _cache_version is the first thing in each cache file so that we can change
+## the format and ignore old files.
+_cache_version = 2
+
+_cache_suffix = ".sgfc"
+
+### ParseCache caches ParsedGames in directory (by default a folder in the
+### system's temp folder), evicting the least recently used entries when the
+### cache files total more than max_bytes.
+###
+### Entries are keyed by the file's full path, and an entry holds the file's
+### size, modification time, and an MD5 hash of its contents.  If the size and
+### mtime match, the entry is used as is.  If only the mtime changed, the file
+### is hashed, and if the contents are the same, the entry is still used (and
+### updated with the new mtime), so touching or copying back a file does not
+### cost a re-parse.
+###
+### For a zip archive member (see sgfparser.open_game_file), the size is the
+### member's size, the mtime is the archive's, and the member's CRC stands in
+### for the MD5 hash, so a member keeps its entry while other members change.
+###
+class ParseCache (object):
+    def __init__ (self, directory = None, max_bytes = default_max_bytes):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "sgfeditor-cache")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    ### parse_file returns a ParsedGame for the named file, from the cache if
+    ### the file hasn't changed, otherwise by parsing it and adding it to the
+    ### cache.  Values are always fully decoded, so lazy parsing doesn't
+    ### apply.
+    ###
+    def parse_file (self, name):
+        size, mtime, crc = _file_stat(name)
+        cache_name = self._cache_name(name)
+        entry = self._read_entry(cache_name)
+        digest = None
+        if entry is not None:
+            entry_size, entry_mtime, entry_digest, props, kinds = entry
+            if entry_size == size:
+                if entry_mtime == mtime:
+                    _touch(cache_name)
+                    return _game_from_records(props, kinds)
+                digest = crc or _file_digest(name)
+                if digest == entry_digest:
+                    g = _game_from_records(props, kinds)
+                    self._write_entry(cache_name, size, mtime, digest, props,
+                                      kinds)
+                    return g
+        g = sgfparser.parse_file(name)
+        if digest is None:
+            digest = crc or _file_digest(name)
+        props, kinds = _records_from_game(g)
+        self._write_entry(cache_name, size, mtime, digest, props, kinds)
+        self._evict()
+        return g
+
+    ### clear removes all the cache files.
+    ###
+    def clear (self):
+        for f, size, mtime in self._cache_files():
+            _remove(f)
+
+    ### _cache_name returns the cache file name for the .sgf file name.
+    ###
+    def _cache_name (self, name):
+        key = os.path.normcase(os.path.abspath(name))
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        return os.path.join(self.directory,
+                            hashlib.md5(key).hexdigest() + _cache_suffix)
+
+    ### _read_entry returns the tuple (size, mtime, digest, props, kinds) from
+    ### the cache file, or None if there is no entry or it is unreadable.
+    ###
+    def _read_entry (self, cache_name):
+        try:
+            f = open(cache_name, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                version, size, mtime, digest = marshal.load(f)
+                if version != _cache_version:
+                    return None
+                props, kinds = marshal.load(f)
+                return size, mtime, digest, props, kinds
+            except (EOFError, ValueError, TypeError):
+                ## Old or corrupt file, treat it as a miss and overwrite it.
+                return None
+        finally:
+            f.close()
+
+    ### _write_entry writes a cache file for the game records.  This writes to
+    ### a temporary file and renames it so that readers never see a partial
+    ### entry.
+    ###
+    def _write_entry (self, cache_name, size, mtime, digest, props, kinds):
+        fd, tmp_name = tempfile.mkstemp(".tmp", "", self.directory)
+        f = os.fdopen(fd, "wb")
+        try:
+            ## Version 2 keeps interned strings (property IDs) interned.
+            marshal.dump((_cache_version, size, mtime, digest), f, 2)
+            marshal.dump((props, kinds), f, 2)
+        finally:
+            f.close()
+        ## Windows won't rename onto an existing file.
+        _remove(cache_name)
+        try:
+            os.rename(tmp_name, cache_name)
+        except OSError:
+            ## Another writer got there first, and its entry is as good.
+            _remove(tmp_name)
+
+    ### _evict removes the least recently used cache files until the total
+    ### size is at most max_bytes.
+    ###
+    def _evict (self):
+        files = self._cache_files()
+        total = sum(size for f, size, mtime in files)
+        if total <= self.max_bytes:
+            return
+        files.sort(key = lambda x: x[2])
+        for f, size, mtime in files:
+            if total <= self.max_bytes:
+                break
+            _remove(f)
+            total -= size
+
+    ### _cache_files returns a list of (name, size, mtime) for the cache files.
+    ### A file's mtime is when it was last used.
+    ###
+    def _cache_files (self):
+        res = []
+        for f in os.listdir(self.directory):
+            if f.endswith(_cache_suffix):
+                f = os.path.join(self.directory, f)
+                try:
+                    st = os.stat(f)
+                except OSError:
+                    continue
+                res.append((f, st.st_size, st.st_mtime))
+        return res
+
+
+### _records_from_game returns the game's tree as two parallel lists in
+### pre-order: each node's properties (with values as tuples), and each
+### node's kind, -1 if the node only has a next node, 0 if it ends a branch,
+### or the number of branches.  These contain only dicts, tuples, lists,
+### strings, and ints, so they marshal quickly.
+###
+def _records_from_game (game):
+    props = []
+    kinds = []
+    if game.nodes is None:
+        return props, kinds
+    stack = [game.nodes]
+    while stack:
+        n = stack.pop()
+        ## tuple() decodes values a lazy parse left undecoded.
+        props.append(dict((k, tuple(v)) for k, v in n.properties.iteritems()))
+        if n.branches is not None:
+            kinds.append(len(n.branches))
+            stack.extend(reversed(n.branches))
+        elif n.next is not None:
+            kinds.append(-1)
+            stack.append(n.next)
+        else:
+            kinds.append(0)
+    return props, kinds
+
+### _game_from_records returns a ParsedGame from the lists that
+### _records_from_game returns.
+###
+def _game_from_records (props, kinds):
+    g = sgfparser.ParsedGame()
+    if not kinds:
+        return g
+    ## prev is the node the next record follows if it only has a next node.
+    ## Otherwise, the next record is a branch of the branching node on top of
+    ## stack, which holds [node, number of branches left to read].
+    prev = None
+    stack = []
+    for i in xrange(len(kinds)):
+        n = sgfparser.ParsedNode()
+        n.properties = props[i]
+        if i == 0:
+            g.nodes = n
+        elif prev is not None:
+            prev.next = n
+            n.previous = prev
+        else:
+            top = stack[-1]
+            parent = top[0]
+            n.previous = parent
+            if not parent.branches:
+                parent.next = n
+            parent.branches.append(n)
+            top[1] -= 1
+            if top[1] == 0:
+                stack.pop()
+        kind = kinds[i]
+        if kind == -1:
+            prev = n
+        else:
+            prev = None
+            if kind > 0:
+                n.branches = []
+                stack.append([n, kind])
+    return g
+
+### _file_stat returns the size and mtime of the named file, along with its
+### CRC as a hex string if it is a zip archive member, otherwise None.  See
+### ParseCache.
+###
+def _file_stat (name):
+    archive, member = sgfparser._zip_member_name(name)
+    if archive is None:
+        st = os.stat(name)
+        return st.st_size, st.st_mtime, None
+    st = os.stat(archive)
+    z = zipfile.ZipFile(archive)
+    try:
+        info = z.getinfo(member)
+    finally:
+        z.close()
+    return info.file_size, st.st_mtime, "%08x" % (info.CRC)
+
+### _file_digest returns the MD5 hash of the named file's contents.
+###
+def _file_digest (name):
+    h = hashlib.md5()
+    f = open(name, "rb")
+    try:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            h.update(data)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+### _touch marks a cache file as just used for LRU eviction.
+###
+def _touch (name):
+    try:
+        os.utime(name, None)
+    except OSError:
+        pass
+
+def _remove (name):
+    try:
+        os.remove(name)
+    except OSError:
+        pass
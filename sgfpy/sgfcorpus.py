@@ -0,0 +1,253 @@
+### sgfcorpus.py loads whole folders of .sgf files (club game collections and
+### the like) for analysis, parsing files in several worker processes at once.
+###
+### CPython's global interpreter lock lets only one thread parse at a time, so
+### the workers are processes from multiprocessing, and they send games back
+### as the flat records sgfcache writes, which pickle quickly.  IronPython has
+### no multiprocessing, but it has no global interpreter lock either, so there
+### the workers are threads that parse truly in parallel.
+###
+### On Windows, worker processes import the main module, so scripts that call
+### load_corpus must do so under "if __name__ == '__main__':".
+###
+
+import os
+import threading
+import zipfile
+import Queue
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+import sgfcache
+import sgfparser
+
+
+### default_chunk_size is the number of files a worker takes from the work
+### queue at a time.  Small files parse in much less time than it takes to
+### hand out work, so handing out a few at once keeps workers busy.
+###
+default_chunk_size = 8
+
+
+### load_corpus is a generator that parses the files named by names (a list of
+### file names or a directory name, see corpus_files) and yields a
+### CorpusResult for each file in the order the parses complete, not the order
+### of names.  Workers is the number of worker processes, or threads on
+### IronPython (default one per processor), and chunk_size is how many files a
+### worker takes at a time.  Lazy and tolerant are passed to
+### sgfparser.parse_file, though games from worker processes come back with
+### all their values decoded.  With tolerant, malformed files still yield
+### games, and their problems are in the games' diagnostics.
+###
+### If the caller stops iterating early, the workers stop after their current
+### chunk (worker processes stop right away).
+###
+def load_corpus (names, workers = None, chunk_size = default_chunk_size,
+                 lazy = False, tolerant = False):
+    if isinstance(names, basestring):
+        names = corpus_files(names)
+    if workers is None:
+        workers = cpu_count()
+    if workers < 1 or chunk_size < 1:
+        raise Exception("Need at least one worker and one file per chunk.")
+    chunks = [names[i:i + chunk_size] for i in xrange(0, len(names), chunk_size)]
+    workers = min(workers, len(chunks))
+    if workers == 0:
+        return
+    pool = _start_pool(workers)
+    if pool is None:
+        results = _thread_results(chunks, workers, lazy, tolerant)
+    else:
+        results = _pool_results(pool, chunks, lazy, tolerant)
+    for r in results:
+        yield r
+
+### _start_pool returns a multiprocessing pool of workers processes, or None
+### if this python can't run one.
+###
+def _start_pool (workers):
+    if multiprocessing is None:
+        return None
+    try:
+        return multiprocessing.Pool(workers)
+    except (ImportError, NotImplementedError, OSError):
+        return None
+
+### _pool_results is a generator that has pool parse the chunks of file names
+### and yields a CorpusResult for each file.  Worker processes run
+### _load_chunk_records, and this rebuilds the games from the records they
+### send back.
+###
+def _pool_results (pool, chunks, lazy, tolerant):
+    try:
+        records = pool.imap_unordered(_load_chunk_records,
+                                      [(c, lazy, tolerant) for c in chunks])
+        for i in xrange(len(chunks)):
+            ## Get with a timeout so that the wait can be interrupted.
+            for r in records.next(_result_timeout):
+                yield _result_from_records(r)
+    finally:
+        pool.terminate()
+
+### _load_chunk_records is the worker process body.  It takes a tuple of a
+### list of file names, lazy, and tolerant, and it returns a list of records
+### for the CorpusResults, where games are the records from
+### sgfcache._records_from_game.  These are just lists, dicts, tuples, and
+### strings, so pickling them to send them back neither recurses down the
+### tree nor needs ParsedNodes to pickle.
+###
+def _load_chunk_records (work):
+    names, lazy, tolerant = work
+    res = []
+    for name in names:
+        r = load_corpus_file(name, lazy, tolerant)
+        if r.game is None:
+            res.append((r.name, None, None, None, r.error, r.location))
+        else:
+            props, kinds = sgfcache._records_from_game(r.game)
+            res.append((r.name, props, kinds, r.game.diagnostics, None, None))
+    return res
+
+### _result_from_records returns a CorpusResult from a record that
+### _load_chunk_records made.
+###
+def _result_from_records (record):
+    name, props, kinds, diagnostics, error, location = record
+    if props is None:
+        return CorpusResult(name, None, error, location)
+    g = sgfcache._game_from_records(props, kinds)
+    g.diagnostics = diagnostics
+    return CorpusResult(name, g)
+
+### _thread_results is a generator that parses the chunks of file names on
+### workers threads and yields a CorpusResult for each file.  This is for
+### IronPython, which has no multiprocessing.
+###
+def _thread_results (chunks, workers, lazy, tolerant):
+    work = Queue.Queue()
+    for c in chunks:
+        work.put(c)
+    results = Queue.Queue()
+    stop = threading.Event()
+    for i in xrange(workers):
+        t = threading.Thread(target = _load_chunks,
+                             args = (work, results, stop, lazy, tolerant))
+        t.daemon = True
+        t.start()
+    try:
+        for i in xrange(len(chunks)):
+            ## Get with a timeout so that the wait can be interrupted.
+            for r in results.get(True, _result_timeout):
+                yield r
+    finally:
+        stop.set()
+
+## Queue.get without a timeout can't be interrupted, so use a long one.
+_result_timeout = 1000000
+
+### _load_chunks is the worker thread body for _thread_results.  It parses
+### chunks of file names from work until there are none left or stop is set,
+### putting a list of CorpusResults on results for each chunk.
+###
+def _load_chunks (work, results, stop, lazy, tolerant):
+    while not stop.is_set():
+        try:
+            names = work.get_nowait()
+        except Queue.Empty:
+            return
+        results.put([load_corpus_file(n, lazy, tolerant) for n in names])
+
+### load_corpus_file parses the named file and returns a CorpusResult for it.
+### This never raises for a bad file; the error is in the result instead.
+###
+def load_corpus_file (name, lazy = False, tolerant = False):
+    l = None
+    data = None
+    try:
+        try:
+            l, data = sgfparser.file_lexer(name, lazy)
+            return CorpusResult(name, sgfparser.parse_game(l, tolerant))
+        except Exception, err:
+            ## l is None if we couldn't read the file at all.
+            return CorpusResult(name, None, err, l and l.location())
+    finally:
+        if data is not None:
+            data.close()
+
+### load_zip_corpus is a generator that parses each .sgf member of the named
+### zip archive, in archive order, and yields a CorpusResult for it.  Result
+### names are the archive name joined with the member name, which
+### sgfparser.parse_file accepts.  This opens the archive once and
+### decompresses each member in one go, rather than opening the archive for
+### each member as parse_file would.  Lazy and tolerant are as for load_corpus.
+###
+def load_zip_corpus (name, lazy = False, tolerant = False):
+    z = zipfile.ZipFile(name)
+    try:
+        for info in z.infolist():
+            if info.filename.lower().endswith(".sgf"):
+                yield _load_zip_member(z, info, os.path.join(name, info.filename),
+                                       lazy, tolerant)
+    finally:
+        z.close()
+
+def _load_zip_member (z, info, name, lazy, tolerant):
+    l = None
+    try:
+        l = sgfparser.Lexer(z.read(info), True, lazy)
+        return CorpusResult(name, sgfparser.parse_game(l, tolerant))
+    except Exception, err:
+        return CorpusResult(name, None, err, l and l.location())
+
+
+### CorpusResult holds the outcome of parsing one file.  If the parse
+### succeeded, game is the ParsedGame and error is None.  Otherwise game is
+### None, error is the exception, and location is the Lexer's location in the
+### file when the error happened (None if the file couldn't be read).
+###
+class CorpusResult (object):
+    def __init__ (self, name, game, error = None, location = None):
+        self.name = name
+        self.game = game
+        self.error = error
+        self.location = location
+
+    def __repr__ (self):
+        if self.error is None:
+            return "<CorpusResult %s>" % (self.name)
+        else:
+            return "<CorpusResult %s: error at %s -- %s>" % \
+                   (self.name, self.location, self.error)
+
+
+### corpus_files returns the sorted full names of the .sgf and .sgf.gz files
+### in directory and its sub directories.
+###
+def corpus_files (directory):
+    res = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for f in filenames:
+            lower = f.lower()
+            if lower.endswith(".sgf") or lower.endswith(".sgf.gz"):
+                res.append(os.path.join(dirpath, f))
+    res.sort()
+    return res
+
+### cpu_count returns the number of processors, which is the default number
+### of workers for load_corpus.
+###
+def cpu_count ():
+    if multiprocessing is not None:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            pass
+    try:
+        ## IronPython doesn't have multiprocessing.
+        from System import Environment
+    except ImportError:
+        return 1
+    return Environment.ProcessorCount
@@ -5,16 +5,36 @@
 ### while following nodes should represent a game, but the nodes could
 ### represent setup for a problem.
 ###
+### parse_file maps a whole file at once.  parse_stream and parse_events read
+### a file object a chunk at a time for very big files.  parse_collection
+### indexes all the games in a file and parses them on demand.
+###
+### parse_file and parse_file_header also read gzip files and zip archive
+### members, and game.write_game writes them, through open_game_file.
+###
+### The Lexer scans the file's bytes, and only property values get decoded,
+### using the charset in the root node's CA property (see _parse_root_node).
+### Writing always produces UTF-8.
+###
 
+import codecs
+import gzip
+import mmap
+import os
 import re
-from System.IO import FileFormatException
+import tempfile
+import time
+import zipfile
+from cStringIO import StringIO
 
 
 
 class ParsedGame (object):
     def __init__ (self):
-        ## nodes is the only public member.
         self.nodes = None
+        ## diagnostics holds a ParseDiagnostic for each problem a tolerant
+        ## parse skipped over (see parse_file).
+        self.diagnostics = []
 
     ### __str__ produces a strong that when printed to a file generates a valid
     ### .sgf file.
@@ -23,34 +43,107 @@ class ParsedGame (object):
         if self.nodes is None:
             return ""  ## Min tree is "(;)", but that implies one empty node
         else:
-            return "(" + self._nodes_string(self.nodes) + ")"
-    
-    ### _nodes_string returns a string for a series of nodes, and the caller
-    ### needs to supply the open and close parens that bracket the series.
+            f = StringIO()
+            self.write_to(f)
+            return f.getvalue()
+
+    ### write_to writes the .sgf text for the game to the file object f, one
+    ### node at a time, so writing takes time linear in the size of the game
+    ### and never builds the whole text in memory.  This walks the tree with
+    ### an explicit stack of branch iterators rather than recursing, so deeply
+    ### nested variations are fine too.
     ###
-    def _nodes_string (self, nodes):
-        res = ""
-        while nodes.next is not None:
-            ## Get one node's string with a leading newline if it is not the
-            ## first.
-            res += nodes.node_str(res != "")
-            if nodes.branches is not None:
-                for n in nodes.branches:
-                    res = res + "\n(" + self._nodes_string(n) + ")"
-                return res
-            nodes = nodes.next
-        res += nodes.node_str(res != "") # Test res, could be single node branch.
-        return res
-    
+    ### If cache_text is true, then this saves each node's text in the node's
+    ### text slot, and later writes use it instead of building the text again.
+    ### This suits games that are saved over and over (see game.write_game),
+    ### where code that changes a node's properties has to reset its text.
+    ###
+    def write_to (self, f, cache_text = False):
+        if self.nodes is None:
+            return
+        write = f.write
+        write("(")
+        ## branches holds an iterator over the remaining branches for each
+        ## branching node we're in.
+        branches = []
+        node = self.nodes
+        newline = False
+        while True:
+            ## Write one node with a leading newline if it is not the first in
+            ## its branch.
+            if newline:
+                write("\n")
+            if node is self.nodes:
+                s = self._root_node_str()
+                if isinstance(s, unicode):
+                    s = s.encode("utf-8")
+            else:
+                s = node.text
+                if s is None:
+                    s = node.node_str(False)
+                    if isinstance(s, unicode):
+                        s = s.encode("utf-8")
+                    if cache_text:
+                        node.text = s
+            write(s)
+            newline = True
+            if node.branches is not None:
+                branches.append(iter(node.branches))
+            elif node.next is not None:
+                node = node.next
+                continue
+            else:
+                ## End of a branch.
+                write(")")
+            ## Start the next branch of the innermost branching node that has
+            ## one left, closing branches that are done.
+            while branches:
+                node = next(branches[-1], None)
+                if node is not None:
+                    break
+                branches.pop()
+                write(")")
+            else:
+                return
+            write("\n(")
+            newline = False
+
+    ### _root_node_str returns the root node's string for write_to.  Values are
+    ### written as UTF-8, so if the game came from a file with some other
+    ### charset, the CA property has to say UTF-8 now.
+    ###
+    def _root_node_str (self):
+        root = self.nodes
+        ca = root.properties.get("CA")
+        if ca is None or _charset_name(ca[0]) == "utf-8":
+            return root.node_str(False)
+        tmp = ParsedNode()
+        tmp.properties = dict(root.properties)
+        tmp.properties["CA"] = ("UTF-8",)
+        return tmp.node_str(False)
 
 
 
+### ParsedNode is one node of a game.  Properties maps property IDs to
+### sequences of string values.  Big files and collections have hundreds of
+### thousands of nodes, so nodes have no per-instance dict, the parser interns
+### IDs (so each "B", "W", "C", etc. is one shared string), and parsed values
+### are tuples (or _LazyValues when parsing lazily).  Code that needs to modify
+### a node's values should replace them or copy them to a list, as
+### game._copy_properties does.
+###
+### Text is the node's .sgf text (without a leading newline) when
+### ParsedGame.write_to caches it, otherwise None.
+###
 class ParsedNode (object):
+    __slots__ = ("next", "previous", "branches", "properties", "text")
+
     def __init__ (self):
         self.next = None
         self.previous = None
         self.branches = None
         self.properties = {}
+        self.text = None
     
     ### node_str returns the string for one node, taking a flag for a
     ### preceding newline and the dictionary of properties for the node.
@@ -58,60 +151,585 @@ class ParsedNode (object):
     def node_str (self, newline):
         props = self.properties
         if newline:
-            s = "\n;"
+            res = ["\n;"]
         else:
-            s = ";"
+            res = [";"]
         ## Print move property first for readability of .sgf file by humans.
         if "B" in props:
-            s = s + "B" + self._escaped_property_values("B", props["B"])
+            res.append("B")
+            res.append(self._escaped_property_values("B", props["B"]))
         if "W" in props:
-            s = s + "W" + self._escaped_property_values("W", props["W"])
+            res.append("W")
+            res.append(self._escaped_property_values("W", props["W"]))
         for k,v in props.iteritems():
             if k == "B" or k == "W": continue
-            s = s + k + self._escaped_property_values(k, v)
-        return s
+            res.append(k)
+            res.append(self._escaped_property_values(k, v))
+        return "".join(res)
 
     ### _escaped_property_values returns a node's property value with escapes so that the .sgf
     ### is valid.  So, ] and \ must be preceded by a backslash.
     ###
     def _escaped_property_values (self, id, values):
-        res = ""
+        res = []
         for v in values:
-            res = res + "["
             if "]" in v or "\\" in v:
-                tmp = []
-                for c in v:
-                    if c == "]" or c == "\\":
-                        tmp.append("\\")
-                    tmp.append(c)
-                tmp.append("]")
-                res = res + "".join(tmp)
-            else:
-                res = res + v + "]"
-        return res
+                v = v.replace("\\", "\\\\").replace("]", "\\]")
+            res.append("[")
+            res.append(v)
+            res.append("]")
+        return "".join(res)
+
+
+
+### _LazyValues is a sequence of property values that holds the (start, end)
+### spans of their raw text in a file's contents.  It unescapes the values the
+### first time someone looks at them and then drops the raw text.  See
+### Lexer.get_lazy_property_values.
+###
+class _LazyValues (object):
+    __slots__ = ("_data", "_spans", "_keep_newlines", "_binary", "charset",
+                 "_values")
+
+    ### charset is the Lexer's charset when it found the values, and the
+    ### parser sets it for lazy values in the root node once it knows it.
+    ###
+    def __init__ (self, data, spans, keep_newlines, binary, charset):
+        self._data = data
+        self._spans = spans
+        self._keep_newlines = keep_newlines
+        self._binary = binary
+        self.charset = charset
+        self._values = None
+
+    ### get_values returns a tuple of the unescaped (and decoded) values.
+    ###
+    def get_values (self):
+        if self._values is None:
+            l = Lexer(self._data, self._binary)
+            values = []
+            for start, end in self._spans:
+                l.set_location(start)
+                v = l.get_property_value(self._keep_newlines)
+                if self.charset is not None:
+                    v = _decode_value(v, self.charset)
+                values.append(v)
+            self._values = tuple(values)
+            self._data = None
+            self._spans = None
+        return self._values
+
+    def __len__ (self):
+        if self._values is None:
+            return len(self._spans)
+        return len(self._values)
 
+    def __getitem__ (self, i):
+        return self.get_values()[i]
 
+    def __iter__ (self):
+        return iter(self.get_values())
 
-def parse_file (name):
-    f = open(name)
-    l = Lexer(f.read())
-    f.close()
-    l.scan_for("(", "Can't find game start")
+    def __repr__ (self):
+        return repr(self.get_values())
+
+
+
+### parse_file memory maps the file rather than reading it into a string, so
+### the only copies of the file's text are the property values the Lexer
+### slices out of the map.
+###
+### If lazy is true, then long property values (big comments, engine analysis,
+### etc.) are not unescaped until code first looks at them (see
+### Lexer.get_lazy_property_values).  Lazy values refer to the file's text, so
+### lazy parsing reads the file into a string rather than mapping it, and
+### that string lives until all the lazy values have been looked at.
+###
+### If tolerant is true, then problems in the file don't stop the parse (see
+### parse_game).
+###
+def parse_file (name, lazy = False, tolerant = False):
+    l, data = file_lexer(name, lazy)
+    try:
+        return parse_game(l, tolerant)
+    finally:
+        if data is not None:
+            data.close()
+
+### file_lexer returns a Lexer for the named file as parse_file uses it, along
+### with the file's memory map, which the caller closes when done parsing (or
+### None if there is nothing to close).  Callers that want to know where a
+### parse error happened can parse with parse_game and ask the Lexer for its
+### location.
+###
+def file_lexer (name, lazy = False):
+    if _is_compressed_name(name):
+        ## Decompress as the Lexer reads unless lazy values need all the text.
+        f = open_game_file(name)
+        if not lazy:
+            return StreamLexer(f, StreamLexer.default_chunk_size, True), f
+        try:
+            return Lexer(f.read(), True, True), None
+        finally:
+            f.close()
+    if lazy:
+        f = open(name, "rb")
+        try:
+            return Lexer(f.read(), True, True), None
+        finally:
+            f.close()
+    data = _map_file(name)
+    return Lexer(data or "", True), data
+
+### parse_game parses the first game in the text of lexer and returns a
+### ParsedGame.
+###
+### If tolerant is true, then this salvages what it can from a malformed game
+### rather than raising at the first problem.  Each problem (duplicate
+### property IDs, stray chars, nodes after branches, EOF in the middle of the
+### game, etc.) becomes a ParseDiagnostic in the game's diagnostics, and
+### parsing picks up at the next ;, (, or ) outside of a property value.  This
+### still makes one pass over the text.  It raises only if there is no game
+### start at all.
+###
+def parse_game (lexer, tolerant = False):
+    lexer.scan_for("(", "Can't find game start")
     g = ParsedGame()
-    g.nodes = _parse_nodes(l)
+    if tolerant:
+        lexer.diagnostics = g.diagnostics
+        g.nodes = _parse_nodes_tolerant(lexer)
+    else:
+        g.nodes = _parse_nodes(lexer)
     return g
 
+### ParseDiagnostic describes one problem a tolerant parse skipped over, with
+### the Lexer's location when it found the problem.
+###
+class ParseDiagnostic (object):
+    def __init__ (self, location, message):
+        self.location = location
+        self.message = message
+
+    def __str__ (self):
+        return "%s -- file location %s" % (self.message, self.location)
+
+    def __repr__ (self):
+        return "<ParseDiagnostic %s>" % (self)
+
+### FileFormatError is the exception for .sgf text that is malformed or ends
+### too soon.  It is a plain Python exception, rather than .NET's
+### System.IO.FileFormatException, so parsing runs under plain CPython too.
+###
+class FileFormatError (Exception):
+    pass
+
+### parse_file_header returns the root ParsedNode of the first game in the
+### named file, which has the game info (players, date, result, size, komi,
+### etc.).  This reads the file in small chunks and stops right after the root
+### node, so it never reads or lexes the moves, and scanning the game info of
+### many files costs little more than opening them.
+###
+def parse_file_header (name):
+    f = open_game_file(name)
+    try:
+        l = StreamLexer(f, header_chunk_size, True)
+        l.scan_for("(", "Can't find game start")
+        l.scan_for(";", "Must be one node in each branch")
+        return _parse_root_node(l)
+    finally:
+        f.close()
+
+## Root nodes are usually a few hundred bytes, so there's no need to read the
+## 64K chunks that whole file parsing uses.
+header_chunk_size = 4 * 1024
+
+### open_game_file opens the named game file for reading ("rb") or writing
+### ("w") and returns a file object.  Names ending in .gz are gzip files, and
+### a name that continues past a .zip file, such as
+### "games.zip\2019\final.sgf", names a member of that zip archive.  Reading a
+### compressed file decompresses as the caller reads, so there's no temporary
+### file.  Writing a zip member stores it when the file object closes (see
+### _ZipMemberWriter), and if writing fails, callers should drop what they
+### wrote with discard_game_file instead of closing.
+###
+def open_game_file (name, mode = "rb"):
+    archive, member = _zip_member_name(name)
+    if mode == "rb":
+        if archive is not None:
+            z = zipfile.ZipFile(archive)
+            try:
+                ## The member's file object keeps the archive open.
+                return z.open(member)
+            finally:
+                z.close()
+        elif _is_gzip_name(name):
+            return gzip.open(name, "rb")
+        else:
+            return open(name, "rb")
+    elif mode == "w":
+        if archive is not None:
+            return _ZipMemberWriter(archive, member)
+        elif _is_gzip_name(name):
+            return gzip.open(name, "wb")
+        else:
+            return open(name, "w")
+    else:
+        raise Exception("Game files open with mode rb or w -- got %s." % (mode))
+
+### _zip_member_name returns the archive name and member name if name is a
+### path through a .zip file (see open_game_file), otherwise None, None.  Zip
+### member names always use forward slashes.
+###
+def _zip_member_name (name):
+    lower = name.lower()
+    i = lower.find(".zip")
+    while i != -1:
+        end = i + 4
+        if end < len(name) and name[end] in "/\\" and os.path.isfile(name[:end]):
+            return name[:end], name[end + 1:].replace("\\", "/")
+        i = lower.find(".zip", end)
+    return None, None
+
+### discard_game_file closes the file object f from open_game_file(name, "w")
+### when writing it failed.  For a zip archive member, this drops the text
+### written so far, so the archive keeps the member it had.  Other files have
+### already been written to, so this just closes them.
+###
+def discard_game_file (f):
+    if isinstance(f, _ZipMemberWriter):
+        f.discard()
+    else:
+        f.close()
+
+def _is_gzip_name (name):
+    return name.lower().endswith(".gz")
+
+def _is_compressed_name (name):
+    return _is_gzip_name(name) or _zip_member_name(name)[0] is not None
+
+### _ZipMemberWriter is the file object open_game_file returns for writing a
+### zip archive member.  It collects the text and stores it in the archive on
+### close, or drops it on discard.  A new member is appended to the archive, but zip files can't
+### replace a member in place, so replacing one copies the other members to a
+### new archive that then replaces the old one.
+###
+class _ZipMemberWriter (object):
+    def __init__ (self, archive, member):
+        self._archive = archive
+        self._member = member
+        self._buffer = StringIO()
+
+    def write (self, s):
+        self._buffer.write(s)
+
+    def discard (self):
+        self._buffer = None
+
+    def close (self):
+        if self._buffer is None:
+            return
+        data = self._buffer.getvalue()
+        self._buffer = None
+        z = zipfile.ZipFile(self._archive)
+        try:
+            exists = self._member in z.namelist()
+        finally:
+            z.close()
+        if not exists:
+            z = zipfile.ZipFile(self._archive, "a", zipfile.ZIP_DEFLATED)
+            try:
+                z.writestr(self._new_info(), data)
+            finally:
+                z.close()
+            return
+        directory = os.path.dirname(os.path.abspath(self._archive))
+        fd, tmp_name = tempfile.mkstemp(".tmp", "", directory)
+        os.close(fd)
+        try:
+            src = zipfile.ZipFile(self._archive)
+            dst = zipfile.ZipFile(tmp_name, "w", zipfile.ZIP_DEFLATED)
+            try:
+                for info in src.infolist():
+                    if info.filename == self._member:
+                        dst.writestr(self._new_info(), data)
+                    else:
+                        dst.writestr(info, src.read(info))
+            finally:
+                dst.close()
+                src.close()
+            ## Windows won't rename onto an existing file.
+            os.remove(self._archive)
+            os.rename(tmp_name, self._archive)
+        except:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def _new_info (self):
+        info = zipfile.ZipInfo(self._member, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+### _map_file returns a read-only mmap of the named file, or None if the file
+### is empty (which mmap does not allow).
+###
+def _map_file (name):
+    f = open(name, "rb")
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        ## The map keeps its own handle to the file.
+        return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+### parse_stream reads a game from the file object f in chunks of chunk_size
+### characters and returns a ParsedGame just like parse_file.  The Lexer only
+### keeps the text of the node being parsed plus one chunk, so this is the
+### entry point for very big files, and parse_events is the entry point for
+### callers that want to see nodes as they are parsed.
+###
+def parse_stream (f, chunk_size = None):
+    builder = ParsedGameBuilder()
+    for event, node in parse_events(f, chunk_size):
+        builder.add(event, node)
+    return builder.game
+
+### parse_events is a generator that reads a game from the file object f in
+### chunks and yields (event, node) pairs as it goes.  Event is one of the
+### ParseEvent kinds, and node is the new ParsedNode for ParseEvent.node and
+### None otherwise.  The outermost parens of the game generate a branch_start
+### and branch_end pair too.  This does not link nodes together (see
+### ParsedGameBuilder), so if the caller drops nodes as it consumes them, then
+### memory is bounded by the depth of the game tree rather than the file size.
+###
+def parse_events (f, chunk_size = None):
+    lexer = StreamLexer(f, chunk_size or StreamLexer.default_chunk_size)
+    lexer.scan_for("(", "Can't find game start")
+    for event in _parse_events(lexer):
+        yield event
+
+### _parse_events is the generator behind parse_events.  The lexer must be
+### just past the open paren of a game, and this stops after the matching close
+### paren.  Like _parse_nodes, this keeps an explicit stack of open branches.
+###
+def _parse_events (lexer):
+    yield ParseEvent.branch_start, None
+    lexer.scan_for(";", "Must be one node in each branch")
+    yield ParseEvent.node, _parse_root_node(lexer)
+    ## branching_yet holds a flag for each open branch, noting whether we've
+    ## seen sub branches in it yet (after which no more nodes can follow).
+    branching_yet = [False]
+    while lexer.has_data():
+        ## Done with all text before the next node or paren.
+        lexer.release()
+        ## Semi-colon starts another node, open paren starts a branch, close
+        ## paren stops list of nodes.  Scanning raises an exception if one of
+        ## these chars fails to follow (ignoring whitespace).
+        char = lexer.scan_for(";()")
+        if char == ";":
+            if branching_yet[-1]:
+                raise Exception("Found node after branching started.")
+            yield ParseEvent.node, _parse_node(lexer)
+        elif char == "(":
+            branching_yet[-1] = True
+            branching_yet.append(False)
+            yield ParseEvent.branch_start, None
+            lexer.scan_for(";", "Must be one node in each branch")
+            yield ParseEvent.node, _parse_node(lexer)
+        elif char == ')':
+            branching_yet.pop()
+            yield ParseEvent.branch_end, None
+            if not branching_yet:
+                return
+        else:
+            raise FileFormatError("SGF file is malformed at char " + str(lexer.location()))
+    raise FileFormatError("Unexpectedly hit EOF!")
+
+### ParseEvent holds the kinds of events parse_events generates.
+###
+class ParseEvent (object):
+    branch_start = object()
+    node = object()
+    branch_end = object()
+
+### ParsedGameBuilder links the nodes from parse_events into a ParsedGame
+### with the same next, previous, and branches structure that parse_file
+### produces.  The game member is usable as soon as the first node has been
+### added, so the UI can create a game from the root node and first moves
+### and keep adding events while the user looks at them.  Game
+### (_ready_for_rendering) only looks at a parsed node's next and branches
+### when rendering its move, so moves that have arrived by then just work.
+###
+class ParsedGameBuilder (object):
+    def __init__ (self):
+        ## game is the only public member.
+        self.game = ParsedGame()
+        ## _cur_node is the last node added to the current branch.
+        self._cur_node = None
+        ## _parents holds the node each open branch follows (None for the
+        ## outermost parens).
+        self._parents = []
+        ## _new_branch is True right after a branch_start.
+        self._new_branch = False
+
+    def add (self, event, node):
+        if event is ParseEvent.node:
+            if not self._new_branch:
+                self._cur_node.next = node
+                node.previous = self._cur_node
+            elif self._cur_node is None:
+                self.game.nodes = node
+            else:
+                parent = self._cur_node
+                if parent.branches is None:
+                    parent.next = node
+                    parent.branches = [node]
+                else:
+                    parent.branches.append(node)
+                node.previous = parent
+            self._new_branch = False
+            self._cur_node = node
+        elif event is ParseEvent.branch_start:
+            self._parents.append(self._cur_node)
+            self._new_branch = True
+        elif event is ParseEvent.branch_end:
+            self._cur_node = self._parents.pop()
+        else:
+            raise Exception("Unknown parse event.")
+        return node
+
+### parse_collection reads a file with any number of games in it, "(;...)(;...)",
+### and returns a GameCollection.  This only finds where the games are in the
+### file, and it parses a game when you ask for it, so opening one game in a
+### big collection does not cost parsing all the games before it.  The file is
+### memory mapped, so indexing a huge archive costs page cache rather than a
+### copy of the file, and offsets are byte offsets.  Call close() on the
+### collection when done with it to release the file.
+###
+def parse_collection (name):
+    data = _map_file(name)
+    return GameCollection(data or "", True)
+
+### GameCollection holds the text of a collection file and an index of where
+### each top level game is.  Use len() for the number of games and
+### get_game(i) to parse game i.
+###
+class GameCollection (object):
+    def __init__ (self, contents, binary = False):
+        self._data = contents
+        self._binary = binary
+        ## offsets holds a (start, end) pair for each game, where start is the
+        ## index of the game's open paren and end is the index after its close
+        ## paren.
+        self.offsets = index_games(contents)
+
+    def __len__ (self):
+        return len(self.offsets)
+
+    ### get_game parses game i and returns a ParsedGame.  Errors report file
+    ### locations relative to the whole collection.  Tolerant is as for
+    ### parse_game.
+    ###
+    def get_game (self, i, tolerant = False):
+        start, end = self.offsets[i]
+        l = Lexer(self._data, self._binary)
+        l.set_location(start)
+        return parse_game(l, tolerant)
+
+    ### close releases the collection's file if it came from parse_collection.
+    ### Games already parsed remain valid.
+    ###
+    def close (self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = ""
+
+### index_games returns a list of (start, end) pairs for each top level game
+### in contents (see GameCollection.offsets).  It makes one pass matching
+### parens, skipping over property values since they may contain parens, but
+### it does not parse nodes or property values other than each game's root
+### node (see _index_root_node).  Text between games is ignored.
+###
+def index_games (contents):
+    offsets = []
+    search = _collection_regexp.search
+    skip_value = _value_end_regexp.match
+    depth = 0
+    start = 0
+    i = 0
+    while True:
+        match = search(contents, i)
+        if match is None:
+            break
+        c = match.group()
+        i = match.end()
+        if c == "(":
+            if depth == 0:
+                start = match.start()
+                ## Each game can have its own charset.
+                skip_value, i = _index_root_node(contents, i)
+            depth += 1
+        elif depth == 0:
+            ## Ignore brackets or close parens between games.
+            continue
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                offsets.append((start, i))
+        else:
+            value_end = skip_value(contents, i)
+            if value_end is None:
+                break
+            i = value_end.end()
+    if depth != 0:
+        raise FileFormatError("Unexpectedly hit EOF!")
+    return offsets
+
+### _index_root_node parses the root node of the game whose open paren is
+### just before index i in contents, and it returns a function that matches
+### the rest of a property value in the game's charset (see
+### _value_end_regexp) along with the index after the root node.  In double
+### byte charsets, the second byte of a char can be \ or ], so index_games
+### can't skip values right without the charset from the root's CA.  If the
+### root node is malformed, index_games skips over it like any other node.
+###
+def _index_root_node (contents, i):
+    l = Lexer(contents, True)
+    l.set_location(i)
+    try:
+        l.scan_for(";", "Must be one node in each branch")
+        _parse_root_node(l)
+    except Exception:
+        return _value_end_regexp.match, i
+    regexp = _value_end_regexps.get(l.charset, _value_end_regexp)
+    return regexp.match, l.location()
+
+## _collection_regexp matches the chars index_games looks for.
+_collection_regexp = re.compile(r'[()\[]')
+## _value_end_regexp matches the rest of a property value after the open
+## bracket, including the close bracket, where backslash escapes any char.
+## This is for single byte charsets and UTF-8 (see _value_end_regexps).
+_value_end_regexp = re.compile(r'[^\\\]]*(?:\\.[^\\\]]*)*\]', re.DOTALL)
+
+
 ### _parse_nodes returns a linked list of ParseNodes.  It starts scanning for a
 ### semi-colon for the start of the first node.  If it encounters an open
-### paren, it recurses and creates branches that follow the current node,
-### making the next pointer of the current node point to the first node in the
-### first branch.
+### paren, it creates branches that follow the current node, making the next
+### pointer of the current node point to the first node in the first branch.
+###
+### Rather than recursing on each open paren, this keeps an explicit stack of
+### the branches we're in, so arbitrarily deep nesting of variations uses a
+### constant number of python stack frames.  Each stack entry holds the first
+### node of a branch, the current (last) node of the branch, and whether we've
+### started the branch's sub branches.
 ###
 def _parse_nodes (lexer):
     lexer.scan_for(";", "Must be one node in each branch")
-    cur_node = _parse_node(lexer)
+    cur_node = _parse_root_node(lexer)
     first = cur_node
     branching_yet = False
+    stack = []
     while lexer.has_data():
         ## Semi-colon starts another node, open paren starts a branch, close
         ## paren stops list of nodes.  Scanning raises an exception if one of
@@ -124,55 +742,312 @@ def _parse_nodes (lexer):
             cur_node.next.previous = cur_node
             cur_node = cur_node.next
         elif char == "(":
+            ## Save current branch and start a new one with its first node.
+            stack.append((first, cur_node))
+            lexer.scan_for(";", "Must be one node in each branch")
+            n = _parse_node(lexer)
+            n.previous = cur_node
             if not branching_yet:
-                cur_node.next = _parse_nodes(lexer)
-                cur_node.next.previous = cur_node
-                cur_node.branches = [cur_node.next]
-                branching_yet = True
+                cur_node.next = n
+                cur_node.branches = [n]
             else:
-                n = _parse_nodes(lexer)
-                n.previous = cur_node
                 cur_node.branches.append(n)
+            first = n
+            cur_node = n
+            branching_yet = False
         elif char == ')':
+            if not stack:
+                return first
+            ## Finished a branch, so pop back to the node it follows, which
+            ## now has started its branches.
+            first, cur_node = stack.pop()
+            branching_yet = True
+        else:
+            raise FileFormatError("SGF file is malformed at char " + str(lexer.location()))
+    raise FileFormatError("Unexpectedly hit EOF!")
+
+### _parse_nodes_tolerant is _parse_nodes for tolerant parsing (see
+### parse_game).  The lexer's diagnostics collect the problems.  Whatever goes
+### wrong, this keeps the nodes parsed so far:
+###    Errors inside a node end that node with the properties parsed so far.
+###    A node after a node's branches becomes another branch.
+###    A branch with no node gets an empty node.
+###    Stray chars between nodes are skipped.
+###    EOF closes all open branches.
+###
+### Stack entries are like those in _parse_nodes plus a flag noting the entry
+### is for a branch made from a node after branches, which has no close paren
+### of its own.
+###
+def _parse_nodes_tolerant (lexer):
+    first = _parse_first_node_tolerant(lexer, True)
+    cur_node = first
+    branching_yet = False
+    stack = []
+    while True:
+        try:
+            char = lexer.scan_for(";()")
+        except Exception, err:
+            if lexer.has_data():
+                lexer.diagnose(_error_message(err))
+                if lexer.resync():
+                    continue
+            ## EOF, so return the game so far unless the last node already
+            ## reported it.
+            if not lexer.diagnostics or lexer.diagnostics[-1].location != lexer.location():
+                lexer.diagnose("Unexpectedly hit EOF!")
+            if stack:
+                return stack[0][0]
             return first
+        if char == ";":
+            if not branching_yet:
+                n = _parse_node_tolerant(lexer)
+                cur_node.next = n
+                n.previous = cur_node
+                cur_node = n
+                continue
+            lexer.diagnose("Found node after branching started.")
+            n = _parse_node_tolerant(lexer)
+            stack.append((first, cur_node, True))
+            cur_node.branches.append(n)
+            n.previous = cur_node
+            first = n
+            cur_node = n
+            branching_yet = False
+        elif char == "(":
+            stack.append((first, cur_node, False))
+            n = _parse_first_node_tolerant(lexer, False)
+            n.previous = cur_node
+            if not branching_yet:
+                cur_node.next = n
+                cur_node.branches = [n]
+            else:
+                cur_node.branches.append(n)
+            first = n
+            cur_node = n
+            branching_yet = False
         else:
-            raise FileFormatException("SGF file is malformed at char " + str(lexer.Location))
-    raise FileFormatException("Unexpectedly hit EOF!")
+            ## Close paren, so pop any branches made from nodes after branches,
+            ## and then the branch the paren closes.
+            while stack and stack[-1][2]:
+                first, cur_node, ignore = stack.pop()
+            if not stack:
+                return first
+            first, cur_node, ignore = stack.pop()
+            branching_yet = True
+
+### _parse_first_node_tolerant parses the first node of a branch, or the root
+### if root is true, returning an empty node if there's no semi-colon.  If the
+### root has an error, its values are decoded as UTF-8 unless its CA was
+### already found.
+###
+def _parse_first_node_tolerant (lexer, root):
+    i, ignore = lexer.peek_for(";")
+    if i is None:
+        lexer.diagnose("Must be one node in each branch")
+        if root and lexer.charset is None:
+            lexer.set_charset("utf-8")
+        return ParsedNode()
+    lexer.set_location(i)
+    if not root:
+        return _parse_node_tolerant(lexer)
+    try:
+        return _parse_root_node(lexer)
+    except Exception:
+        ## Parse the root again to keep the properties before the error, which
+        ## also records the error.  See _parse_root_node about set_location.
+        if lexer.charset is None:
+            lexer.set_charset("utf-8")
+        lexer.set_location(i)
+        return _parse_node_tolerant(lexer)
 
-### _parse_node returns a ParseNode with its properties filled in.
+### _parse_node_tolerant returns a node like _parse_node, but if there's an
+### error in the node, it returns the node with the properties parsed before
+### the error.
 ###
-def _parse_node (lexer):
+def _parse_node_tolerant (lexer):
     node = ParsedNode()
+    try:
+        _parse_node(lexer, node)
+    except Exception, err:
+        lexer.diagnose(_error_message(err))
+    return node
+
+### _error_message returns the message of a python or .NET exception without
+### the file location that lexer messages end with, since diagnostics have
+### their own location.
+###
+def _error_message (err):
+    msg = getattr(err, "Message", None) or str(err)
+    i = msg.find(" -- file location")
+    if i != -1:
+        msg = msg[:i]
+    return msg
+
+### _parse_node returns a ParseNode with its properties filled in.  If node is
+### supplied, this fills in its properties instead, so that a caller catching
+### an error still has the properties parsed before it.
+###
+def _parse_node (lexer, node = None):
+    if node is None:
+        node = ParsedNode()
     ## Loop properties ...
     while lexer.has_data():
         id = lexer.get_property_id()
         if not id:
             return node
         if node.properties.has_key(id):
-            raise Exception("Encountered ID, %s, twice for node -- file location %s." %
-                            (id, lexer.location))
+            msg = "Encountered ID, %s, twice for node" % (id)
+            if lexer.diagnostics is None:
+                raise Exception(msg + " -- file location %s." % (lexer.location()))
+            ## Tolerant parse, so keep the first values and skip these.
+            lexer.diagnose(msg)
+            _skip_property_values(lexer)
+            continue
         lexer.scan_for("[", "Expected property value")
-        i = None
-        values = []
-        node.properties[id] = values
-        ## Loop values for one property
-        while lexer.has_data():
-            ## C and GC properties allow newline sequences in value.
-            values.append(lexer.get_property_value(id == "C" or id == "GC"))
+        ## C and GC properties allow newline sequences in value.
+        keep_newlines = id == "C" or id == "GC"
+        if lexer.lazy:
+            node.properties[intern(id)] = lexer.get_lazy_property_values(keep_newlines)
+            continue
+        values = [lexer.get_property_value(keep_newlines)]
+        ## Loop any more values for one property
+        while True:
             ## Must bind ignore due to Python's multi-value return model.
             i, ignore = lexer.peek_for("[")
             if i is None: break #no new values
             lexer.set_location(i)
-    raise FileFormatException("Unexpectedly hit EOF!")
+            values.append(lexer.get_property_value(keep_newlines))
+        node.properties[intern(id)] = tuple(values)
+    raise FileFormatError("Unexpectedly hit EOF!")
+
+### _skip_property_values parses the values of a property, starting with the
+### first '[', and drops them.
+###
+def _skip_property_values (lexer):
+    lexer.scan_for("[", "Expected property value")
+    lexer.get_property_value(False)
+    while True:
+        i, ignore = lexer.peek_for("[")
+        if i is None: break
+        lexer.set_location(i)
+        lexer.get_property_value(False)
+
+### _parse_root_node parses a game's root node and then sets the lexer's
+### charset from the root's CA property so that _parse_node decodes the values
+### of all following nodes.  The root's own values were read before we knew
+### the charset, so this decodes them here.  Without CA, values are decoded as
+### UTF-8, since most files without CA are UTF-8 or plain ASCII.  The SGF
+### default, ISO-8859-1, is the fallback for values that don't decode.
+###
+### In double byte charsets like Shift_JIS, the second byte of a char can be
+### \ or ], so the root can't be parsed right without knowing the charset
+### first.  For those, Lexer.find_charset gets the charset ahead of parsing,
+### and if it guesses wrong, this parses the root again.
+###
+def _parse_root_node (lexer):
+    ## Nothing has called lexer.release yet, so this is an index into the
+    ## lexer's text for set_location, even for a StreamLexer.
+    start = lexer.location()
+    guess = _charset_name(lexer.find_charset() or "")
+    if guess in _double_byte_lead_bytes:
+        lexer.set_charset(guess)
+    node = _parse_node(lexer)
+    ca = node.properties.get("CA")
+    charset = "utf-8"
+    if ca:
+        charset = _charset_name(ca[0]) or charset
+    if charset == lexer.charset:
+        return node
+    if lexer.charset is not None or charset in _double_byte_lead_bytes:
+        lexer.set_charset(charset)
+        lexer.set_location(start)
+        return _parse_node(lexer)
+    lexer.set_charset(charset)
+    for k, v in node.properties.iteritems():
+        if isinstance(v, _LazyValues):
+            v.charset = charset
+        else:
+            node.properties[k] = tuple([_decode_value(x, charset) for x in v])
+    return node
+
+### _charset_name returns python's name for the charset named in a CA
+### property value, or None if python doesn't support it.  Files that say
+### GB2312 are often really GBK, a superset, so we decode them as GBK.
+###
+def _charset_name (ca):
+    try:
+        name = codecs.lookup(ca.strip()).name
+    except LookupError:
+        return None
+    return _charset_supersets.get(name, name)
+
+_charset_regexp = re.compile(r'(?<![A-Za-z])CA\s*\[\s*([-\w]+)\s*\]')
+
+_charset_supersets = {"gb2312": "gbk", "euc_cn": "gbk"}
+
+## _double_byte_lead_bytes maps charsets whose second bytes can look like
+## ASCII to the ranges of their lead bytes.  The Lexer has to step over the
+## second byte after any lead byte.
+_double_byte_lead_bytes = {"shift_jis": r'\x81-\x9f\xe0-\xfc',
+                           "cp932": r'\x81-\x9f\xe0-\xfc',
+                           "shift_jis_2004": r'\x81-\x9f\xe0-\xfc',
+                           "shift_jisx0213": r'\x81-\x9f\xe0-\xfc',
+                           "gbk": r'\x81-\xfe',
+                           "gb18030": r'\x81-\xfe',
+                           "cp936": r'\x81-\xfe',
+                           "big5": r'\x81-\xfe',
+                           "big5hkscs": r'\x81-\xfe',
+                           "cp950": r'\x81-\xfe'}
+
+## _value_end_regexps maps double byte charsets to a _value_end_regexp that
+## takes a lead byte and the byte after it together.
+_value_end_regexps = dict(
+    (charset, re.compile(r'(?:[^\\\]%s]|[%s].|\\.)*\]' % (lead, lead),
+                         re.DOTALL))
+    for charset, lead in _double_byte_lead_bytes.iteritems())
+
+### _decode_value returns the value decoded in charset, or the value itself if
+### it is plain ASCII (most values are points or ASCII text).  Values with
+### bytes that are not valid in charset decode as ISO-8859-1, which maps every
+### byte, so a bad CA or stray bytes never stop a game from loading.
+###
+def _decode_value (value, charset):
+    if _non_ascii_regexp.search(value) is None:
+        return value
+    try:
+        return value.decode(charset)
+    except UnicodeError:
+        return value.decode("latin-1")
+
+_non_ascii_regexp = re.compile(r'[\x80-\xff]')
+
+_non_plain_value_regexp = re.compile(r'[\x00-\x1f\\\]\x80-\xff]')
 
 
 
 class Lexer (object):
-    def __init__ (self, contents):
+    ### __init__ takes the text to scan, which can be a string or a buffer like
+    ### an mmap.  Binary means contents are the file's raw bytes rather than
+    ### text read in text mode, so kept newline sequences of CR LF become a
+    ### single newline as if the file had been read in text mode.
+    ###
+    ### If lazy is true, the parser gets property values with
+    ### get_lazy_property_values.
+    ###
+    def __init__ (self, contents, binary = False, lazy = False):
         self._data = contents
         self._data_len = len(contents)
         self._index = 0
         self._put_token = None
+        self._binary = binary
+        self.lazy = lazy
+        ## charset is the python name of the charset to decode property values
+        ## with, or None to leave them as bytes (see _parse_root_node).
+        self.charset = None
+        ## diagnostics is a list of ParseDiagnostics when parsing tolerantly
+        ## (see parse_game), and None otherwise.
+        self.diagnostics = None
     
     ### scan_for scans for any char in chars following whitespace.  If
     ### non-whitespace intervenes, this is an error.  Scan_for leaves _index
@@ -182,8 +1057,9 @@ class Lexer (object):
         i, c = self.peek_for(chars)
         if i is None:
             if errmsg:
-                errmsg = errmsg + " -- file location %s" % self._index
-            raise Exception(errmsg or "Expecting one of '%s' while scanning -- file location %s" % (chars, self._index))
+                errmsg = errmsg + " -- file location %s" % self.location()
+            raise Exception(errmsg or "Expecting one of '%s' while scanning -- file location %s" %
+                            (chars, self.location()))
         else:
             self._index = i
             return c
@@ -194,19 +1070,23 @@ class Lexer (object):
     ###
     def peek_for (self, chars):
         i = self._index
-        while self.has_data():
-            c = self._data[i]
-            i += 1
-            if c in " \t\n\r\f\v":
-                continue
-            elif c in chars:
-                return (i, c)
-            else:
+        ## Usually there's no whitespace before the char we want.
+        if i < self._data_len and self._data[i] in chars:
+            return (i + 1, self._data[i])
+        match = self._whitespace_regexp.match(self._data, i)
+        while match.end() == self._data_len:
+            if not self._fill():
                 return (None, None)
-        return (None, None)
+            match = self._whitespace_regexp.match(self._data, i)
+        i = match.end()
+        c = self._data[i]
+        if c in chars:
+            return (i + 1, c)
+        else:
+            return (None, None)
         
     def has_data (self):
-        return self._index < self._data_len
+        return self._index < self._data_len or self._fill()
     
     def location (self):
         return self._index
@@ -214,8 +1094,101 @@ class Lexer (object):
     def set_location (self, i):
         self._index = i
         return i
+
+    ### set_charset sets the charset to decode property values with (see
+    ### _parse_root_node).  For double byte charsets, get_property_value
+    ### needs to see lead bytes so that it can skip the byte after them, and
+    ### lazy values are off since their spans are found without knowing the
+    ### charset.
+    ###
+    def set_charset (self, charset):
+        self.charset = charset
+        lead_bytes = _double_byte_lead_bytes.get(charset)
+        if lead_bytes is not None:
+            self._plain_value_regexp = re.compile(r'[\x00-\x1f\\\]' + lead_bytes + ']')
+            self._value_run_regexp = re.compile(r'(?:[^\x00-\x1f\\\]%s]|[%s].)*' %
+                                                (lead_bytes, lead_bytes), re.DOTALL)
+            self._resync_run_regexp = re.compile(r'(?:[^;()\[%s]|[%s].)*' %
+                                                 (lead_bytes, lead_bytes),
+                                                 re.DOTALL)
+            self.lazy = False
+        else:
+            self._plain_value_regexp = _non_plain_value_regexp
+            self._value_run_regexp = Lexer._value_run_regexp
+            self._resync_run_regexp = Lexer._resync_run_regexp
+
+    ### find_charset returns the value of what looks like a CA property within
+    ### the next find_charset_limit chars, or None.  This is only a guess since
+    ### it doesn't lex the text, but CA is usually one of the first properties
+    ### in the root node.
+    ###
+    def find_charset (self):
+        while self._data_len - self._index < self.find_charset_limit:
+            if not self._fill():
+                break
+        match = _charset_regexp.search(self._data, self._index,
+                                       self._index + self.find_charset_limit)
+        return match and match.group(1)
+
+    find_charset_limit = 4096
+
+    ### diagnose records a ParseDiagnostic with message at the current location.
+    ###
+    def diagnose (self, message):
+        self.diagnostics.append(ParseDiagnostic(self.location(), message))
+
+    ### resync moves forward to the next ;, (, or ) that is not in a property
+    ### value, leaving the Lexer on that char, so that tolerant parsing can
+    ### carry on after an error.  This returns false if it hits EOF first.
+    ###
+    def resync (self):
+        while True:
+            i = self._resync_run_regexp.match(self._data, self._index).end()
+            if i == self._data_len or self._data[i] not in ";()[":
+                ## End of _data, or a lead byte whose second byte is in the
+                ## next chunk.
+                self._index = i
+                if not self._fill():
+                    self._index = self._data_len
+                    return False
+                continue
+            if self._data[i] != "[":
+                self._index = i
+                return True
+            self._index = i + 1
+            try:
+                self._get_property_value(False)
+            except Exception:
+                return False
+
+    ### _fill is how StreamLexer gets more text when scanning hits the end of
+    ### _data.  It returns whether it added any text to the end of _data.
+    ### Filling never moves text already in _data, so indexes stay valid.
+    ###
+    def _fill (self):
+        return False
+
+    ### release lets the lexer drop all text before the current location.
+    ### Callers must not hold onto indexes (from peek_for) across this call.
+    ###
+    def release (self):
+        pass
     
     _property_id_regexp = re.compile(r'\s*([A-Za-z]+)')
+    _whitespace_regexp = re.compile(r'\s*')
+    ## _value_run_regexp matches the run of chars get_property_value can
+    ## copy as is, that is, up to a char less than space, backslash, or close
+    ## bracket.  For double byte charsets, it takes a lead byte and the byte
+    ## after it together (see set_charset).
+    _value_run_regexp = re.compile(r'[^\x00-\x1f\\\]]*')
+    ## _resync_run_regexp matches the run of chars resync skips before the
+    ## next ;, (, ), or [, taking double byte chars together like
+    ## _value_run_regexp.
+    _resync_run_regexp = re.compile(r'[^;()\[]*')
+    ## _plain_value_regexp is what get_property_value searches with first.  If
+    ## it finds the close bracket, the value needs no unescaping or decoding.
+    ## Once there is a charset, it stops at non-ASCII bytes too.
+    _plain_value_regexp = re.compile(r'[\x00-\x1f\\\]]')
     
     ### "text" properties can have newlines, newlines following \ are removed
     ### along with \, other escaped chars are kept verbatim except whitespace
@@ -225,6 +1198,17 @@ class Lexer (object):
     ###
     def get_property_id (self):
         match = self._property_id_regexp.match(self._data, self._index)
+        if match is not None and match.end() < self._data_len:
+            self._index = match.end()
+            return match.group(1)
+        ## If the ID or whitespace runs to the end of _data, there may be more
+        ## to it in the next chunk of a stream.
+        while ((match is not None and match.end() == self._data_len) or
+               (match is None and
+                self._whitespace_regexp.match(self._data, self._index).end() == self._data_len)):
+            if not self._fill():
+                break
+            match = self._property_id_regexp.match(self._data, self._index)
         if match:
             self._index = match.end()
             return match.group(1)
@@ -237,13 +1221,66 @@ class Lexer (object):
     ### that can have newlines in their values, but otherwise, newlines are
     ### assumed to be purely line-length management in the .sgf file.
     ###
+    ### This finds the next char that needs handling (control chars,
+    ### backslash, and close bracket) and slices the run of plain chars before
+    ### it in one go, since values like comments are mostly plain chars.  Once
+    ### the Lexer has a charset, values come back decoded (see set_charset).
+    ###
     def get_property_value (self, keep_newlines):
+        match = self._plain_value_regexp.search(self._data, self._index)
+        if match is not None and match.group() == "]":
+            ## Short cut the common case of a value with nothing to map.
+            value = self._data[self._index:match.start()]
+            self._index = match.end()
+            return value
+        value = self._get_property_value(keep_newlines)
+        if self.charset is not None:
+            return _decode_value(value, self.charset)
+        return value
+
+    def _get_property_value (self, keep_newlines):
         res = []
-        while self.has_data():
-            c = self._data[self._index]
-            self._index += 1
-            if ord(c) < ord(' '): #if < space
-                ## Map whitespace to spaces.
+        while True:
+            i = self._value_run_regexp.match(self._data, self._index).end()
+            if i == self._data_len:
+                ## Rest of _data is plain chars, and the value continues in
+                ## the next chunk if there is one.
+                res.append(self._data[self._index:])
+                self._index = self._data_len
+                if not self._fill():
+                    break
+                continue
+            if i != self._index:
+                res.append(self._data[self._index:i])
+            c = self._data[i]
+            self._index = i + 1
+            if c == "]":
+                return "".join(res)
+            elif c >= "\x80":
+                ## Lead byte of a double byte char at the end of _data, so keep
+                ## the next byte even if it looks like ] or \.
+                res.append(c)
+                if not self.has_data():
+                    break
+                res.append(self._data[self._index])
+                self._index += 1
+            elif c == '\\':
+                ## Backslash quotes chars and erases newlines.
+                if not self.has_data():
+                    break
+                c = self._data[self._index]
+                self._index += 1
+                if c == "\r":
+                    c = self._translate_crlf(c)
+                newline, ignore = self._check_property_newline(c)
+                if newline:
+                    res.append("")
+                else:
+                    res.append(c)
+            else:
+                ## Control char, so map whitespace to spaces.
+                if c == "\r":
+                    c = self._translate_crlf(c)
                 newline, c2 = self._check_property_newline(c)
                 if newline:
                     ## Only map newline sequences according to keep_newlines.
@@ -255,20 +1292,54 @@ class Lexer (object):
                         res.append(" ")
                 else:
                     res.append(" ")
-            elif c == '\\':
-                ## Backslash quotes chars and erases newlines.
-                c = self._data[self._index]
-                self._index += 1
-                newline, ignore = self._check_property_newline(c)
-                if newline:
-                    res.append("")
-                else:
-                    res.append(c)
-            elif c == "]":
-                return "".join(res)
+        raise FileFormatError("Unexpectedly hit EOF!")
+
+    ## Lazy values whose raw text is shorter than this get unescaped right away
+    ## since a _LazyValues would cost more than the strings.
+    lazy_threshold = 64
+
+    ### get_lazy_property_values takes a flag like get_property_value and
+    ### returns a sequence of the values of a property, starting after the
+    ### first '[' (which has already been consumed).  Short values (points,
+    ### move numbers, etc.) get unescaped as the Lexer passes over them, so
+    ### they cost no more than an eager parse.  For a long value, this only
+    ### finds the (start, end) span of its raw text, and if any value is long,
+    ### it returns a _LazyValues that unescapes them all on first access.
+    ###
+    def get_lazy_property_values (self, keep_newlines):
+        values = []
+        spans = []
+        lazy = False
+        while True:
+            start = self._index
+            ## Usually the value is short with nothing to map, as in
+            ## get_property_value.
+            match = self._plain_value_regexp.search(self._data, start,
+                                                    start + self.lazy_threshold)
+            if match is not None and match.group() == "]":
+                values.append(self._data[start:match.start()])
+                self._index = match.end()
+                spans.append((start, self._index - 1))
             else:
-                res.append(c)
-        raise FileFormatException("Unexpectedly hit EOF!")
+                match = _value_end_regexp.match(self._data, start)
+                if match is None:
+                    ## Leave the Lexer at EOF as get_property_value does.
+                    self._index = self._data_len
+                    raise FileFormatError("Unexpectedly hit EOF!")
+                spans.append((start, match.end() - 1))
+                if match.end() - start < self.lazy_threshold:
+                    values.append(self.get_property_value(keep_newlines))
+                else:
+                    lazy = True
+                    self._index = match.end()
+            ## Must bind ignore due to Python's multi-value return model.
+            i, ignore = self.peek_for("[")
+            if i is None: break #no new values
+            self._index = i
+        if not lazy:
+            return tuple(values)
+        return _LazyValues(self._data, spans, keep_newlines, self._binary,
+                           self.charset)
 
     ### _check_property_newline check if c is part of a newline sequence.  If
     ### it is, then see if there's a second newline sequence char and gobble
@@ -278,12 +1349,67 @@ class Lexer (object):
     def _check_property_newline (self, c):
         if c == '\n' or c == '\r':
             ## Only map newline sequences according to keep_newlines.
+            if not self.has_data():
+                return (True, None)
             c2 = self._data[self._index]
             if c2 == '\n' or c2 == '\r':
                 self._index += 1
+                if c2 == "\r":
+                    c2 = self._translate_crlf(c2)
                 return (True, c2)
             return (True, None)
         else:
             return (False, None)
 
+    ### _translate_crlf takes a CR that was just consumed.  When scanning raw
+    ### bytes, if a LF follows, then this consumes it and returns a newline, so
+    ### that values come out the same as when reading the file in text mode.
+    ###
+    def _translate_crlf (self, c):
+        if self._binary and self.has_data() and self._data[self._index] == "\n":
+            self._index += 1
+            return "\n"
+        return c
+
+
+
+### StreamLexer is a Lexer that reads its text from a file object in chunks
+### as scanning needs more text, rather than taking the whole file contents up
+### front.  Location is the offset into the whole stream, not into _data.
+###
+class StreamLexer (Lexer):
+
+    default_chunk_size = 64 * 1024
+
+    def __init__ (self, f, chunk_size = default_chunk_size, binary = False):
+        Lexer.__init__(self, "", binary)
+        self._file = f
+        self._chunk_size = chunk_size
+        ## _base is the stream offset of the first char in _data.
+        self._base = 0
+        self._eof = False
+
+    def location (self):
+        return self._base + self._index
+
+    ### _fill reads at least a chunk, but when one token (say, a huge
+    ### comment) spans many chunks, we read as much as we have buffered so
+    ### that total copying stays linear in the size of the token.
+    ###
+    def _fill (self):
+        if self._eof:
+            return False
+        chunk = self._file.read(max(self._chunk_size, self._data_len))
+        if not chunk:
+            self._eof = True
+            return False
+        self._data = self._data + chunk
+        self._data_len = len(self._data)
+        return True
 
+    def release (self):
+        if self._index > 0:
+            self._base += self._index
+            self._data = self._data[self._index:]
+            self._data_len = len(self._data)
+            self._index = 0
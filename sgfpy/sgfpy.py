@@ -33,7 +33,6 @@ from System.Windows.Data import Binding, RelativeSource
 from System.Windows.Shapes import Rectangle, Ellipse, Polygon
 from System.Windows.Input import MouseButtonEventHandler, Key, Keyboard, ModifierKeys
 from System.Windows.FrameworkElement import WidthProperty
-from System.IO import FileFormatException #FileStream, FileMode
 from Microsoft.Win32 import OpenFileDialog, SaveFileDialog
 
 #import sys
@@ -42,6 +41,7 @@ from Microsoft.Win32 import OpenFileDialog, SaveFileDialog
 
 
 import game
+import goboard
 from goboard import Adornments
 import sgfparser
 import newdialog
@@ -235,27 +235,26 @@ class SgfEdWindow(Window):
         self._focus_on_stones()
     
     ### prevButton_left_down handles the rewind one move button.  Also,
-    ### mainwin_keydown calls this to handle left arrow.  This also handles
-    ### removing and restoring adornments, and handling the current move
-    ### adornment.  This function assume the game is started, and there's a
-    ### move to rewind.
+    ### mainwin_keydown calls this to handle left arrow.  The game updates the
+    ### stones and adornments (see update_board), and this updates the tree
+    ### view and title.  This function assume the game is started, and there's
+    ### a move to rewind.
     ###
     def prevButton_left_down (self, prev_button,  e):
-        move = self.game.unwind_move()
-        #remove_stone(main_win.FindName("stonesGrid"), move)
-        if not move.is_pass:
-            remove_stone(self.stonesGrid, move)
-        if move.previous is not None:
-            self.add_current_adornments(move.previous)
-        else:
-            restore_adornments(self.stonesGrid, self.game.setup_adornments)
-        self._update_tree_view(move.previous)
-        if self.game.current_move is not None:
-            m = self.game.current_move
+        self.game.unwind_move()
+        self._show_current_move()
+        self._focus_on_stones()
+
+    ### _show_current_move updates the tree view and title for the game's
+    ### current move after rewinding or cutting a move.
+    ###
+    def _show_current_move (self):
+        m = self.game.current_move
+        self._update_tree_view(m)
+        if m is not None:
             self.update_title(m.number, m.is_pass)
         else:
             self.update_title(0)
-        self._focus_on_stones()
     
     ### homeButton_left_down rewinds all moves to the game start.  This
     ### function signals an error if the game has not started, or no move has
@@ -267,10 +266,9 @@ class SgfEdWindow(Window):
         self._focus_on_stones()
 
     ### nextButton_left_down handles the replay one move button.  Also,
-    ### mainwin_keydown calls this to handle left arrow.  This also handles
-    ### removing and restoring adornments, and handling the current move
-    ### adornment.  This function assumes the game has started, and there's
-    ### a next move to replay.
+    ### mainwin_keydown calls this to handle left arrow.  The game updates the
+    ### stones and adornments (see update_board).  This function assumes the
+    ### game has started, and there's a next move to replay.
     ###
     def nextButton_left_down (self, next_button,  e):
         move = self.game.replay_move()
@@ -281,14 +279,10 @@ class SgfEdWindow(Window):
         self._update_tree_view(move)
         self._focus_on_stones()
 
-    ### _advance_to_stone displays move, which as already been added to the
-    ### board and readied for rendering.  We add the stone with no current
-    ### adornment because that does the basic work and then immediately add the
-    ### adornment.
+    ### _advance_to_stone updates the tree view and title for move, which has
+    ### already been added to the board and displayed by the game.
     ###
     def _advance_to_stone (self, move):
-        self.add_next_stone_no_current(move)
-        self.add_current_adornments(move)
         self._update_tree_view(move)
         self.update_title(move.number, move.is_pass)
     
@@ -338,34 +332,43 @@ class SgfEdWindow(Window):
 
 
 
-    ### add_next_stone_no_current adds a stone to the stones grid for move,
-    ### removes previous moves current move marker, and removes previous moves
-    ### adornments.  This is used for advancing to a stone for replay move or
-    ### click to place stone (which sometimes replays a move and needs to place
-    ### adornments for pre-existing moves).  The Game class also uses this.
+    ### update_board applies a BoardDiff to the stones grid.  Game calls this
+    ### once for each move, rewind, or jump, however many moves it replayed or
+    ### unwound, with the stones, adornments, and current move marker that
+    ### changed.
     ###
-    def add_next_stone_no_current (self, move):
-        if not move.is_pass:
-            #add_stone(main_win.FindName("stonesGrid"), m.row, m.column, m.color)
-            add_stone(self.stonesGrid, move.row, move.column, move.color)
+    def update_board (self, diff):
+        g = self.stonesGrid
         ## Must remove current adornment before adding it elsewhere.
-        if move.previous is not None:
-            if Adornments.current_move_adornment in move.previous.adornments:
-                remove_current_stone_adornment(self.stonesGrid, move.previous)
-            remove_adornments(self.stonesGrid, move.previous.adornments)
-        else:
-            remove_adornments(self.stonesGrid, self.game.setup_adornments)
+        if diff.unmarked is not None:
+            remove_current_stone_adornment(g, diff.unmarked)
+        remove_adornments(g, diff.removed_adornments)
+        for m in diff.removed_stones:
+            remove_stone(g, m)
+        for m in diff.added_stones:
+            add_stone(g, m.row, m.column, m.color)
+        restore_adornments(g, diff.added_adornments)
+        if diff.marked is not None:
+            add_current_stone_adornment(g, diff.marked)
 
-    ### add_current_adornments adds to the stones grid a current move marker
-    ### for move as well as move's adornments.  This is used for replay move UI
-    ### in this module as well as by code in the Game class.
+    ### update_navigation enables the buttons for rewinding and replaying
+    ### moves.  This and the following methods implement the rest of
+    ### game.GameObserver for the Game.
     ###
-    def add_current_adornments (self, move):
-        ## Must restore adornemnts before adding current, else error adding
-        ## current twice.
-        restore_adornments(self.stonesGrid, move.adornments)
-        if not move.is_pass:
-            add_current_stone_adornment(self.stonesGrid, move)
+    def update_navigation (self, can_unwind, can_replay):
+        self.prevButton.IsEnabled = can_unwind
+        self.homeButton.IsEnabled = can_unwind
+        self.nextButton.IsEnabled = can_replay
+        self.endButton.IsEnabled = can_replay
+
+    def set_comment (self, text):
+        self.commentBox.Text = text
+
+    def get_comment (self):
+        return self.commentBox.Text
+
+    def show_message (self, text):
+        MessageBox.Show(text)
     
     ### endButton_left_down replays all moves to the game end, using currently
     ### selected branches in each move.  This function signals an error if the
@@ -441,9 +444,9 @@ class SgfEdWindow(Window):
                 self.game.filename = dlg.FileName
                 self.game.filebase = dlg.FileName[dlg.FileName.rfind("\\") + 1:]
                 self.update_title(0, False, self.game.filebase)
-            except FileFormatException, err: 
+            except sgfparser.FileFormatError, err: 
                 ## Essentially handles unexpected EOF or malformed property values.
-                MessageBox.Show(err.Message + err.StackTrace);
+                MessageBox.Show(str(err));
         self._focus_on_stones()
 
     ### _check_dirty_save prompts whether to save the game if it is dirty.  If
@@ -590,12 +593,16 @@ class SgfEdWindow(Window):
                                 "Confirm cutting move", MessageBoxButton.YesNo) == 
                 MessageBoxResult.Yes):
             win.game.cut_move()
+            self._show_current_move()
             e.Handled = True
         ## Pasting a sub tree
         elif (e.Key == Key.V and Keyboard.Modifiers == ModifierKeys.Control and
                 not self.commentBox.IsKeyboardFocused):
             if win.game.can_paste():
-                win.game.paste_move()
+                move = win.game.paste_move()
+                if move is not None:
+                    self._advance_to_stone(move)
+                self._focus_on_stones()
             else:
                 MessageBox.Show("No cut move to paste at this time.")
             e.Handled = True
@@ -612,50 +619,13 @@ class SgfEdWindow(Window):
                                  "Confirm cut operation", MessageBoxButton.YesNo) == 
                      MessageBoxResult.Yes):
                 self.game.cut_move()
+                self._show_current_move()
             e.Handled = True
 
     ###
     ### Utilities
     ###
 
-    ### add_stones adds Ellispses to the stones grid for each move.  Moves must
-    ### be non-null.  Game uses this for replacing captures.
-    ###
-    def add_stones (self, moves):
-        #g = self.FindName("stonesGrid")
-        g = self.stonesGrid
-        for m in moves:
-            add_stone(g, m.row, m.column, m.color)
-
-    ### remove_stones removes the Ellipses from the stones grid.  Moves must be
-    ### non-null.  Game uses this to remove captures.
-    ###
-    def remove_stones (self, moves):
-        #g = self.FindName("stonesGrid") #not needed with wpf.LoadComponent
-        g = self.stonesGrid
-        for m in moves:
-            remove_stone(g, m)
-
-    ### reset_to_start resets the board UI back to the start of the game before
-    ### any moves have been played.  Handicap stones will be displayed.  Game
-    ### uses this after resetting the model.
-    ###
-    def reset_to_start (self, cur_move):
-        g = self.stonesGrid
-        ## Must remove current adornment before other adornments.
-        if not cur_move.is_pass:
-            remove_current_stone_adornment(g, cur_move)
-        remove_adornments(g, cur_move.adornments)
-        size = self.game.board.size
-        for row in xrange(size):
-            for col in xrange(size):
-                stone = stones[row][col]
-                if stone is not None:
-                    g.Children.Remove(stone)
-                stones[row][col] = None
-        self.add_handicap_stones(self.game)
-        self.commentBox.Text = self.game.comments
-
     ### add_handicap_stones takes a game and adds its handicap moves to the
     ### display.  This takes a game because it is used on new games when
     ### setting up an initial display and when resetting to the start of self.game.
@@ -896,6 +866,14 @@ def _setup_index_label (g, content, x, y, h_alignment, v_alignment):
 stones = [[None for col in xrange(game.MAX_BOARD_SIZE)] for
            row in xrange(game.MAX_BOARD_SIZE)]
 
+### wpf_color returns the WPF Color for a stone color from goboard.Colors.
+###
+def wpf_color (color):
+    return _wpf_colors[color]
+
+_wpf_colors = {goboard.Colors.Black: Colors.Black,
+               goboard.Colors.White: Colors.White}
+
 ### add_stone takes a Grid and row, column that index the go board one based
 ### from the top left corner.  It adds a WPF Ellipse object to the stones grid.
 ###
@@ -905,7 +883,7 @@ def add_stone (g, row, col, color):
     Grid.SetColumn(stone, col)
     stone.StrokeThickness = 1
     stone.Stroke = SolidColorBrush(Colors.Black)
-    stone.Fill = SolidColorBrush(color)
+    stone.Fill = SolidColorBrush(wpf_color(color))
     stone.HorizontalAlignment = HorizontalAlignment.Stretch
     stone.VerticalAlignment = VerticalAlignment.Stretch
     b = Binding("ActualHeight")
@@ -920,8 +898,7 @@ _current_stone_adornment_ellipse = None
 
 ### remove_stone takes a stones grid and a move.  It removes the Ellipse for
 ### the move and notes in stones global that there's no stone there in the
-### display.  This function also handles the current move adornment and other
-### adornments since this is used to rewind the current move.
+### display.  Adornments are up to the caller (see update_board).
 ###
 def remove_stone (g, move):
     stone = stones[move.row - 1][move.column - 1]
@@ -929,11 +906,6 @@ def remove_stone (g, move):
         raise Exception("Shouldn't be removing stone if there isn't one.")
     g.Children.Remove(stone)
     stones[move.row - 1][move.column - 1] = None
-    ## Must remove current adornment before other adornments (or just call
-    ## Adornments.release_current_move after loop).
-    if Adornments.current_move_adornment in move.adornments:
-        remove_current_stone_adornment(g, move)
-    remove_adornments(g, move.adornments)
 
 
 ### grid_pixels_to_cell returns the go board indexes (one based), as a tuple,
@@ -966,7 +938,7 @@ def add_current_stone_adornment (stones_grid, move):
     global _current_stone_adornment_ellipse
     if _current_stone_adornment_grid is not None:
         _current_stone_adornment_ellipse.Stroke = \
-           SolidColorBrush(game.opposite_move_color(move.color))        
+           SolidColorBrush(wpf_color(game.opposite_move_color(move.color)))
         Grid.SetRow(_current_stone_adornment_grid, move.row)
         Grid.SetColumn(_current_stone_adornment_grid, move.column)
         Adornments.get_current_move(move, _current_stone_adornment_grid)
@@ -981,7 +953,7 @@ def add_current_stone_adornment (stones_grid, move):
         Grid.SetRow(mark, 1)
         Grid.SetColumn(mark, 1)
         mark.StrokeThickness = 2
-        mark.Stroke = SolidColorBrush(game.opposite_move_color(move.color))
+        mark.Stroke = SolidColorBrush(wpf_color(game.opposite_move_color(move.color)))
         mark.Fill = SolidColorBrush(Colors.Transparent)
         mark.HorizontalAlignment = HorizontalAlignment.Stretch
         mark.VerticalAlignment = VerticalAlignment.Stretch
@@ -1051,7 +1023,7 @@ def make_square_adornment (stones_grid, row, col, game_inst, render):
     sq.StrokeThickness = 2
     move = game_inst.board.move_at(row, col)
     if move is not None:
-        color = game.opposite_move_color(move.color)
+        color = wpf_color(game.opposite_move_color(move.color))
     else:
         color = Colors.Black
     sq.Stroke = SolidColorBrush(color)
@@ -1084,7 +1056,7 @@ def make_triangle_adornment (stones_grid, row, col, game_inst, render):
     tri.StrokeThickness = 1
     move = game_inst.board.move_at(row, col)
     if move is not None:
-        color = game.opposite_move_color(move.color)
+        color = wpf_color(game.opposite_move_color(move.color))
     else:
         color = Colors.Black
     tri.Stroke = SolidColorBrush(color)
@@ -1118,7 +1090,7 @@ def make_letter_adornment (stones_grid, row, col, letter, game_inst, render):
     label.VerticalAlignment = VerticalAlignment.Stretch
     move = game_inst.board.move_at(row, col)
     if move is not None:
-        color = game.opposite_move_color(move.color)
+        color = wpf_color(game.opposite_move_color(move.color))
         label.Background = SolidColorBrush(Colors.Transparent)
     else:
         color = Colors.Black
@@ -1217,7 +1189,7 @@ def _new_tree_view_item_grid (move):
     stone = Ellipse()
     stone.StrokeThickness = 1
     stone.Stroke = SolidColorBrush(Colors.Black)
-    stone.Fill = SolidColorBrush(move.color)
+    stone.Fill = SolidColorBrush(wpf_color(move.color))
     stone.HorizontalAlignment = HorizontalAlignment.Stretch
     stone.VerticalAlignment = VerticalAlignment.Stretch
     g.Children.Add(stone)
@@ -1226,7 +1198,7 @@ def _new_tree_view_item_grid (move):
     label.Content = str(move.number)
     label.FontWeight = FontWeights.Bold
     label.FontSize = 12
-    label.Foreground = SolidColorBrush(game.opposite_move_color(move.color))
+    label.Foreground = SolidColorBrush(wpf_color(game.opposite_move_color(move.color)))
     label.HorizontalAlignment = HorizontalAlignment.Center
     label.VerticalAlignment = VerticalAlignment.Center
     g.Children.Add(label)
@@ -0,0 +1,316 @@
+### test_game.py tests game.py without a UI, using game.GameObserver.
+###
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import game
+import goboard
+import sgfparser
+
+
+
+### RecordingObserver is a game.GameObserver that records the
+### goboard.BoardDiffs game.Game sends it in diffs and keeps the display they
+### describe: stones maps (row, col) to color, adornments is the set of
+### adornments showing, and marked is the move with the current move marker.
+### Applying a diff that does not fit the display, such as removing a stone
+### that is not there, raises an exception, and matches checks the display
+### against a game, so navigation can be checked without a UI.
+###
+class RecordingObserver (game.GameObserver):
+    def __init__ (self):
+        game.GameObserver.__init__(self)
+        self.diffs = []
+        self.stones = {}
+        self.adornments = set()
+        self.marked = None
+
+    def setup_board_display (self, g):
+        if g.handicap_moves is not None:
+            for m in g.handicap_moves:
+                self.stones[(m.row, m.column)] = m.color
+
+    def update_board (self, diff):
+        self.diffs.append(diff)
+        if diff.unmarked is not None:
+            if diff.unmarked is not self.marked:
+                raise Exception("Unmarking a move that is not marked.")
+            self.marked = None
+        for a in diff.removed_adornments:
+            if a not in self.adornments:
+                raise Exception("Removing an adornment that is not showing.")
+            self.adornments.remove(a)
+        for m in diff.removed_stones:
+            if self.stones.get((m.row, m.column)) != m.color:
+                raise Exception("Removing a stone that is not showing.")
+            del self.stones[(m.row, m.column)]
+        for m in diff.added_stones:
+            if (m.row, m.column) in self.stones:
+                raise Exception("Adding a stone where one is showing.")
+            self.stones[(m.row, m.column)] = m.color
+        for a in diff.added_adornments:
+            if a in self.adornments:
+                raise Exception("Adding an adornment that is showing.")
+            self.adornments.add(a)
+        if diff.marked is not None:
+            if self.marked is not None:
+                raise Exception("Marking a move when another is marked.")
+            self.marked = diff.marked
+
+    ### matches returns whether the display shows game's board, the current
+    ### move's adornments, and the current move marker.
+    ###
+    def matches (self, g):
+        board = g.board
+        stones = {}
+        for row in xrange(1, board.height + 1):
+            for col in xrange(1, board.width + 1):
+                m = board.move_at(row, col)
+                if m is not None:
+                    stones[(row, col)] = m.color
+        current = g.current_move
+        if current is not None and current.is_pass:
+            marked = None
+        else:
+            marked = current
+        return (stones == self.stones and marked is self.marked and
+                set(g._shown_adornments(current)) == self.adornments)
+
+
+
+class WriteTests (unittest.TestCase):
+
+    text = "(;GM[1]FF[4]SZ[19]C[hi];B[aa];W[bb])"
+
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.dir, "games.zip")
+        z = zipfile.ZipFile(self.archive, "w")
+        try:
+            z.writestr("a.sgf", self.text)
+        finally:
+            z.close()
+        self.name = os.path.join(self.archive, "a.sgf")
+        self.write_to = sgfparser.ParsedGame.write_to
+
+    def tearDown (self):
+        sgfparser.ParsedGame.write_to = self.write_to
+        shutil.rmtree(self.dir)
+
+    ### read_members returns a list of the archive's (member name, text)
+    ### pairs.
+    ###
+    def read_members (self):
+        z = zipfile.ZipFile(self.archive)
+        try:
+            return [(n, z.read(n)) for n in z.namelist()]
+        finally:
+            z.close()
+
+    ### fail_writes makes ParsedGame.write_to write some text and then fail.
+    ###
+    def fail_writes (self):
+        def write_to (pg, f, cache_text = False):
+            f.write("(;GM[1]")
+            raise IOError("disk full")
+        sgfparser.ParsedGame.write_to = write_to
+
+    def test_write_zip_member (self):
+        g = game.create_parsed_game(sgfparser.parse_file(self.name))
+        g.goto_last_move()
+        g.make_move(3, 3)
+        g.write_game(self.name)
+        self.assertFalse(g.dirty)
+        self.assertEqual(str(sgfparser.parse_file(self.name)),
+                         str(game.parsed_game_from_game(g)))
+
+    def test_failed_write_keeps_member (self):
+        g = game.create_parsed_game(sgfparser.parse_file(self.name))
+        g.goto_last_move()
+        g.make_move(3, 3)
+        self.fail_writes()
+        self.assertRaises(IOError, g.write_game, self.name)
+        self.assertTrue(g.dirty)
+        self.assertRaises(IOError, g.write_flipped_game, self.name)
+        self.assertRaises(IOError, g.write_game,
+                          os.path.join(self.archive, "b.sgf"))
+        self.assertEqual(self.read_members(), [("a.sgf", self.text)])
+
+
+class KoTests (unittest.TestCase):
+
+    ## Through move 9, black takes a ko at bb by playing cb.  Then white
+    ## retakes it at once in one branch.
+    moves = ";B[ab];W[ca];B[ba];W[cc];B[bc];W[db];B[dd];W[bb];B[cb]"
+
+    def make_game (self, text):
+        g = game.create_parsed_game(sgfparser.parse_game(
+                sgfparser.Lexer(text, True)))
+        g.goto_move_number(9)
+        self.assertEqual((g.current_move.row, g.current_move.column), (2, 3))
+        self.assertEqual(g.board.color_at(2, 2), None)
+        return g
+
+    def test_retake_existing_branch (self):
+        g = self.make_game("(;GM[1]SZ[9]" + self.moves + "(;W[ee])(;W[bb]))")
+        move = g.make_move(2, 2)
+        self.assertTrue(move is not None)
+        self.assertTrue(move is g.current_move)
+        self.assertTrue(move is g.current_move.previous.branches[1])
+        self.assertEqual(g.board.color_at(2, 3), None)
+        self.assertFalse(g.dirty)
+
+    def test_retake_new_move (self):
+        g = self.make_game("(;GM[1]SZ[9]" + self.moves + "(;W[ee])(;W[ff]))")
+        self.assertTrue(g.make_move(2, 2) is None)
+        self.assertEqual(g._observer.messages[-1],
+                         "You cannot retake the ko immediately.")
+        self.assertEqual(len(g.current_move.branches), 2)
+        self.assertEqual(g.board.color_at(2, 3), goboard.Colors.Black)
+
+
+class CutPasteTests (unittest.TestCase):
+
+    def test_goto_after_paste (self):
+        g = game.create_parsed_game(sgfparser.parse_game(sgfparser.Lexer(
+                "(;GM[1]SZ[9];B[aa];W[bb];B[cc](;W[dd];B[ee])(;W[ff];B[gg]))",
+                True)))
+        g.goto_last_move()
+        ## Cut and paste back W[bb], whose tree has branches after B[cc].
+        g.goto_move_number(2)
+        g.cut_move()
+        g.paste_move()
+        dd, ff = g.current_move.next.branches
+        self.assertEqual((dd.number, ff.number), (4, 4))
+        self.assertTrue(g.goto_node(ff) is ff)
+        self.assertTrue(g.goto_node(dd) is dd)
+        self.assertEqual(g.board.color_at(6, 6), None)
+        self.assertEqual(g.board.color_at(4, 4), goboard.Colors.White)
+        self.assertEqual(g.goto_move_number(5).number, 5)
+        self.assertEqual(g.current_move.previous, dd)
+        g.goto_move_number(3)
+        self.assertEqual(g.board.color_at(4, 4), None)
+        g.current_move.next = ff
+        g.goto_last_move()
+        self.assertEqual(g.move_count, 5)
+        self.assertEqual(g.board.color_at(4, 4), None)
+        self.assertEqual(g.board.color_at(5, 5), None)
+        self.assertEqual(g.board.color_at(7, 7), goboard.Colors.Black)
+
+
+class NavigationTests (unittest.TestCase):
+
+    ## B[ab] captures W[aa], which has a triangle, and the branches after it
+    ## have a label and a comment.
+    text = ("(;GM[1]SZ[9];B[ba];W[aa]TR[ba];B[ab]C[takes aa]" +
+            "(;W[cc];B[dd])(;W[ee]LB[ef:A];B[ff]))")
+
+    def setUp (self):
+        self.observer = RecordingObserver()
+        self.game = game.create_parsed_game(sgfparser.parse_game(
+                sgfparser.Lexer(self.text, True)), self.observer)
+        self.assertTrue(self.observer.matches(self.game))
+
+    ### step calls the game's method named name with args and checks that it
+    ### sent the observer one diff that left the display matching the game.
+    ###
+    def step (self, name, *args):
+        count = len(self.observer.diffs)
+        res = getattr(self.game, name)(*args)
+        self.assertEqual(len(self.observer.diffs), count + 1)
+        self.assertTrue(self.observer.matches(self.game))
+        return res
+
+    def test_next_prev (self):
+        g = self.game
+        while g.can_replay_move():
+            self.step("replay_move")
+        self.assertEqual(g.move_count, 5)
+        self.assertEqual(g.board.color_at(1, 1), None)
+        while g.can_unwind_move():
+            self.step("unwind_move")
+        self.assertEqual(g.current_move, None)
+        self.assertEqual(self.observer.stones, {})
+
+    def test_goto (self):
+        g = self.game
+        self.step("goto_last_move")
+        cc, ee = g.current_move.previous.previous.branches
+        self.step("goto_node", ee)
+        self.step("goto_node", ee.next)
+        self.step("goto_move_number", 2)
+        self.assertEqual(self.observer.stones,
+                         {(1, 2): goboard.Colors.Black,
+                          (1, 1): goboard.Colors.White})
+        self.step("goto_node", cc)
+        self.step("goto_last_move")
+        self.step("goto_node", ee.next)
+        self.step("goto_start")
+        self.assertEqual(self.observer.stones, {})
+        self.step("goto_move_number", 4)
+        self.assertTrue(g.current_move is ee)
+
+    def test_cut_paste (self):
+        g = self.game
+        self.step("goto_last_move")
+        ab = g.current_move.previous.previous
+        ee = ab.branches[1]
+        self.step("goto_node", ee)
+        self.step("cut_move")
+        self.assertTrue(g.current_move is ab)
+        self.assertEqual(ab.branches, None)
+        self.assertTrue(self.step("paste_move") is ee)
+        self.step("goto_node", ab.branches[0])
+        self.step("goto_node", ee.next)
+        ## Cut the whole game and paste it back at the initial board.
+        self.step("goto_move_number", 1)
+        self.step("cut_move")
+        self.assertEqual(self.observer.stones, {})
+        self.step("paste_move")
+        self.step("goto_node", ee.next)
+        self.assertEqual(g.move_count, 5)
+
+
+class AdornmentTests (unittest.TestCase):
+
+    def test_letters (self):
+        g = game.create_parsed_game(sgfparser.parse_game(sgfparser.Lexer(
+                "(;GM[1]SZ[9];B[aa]LB[bb:A];W[cc])", True)))
+        letter = goboard.Adornments.letter
+        move = g.replay_move()
+        self.assertEqual(g.add_adornment(move, 3, 3, letter).letter, "B")
+        self.assertEqual(g.add_adornment(move, 4, 4, letter).letter, "C")
+        move = g.replay_move()
+        self.assertEqual(g.add_adornment(move, 1, 1, letter).letter, "A")
+        nodes = game.parsed_game_from_game(g).nodes
+        self.assertEqual(nodes.next.properties["LB"], ["bb:A", "cc:B", "dd:C"])
+        self.assertEqual(nodes.next.next.properties["LB"], ["aa:A"])
+
+
+class CoordinatesTests (unittest.TestCase):
+
+    def parse (self, text):
+        return sgfparser.parse_game(sgfparser.Lexer(text, True))
+
+    def test_move_off_board (self):
+        self.assertRaises(sgfparser.FileFormatError, game.create_parsed_game,
+                          self.parse("(;GM[1]SZ[9];B[ss])"))
+        g = game.create_parsed_game(self.parse("(;GM[1]SZ[9];B[ii];W[aj])"))
+        self.assertRaises(sgfparser.FileFormatError, g.replay_move)
+
+    def test_adornment_off_board (self):
+        g = game.create_parsed_game(self.parse("(;GM[1]SZ[9];B[aa]TR[ja])"))
+        self.assertRaises(sgfparser.FileFormatError, g.replay_move)
+
+    def test_handicap_off_board (self):
+        self.assertRaises(sgfparser.FileFormatError, game.create_parsed_game,
+                          self.parse("(;GM[1]SZ[9]HA[2]AB[cc][kk];W[aa])"))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+### test_goboard.py tests goboard.py.  The group tests play random stones and
+### compare the board's incremental groups with a brute force flood fill.
+###
+
+import random
+import unittest
+
+import goboard
+from goboard import Colors
+import sgfparser
+
+
+
+### brute_group returns the set of (row, col) locations of the stones
+### connected to the stone at row, col on board, and the set of their
+### liberties, by flood filling the board's moves.
+###
+def brute_group (board, row, col):
+    color = board.color_at(row, col)
+    group = set([(row, col)])
+    libs = set()
+    stack = [(row, col)]
+    while stack:
+        r, c = stack.pop()
+        for u, v in ((r, c + 1), (r + 1, c), (r, c - 1), (r - 1, c)):
+            if not (1 <= u <= board.height and 1 <= v <= board.width):
+                continue
+            other = board.color_at(u, v)
+            if other is None:
+                libs.add((u, v))
+            elif other == color and (u, v) not in group:
+                group.add((u, v))
+                stack.append((u, v))
+    return group, libs
+
+def locations (moves):
+    return set((m.row, m.column) for m in moves)
+
+
+
+class GroupTests (unittest.TestCase):
+
+    sizes = [2, 3, 9, 13, 19, 52, (5, 3), (2, 7), (30, 11)]
+
+    ### check_move checks the board's capture and self capture predictions
+    ### for move, whose location is empty, against brute force.
+    ###
+    def check_move (self, board, move):
+        r, c = move.row, move.column
+        board.moves[r - 1][c - 1] = move
+        dead = set()
+        for u, v in ((r, c + 1), (r + 1, c), (r, c - 1), (r - 1, c)):
+            if (1 <= u <= board.height and 1 <= v <= board.width and
+                    board.color_at(u, v) not in (None, move.color)):
+                group, libs = brute_group(board, u, v)
+                if not libs:
+                    dead |= group
+        group, libs = brute_group(board, r, c)
+        board.moves[r - 1][c - 1] = None
+        captures = board.would_capture(move)
+        self.assertEqual(locations(captures), dead)
+        self.assertEqual(len(captures), len(dead))
+        self.assertEqual(board.is_self_capture(move), not dead and not libs)
+        return dead
+
+    ### check_groups checks every stone's group and liberties against brute
+    ### force.
+    ###
+    def check_groups (self, board, stones):
+        for m in stones:
+            group, libs = brute_group(board, m.row, m.column)
+            self.assertEqual(locations(board.group_moves(m.row, m.column)), group)
+            self.assertEqual(board.liberty_count(m.row, m.column) == 0, not libs)
+            self.assertEqual(board.find_liberty(m.row, m.column, m.color),
+                             bool(libs))
+            found = board.collect_stones(m.row, m.column, m.color)
+            self.assertEqual(locations(found), group)
+            self.assertEqual(len(found), len(group))
+
+    ### check_hash checks that the board's position hash is the hash of a
+    ### new board with the same stones.
+    ###
+    def check_hash (self, board, stones):
+        fresh = goboard.GoBoard(board.size)
+        for m in stones:
+            fresh.add_stone(goboard.Move(m.row, m.column, m.color))
+        self.assertEqual(board.position_hash, fresh.position_hash)
+
+    def test_random_play (self):
+        for seed in xrange(30):
+            rand = random.Random(seed)
+            size = rand.choice(self.sizes)
+            width, height = goboard.board_dimensions(size)
+            board = goboard.GoBoard(size)
+            stones = []
+            snapshot = None
+            for step in xrange(400):
+                op = rand.random()
+                if op < 0.1 and stones:
+                    board.remove_stone(stones.pop(rand.randrange(len(stones))))
+                    continue
+                elif op < 0.12:
+                    board.goto_start()
+                    stones = []
+                    continue
+                elif op < 0.14:
+                    snapshot = (board.snapshot(), list(stones))
+                    continue
+                elif op < 0.16 and snapshot is not None:
+                    board.restore(snapshot[0])
+                    stones = list(snapshot[1])
+                    continue
+                r, c = rand.randint(1, height), rand.randint(1, width)
+                if board.has_stone(r, c):
+                    continue
+                color = rand.choice([Colors.Black, Colors.White])
+                move = goboard.Move(r, c, color)
+                dead = self.check_move(board, move)
+                board.add_stone(move)
+                stones.append(move)
+                captured = board.captured_stones(move)
+                self.assertEqual(locations(captured), dead)
+                self.assertEqual(len(captured), len(dead))
+                for m in captured:
+                    board.remove_stone(m)
+                    stones.remove(m)
+                if step % 25 == 0:
+                    self.check_groups(board, stones)
+                    self.check_hash(board, stones)
+            self.check_groups(board, stones)
+            self.check_hash(board, stones)
+
+    ### test_big_groups checks board wide groups, which are where recursive
+    ### flood fills used to run out of stack.
+    ###
+    def test_big_groups (self):
+        board = goboard.GoBoard(52)
+        stones = []
+        for row in xrange(1, 53):
+            for col in xrange(1, 53):
+                if (row, col) != (52, 52):
+                    m = goboard.Move(row, col, Colors.Black)
+                    board.add_stone(m)
+                    stones.append(m)
+        self.assertEqual(len(board.group_moves(1, 1)), 52 * 52 - 1)
+        self.assertTrue(board.find_liberty(1, 1, Colors.Black))
+        move = goboard.Move(52, 52, Colors.White)
+        self.assertEqual(len(self.check_move(board, move)), 52 * 52 - 1)
+        self.check_groups(board, stones[:3])
+
+
+class CoordinatesTests (unittest.TestCase):
+
+    def test_board_size (self):
+        self.assertEqual(goboard.parsed_to_model_coordinates("ia", 9), (1, 9))
+        self.assertEqual(goboard.parsed_to_model_coordinates("ss"), (19, 19))
+        self.assertEqual(goboard.parsed_to_model_coordinates("", 9),
+                         (None, None))
+        self.assertEqual(goboard.parsed_to_model_coordinates("gc", (7, 3)),
+                         (3, 7))
+        for coords in ("ss", "ja", "aj", "a", "a1"):
+            self.assertRaises(sgfparser.FileFormatError,
+                              goboard.parsed_to_model_coordinates, coords, 9)
+        self.assertRaises(sgfparser.FileFormatError,
+                          goboard.parsed_to_model_coordinates, "ad", (7, 3))
+        self.assertRaises(sgfparser.FileFormatError,
+                          goboard.parsed_label_model_coordinates, "jj:A", 9)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+### test_sgfcache.py tests sgfcache.py.
+###
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+import sgfcache
+import sgfparser
+
+
+
+class ParseCacheTests (unittest.TestCase):
+
+    text = "(;GM[1]SZ[19]C[caf\xc3\xa9];B[aa](;W[bb];B[cc])(;W[cc]))"
+    other_text = "(;GM[1]SZ[19];B[dd];W[ee])"
+
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = sgfcache.ParseCache(os.path.join(self.dir, "cache"))
+        ## parses counts the calls to sgfparser.parse_file, so tests can tell
+        ## cache hits from misses.
+        self.parses = 0
+        self.parse_file = sgfparser.parse_file
+        def counting_parse_file (*args):
+            self.parses += 1
+            return self.parse_file(*args)
+        sgfparser.parse_file = counting_parse_file
+
+    def tearDown (self):
+        sgfparser.parse_file = self.parse_file
+        shutil.rmtree(self.dir)
+
+    def write_file (self, name, text):
+        f = open(name, "wb")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    ### write_zip writes an archive holding members with the texts in members,
+    ### which is a list of (member name, text) pairs.
+    ###
+    def write_zip (self, name, members):
+        z = zipfile.ZipFile(name, "w")
+        try:
+            for m, text in members:
+                z.writestr(m, text)
+        finally:
+            z.close()
+
+    ### set_mtime moves the named file's mtime back by seconds, so that a
+    ### rewrite right after it always looks changed.
+    ###
+    def set_mtime (self, name, seconds):
+        t = time.time() - seconds
+        os.utime(name, (t, t))
+
+    def check_parse (self, name, text, parses):
+        g = self.cache.parse_file(name)
+        expected = sgfparser.parse_game(sgfparser.Lexer(text, True))
+        self.assertEqual(str(g), str(expected))
+        self.assertEqual(self.parses, parses)
+
+    def test_file (self):
+        name = os.path.join(self.dir, "game.sgf")
+        self.write_file(name, self.text)
+        self.set_mtime(name, 100)
+        self.check_parse(name, self.text, 1)
+        self.check_parse(name, self.text, 1)
+        ## Same contents with a new mtime is still a hit.
+        self.set_mtime(name, 50)
+        self.check_parse(name, self.text, 1)
+        self.write_file(name, self.other_text)
+        self.check_parse(name, self.other_text, 2)
+
+    def test_zip_member (self):
+        archive = os.path.join(self.dir, "games.zip")
+        self.write_zip(archive, [("a.sgf", self.text), ("b.sgf", self.text)])
+        self.set_mtime(archive, 100)
+        for name in (os.path.join(archive, "a.sgf"), archive + "\\b.sgf"):
+            self.check_parse(name, self.text, 1)
+            self.check_parse(name, self.text, 1)
+            self.parses = 0
+        ## Changing another member leaves a.sgf's entry good.
+        self.write_zip(archive, [("a.sgf", self.text),
+                                 ("b.sgf", self.other_text)])
+        self.check_parse(os.path.join(archive, "a.sgf"), self.text, 0)
+        self.check_parse(os.path.join(archive, "b.sgf"), self.other_text, 1)
+
+    def test_missing_member (self):
+        archive = os.path.join(self.dir, "games.zip")
+        self.write_zip(archive, [("a.sgf", self.text)])
+        self.assertRaises(KeyError, self.cache.parse_file,
+                          os.path.join(archive, "c.sgf"))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+### test_sgfcorpus.py tests sgfcorpus.py.
+###
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sgfcorpus
+import sgfparser
+
+
+
+class CorpusTests (unittest.TestCase):
+
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.names = []
+        for i in xrange(20):
+            text = "(;GM[1]SZ[19]GN[game %d]C[caf\xc3\xa9];B[aa]C[%s]" % (i, "x" * 100)
+            if i % 5 == 0:
+                ## Broken game, ending inside a node.
+                text += ";W[bb"
+            else:
+                text += "(;W[bb];B[cc])(;W[cc]))"
+            name = os.path.join(self.dir, "g%02d.sgf" % (i))
+            f = open(name, "wb")
+            try:
+                f.write(text)
+            finally:
+                f.close()
+            self.names.append(name)
+
+    def tearDown (self):
+        shutil.rmtree(self.dir)
+
+    ### check_results checks that results has one result for each file, with
+    ### the same game a parse in this process gets, or an error for the
+    ### broken games.
+    ###
+    def check_results (self, results, tolerant):
+        results = sorted(results, key = lambda r: r.name)
+        self.assertEqual([r.name for r in results], self.names)
+        for i, r in enumerate(results):
+            if i % 5 == 0 and not tolerant:
+                self.assertTrue(r.game is None)
+                self.assertTrue(r.error is not None)
+                self.assertTrue(r.location > 0)
+                continue
+            self.assertTrue(r.error is None)
+            g = sgfparser.parse_file(r.name, False, tolerant)
+            self.assertEqual(str(r.game), str(g))
+            self.assertEqual([str(d) for d in r.game.diagnostics],
+                             [str(d) for d in g.diagnostics])
+            self.assertEqual(r.game.nodes.properties["C"], (u"caf\xe9",))
+
+    def test_load_corpus (self):
+        self.check_results(sgfcorpus.load_corpus(self.dir, 3, 2), False)
+
+    def test_load_corpus_tolerant (self):
+        self.check_results(sgfcorpus.load_corpus(self.names, 2, 3, True, True),
+                           True)
+
+    def test_threads (self):
+        chunks = [self.names[i:i + 3] for i in xrange(0, len(self.names), 3)]
+        self.check_results(sgfcorpus._thread_results(chunks, 2, False, False),
+                           False)
+
+    def test_stop_early (self):
+        results = sgfcorpus.load_corpus(self.names, 2, 1)
+        r = results.next()
+        self.assertTrue(r.name in self.names)
+        results.close()
+
+    def test_no_files (self):
+        self.assertEqual(list(sgfcorpus.load_corpus([], 2)), [])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
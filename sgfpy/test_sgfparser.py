@@ -0,0 +1,160 @@
+### test_sgfparser.py tests sgfparser.py.  Run the tests from this directory
+### with "python -m unittest discover" (they need plain CPython 2 or
+### IronPython, but not WPF).
+###
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+import sgfparser
+
+
+
+class DeepTreeTests (unittest.TestCase):
+
+    ## depth is how many nested variations the deep game has.
+    depth = 100000
+
+    def setUp (self):
+        self.dir = tempfile.mkdtemp()
+        self.name = os.path.join(self.dir, "deep.sgf")
+        f = open(self.name, "wb")
+        try:
+            f.write("(;GM[1]SZ[19]" + "(;B[aa]C[deep]" * self.depth +
+                    ")" * self.depth + ")")
+        finally:
+            f.close()
+
+    def tearDown (self):
+        shutil.rmtree(self.dir)
+
+    ### check_game checks that g has depth nodes after the root, each one the
+    ### only branch of the node before it, and that writing g and parsing it
+    ### again gives the same text.
+    ###
+    def check_game (self, g):
+        n = g.nodes
+        self.assertEqual(n.properties["SZ"], ("19",))
+        count = 0
+        while n.next is not None:
+            self.assertEqual(n.branches, [n.next])
+            self.assertTrue(n.next.previous is n)
+            n = n.next
+            count += 1
+        self.assertEqual(count, self.depth)
+        self.assertEqual(n.properties["C"][0], "deep")
+        text = str(g)
+        f = StringIO()
+        g.write_to(f)
+        self.assertEqual(f.getvalue(), text)
+        again = sgfparser.parse_stream(StringIO(text))
+        self.assertEqual(str(again), text)
+
+    def test_eager (self):
+        self.check_game(sgfparser.parse_file(self.name))
+
+    def test_lazy (self):
+        self.check_game(sgfparser.parse_file(self.name, True))
+
+    def test_stream (self):
+        f = open(self.name, "rb")
+        try:
+            self.check_game(sgfparser.parse_stream(f))
+        finally:
+            f.close()
+
+    def test_tolerant (self):
+        g = sgfparser.parse_file(self.name, False, True)
+        self.assertEqual(g.diagnostics, [])
+        self.check_game(g)
+
+
+class LazyTests (unittest.TestCase):
+
+    long_comment = "a long comment, with \\] escapes and\nnewlines " * 4
+
+    text = ("(;GM[1]CA[UTF-8]C[" + long_comment + "]GN[caf\xc3\xa9]" +
+            ";B[aa]C[short \\] one]LB[bb:x][cc:y]" +
+            ";W[bb]C[" + long_comment + "]TR[aa][" + long_comment + "]" +
+            ";B[cc]C[\xc3\xa9t\xc3\xa9\n])")
+
+    def parse (self, lazy):
+        return sgfparser.parse_game(sgfparser.Lexer(self.text, True, lazy))
+
+    def test_same_values (self):
+        eager = self.parse(False).nodes
+        lazy = self.parse(True).nodes
+        while eager is not None:
+            self.assertEqual(sorted(eager.properties.keys()),
+                             sorted(lazy.properties.keys()))
+            for k, v in eager.properties.iteritems():
+                self.assertEqual(tuple(lazy.properties[k]), v)
+            eager = eager.next
+            lazy = lazy.next
+        self.assertTrue(lazy is None)
+
+    ### test_short_values_not_deferred checks that only properties with a
+    ### long value are left for later.
+    ###
+    def test_short_values_not_deferred (self):
+        n = self.parse(True).nodes
+        self.assertTrue(isinstance(n.properties["C"], sgfparser._LazyValues))
+        self.assertEqual(n.properties["GN"], (u"caf\xe9",))
+        n = n.next
+        self.assertEqual(n.properties["C"], ("short ] one",))
+        self.assertEqual(n.properties["LB"], ("bb:x", "cc:y"))
+        n = n.next
+        self.assertTrue(isinstance(n.properties["TR"], sgfparser._LazyValues))
+        self.assertEqual(n.properties["TR"][0], "aa")
+        n = n.next
+        self.assertEqual(n.properties["B"], ("cc",))
+        self.assertEqual(n.properties["C"], (u"\xe9t\xe9\n",))
+
+    def test_tolerant_eof_in_value (self):
+        text = "(;GM[1];B[aa]C[x];W[bb"
+        eager = sgfparser.parse_game(sgfparser.Lexer(text, True), True)
+        lazy = sgfparser.parse_game(sgfparser.Lexer(text, True, True), True)
+        self.assertEqual(str(lazy), str(eager))
+        self.assertEqual([str(d) for d in lazy.diagnostics],
+                         [str(d) for d in eager.diagnostics])
+
+
+class DoubleByteTests (unittest.TestCase):
+
+    ## so is a Shift_JIS char whose second byte is a backslash.
+    so = u"\u30bd".encode("shift_jis")
+
+    def test_index_games (self):
+        first = "(;CA[Shift_JIS]SZ[19]C[" + self.so + "](;B[aa])(;B[bb]))"
+        text = first + "\n(;GM[1];B[cc])"
+        self.assertEqual(sgfparser.index_games(text),
+                         [(0, len(first)), (len(first) + 1, len(text))])
+        c = sgfparser.GameCollection(text)
+        g = c.get_game(0)
+        self.assertEqual(g.nodes.properties["C"], (u"\u30bd",))
+        self.assertEqual(len(g.nodes.branches), 2)
+        self.assertEqual(c.get_game(1).nodes.next.properties["B"], ("cc",))
+
+    ### test_resync checks that tolerant parsing skips stray double byte
+    ### chars whose second byte is an open bracket.
+    ###
+    def test_resync (self):
+        text = "(;CA[Shift_JIS]SZ[19];B[aa]x\x83[;W[bb]C[" + self.so + "])"
+        for chunk_size in (None, 1, 3):
+            if chunk_size is None:
+                l = sgfparser.Lexer(text, True)
+            else:
+                l = sgfparser.StreamLexer(StringIO(text), chunk_size, True)
+            g = sgfparser.parse_game(l, True)
+            n = g.nodes.next.next
+            self.assertEqual(n.properties["W"], ("bb",))
+            self.assertEqual(n.properties["C"], (u"\u30bd",))
+            self.assertTrue(n.next is None)
+
+
+
+if __name__ == "__main__":
+    unittest.main()